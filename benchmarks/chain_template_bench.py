@@ -0,0 +1,109 @@
+"""
+Microbenchmark: compiled prompt templates vs the original str.replace scanning.
+
+Fills a 10-step chain where every prompt carries a 50 KB file_content block and
+references earlier (string and dict) outputs.
+
+    uv run python benchmarks/chain_template_bench.py
+"""
+
+import json
+import timeit
+from typing import Any, Dict, List
+
+from mermaid_agent.modules.prompt_template import compile_prompt
+
+FILE_CONTENT_BYTES = 50 * 1024
+CHAIN_LENGTH = 10
+REPEATS = 20
+
+
+def legacy_fill(prompt: str, context: Dict[str, Any], output: List[Any]) -> str:
+    # The MinimalChainable.run substitution loop prior to compiled templates
+    i = len(output)
+    for key, value in context.items():
+        if "{{" + key + "}}" in prompt:
+            prompt = prompt.replace("{{" + key + "}}", str(value))
+
+    for j in range(i, 0, -1):
+        previous_output = output[i - j]
+        if isinstance(previous_output, dict):
+            if f"{{{{output[-{j}]}}}}" in prompt:
+                prompt = prompt.replace(
+                    f"{{{{output[-{j}]}}}}", json.dumps(previous_output)
+                )
+            for key, value in previous_output.items():
+                if f"{{{{output[-{j}].{key}}}}}" in prompt:
+                    prompt = prompt.replace(f"{{{{output[-{j}].{key}}}}}", str(value))
+        else:
+            if f"{{{{output[-{j}]}}}}" in prompt:
+                prompt = prompt.replace(f"{{{{output[-{j}]}}}}", str(previous_output))
+    return prompt
+
+
+def compiled_fill(prompt: str, context: Dict[str, Any], output: List[Any]) -> str:
+    return compile_prompt(prompt).fill(context, output)
+
+
+def build_chain():
+    line = "flowchart node -> edge, label text for a large input file\n"
+    file_content = (line * (FILE_CONTENT_BYTES // len(line) + 1))[:FILE_CONTENT_BYTES]
+
+    context = {f"var{n}": f"value {n}" for n in range(20)}
+    context["file_content"] = file_content
+    context["user_prompt"] = "Flowchart of the setup instructions"
+
+    prompts = []
+    for step in range(CHAIN_LENGTH):
+        refs = " ".join(f"{{{{output[-{j}]}}}}" for j in range(1, min(step, 3) + 1))
+        prompts.append(
+            f"Step {step}: {{{{user_prompt}}}} {{{{var{step}}}}}\n"
+            f"<file-content>\n{{{{file_content}}}}\n</file-content>\n"
+            f"Previous: {refs} {{{{output[-1].nodes}}}}"
+        )
+
+    # Dict outputs with many keys exercise the per-key scanning of the old loop
+    outputs = [
+        {"nodes": f"A{step} --> B{step}", **{f"k{n}": n for n in range(50)}}
+        for step in range(CHAIN_LENGTH)
+    ]
+    return context, prompts, outputs
+
+
+def run_chain(fill, context, prompts, outputs):
+    for step, prompt in enumerate(prompts):
+        fill(prompt, context, outputs[:step])
+
+
+def main():
+    context, prompts, outputs = build_chain()
+
+    # Both implementations must produce identical prompts for this chain
+    for step, prompt in enumerate(prompts):
+        assert legacy_fill(prompt, context, outputs[:step]) == compiled_fill(
+            prompt, context, outputs[:step]
+        )
+
+    legacy = min(
+        timeit.repeat(
+            lambda: run_chain(legacy_fill, context, prompts, outputs),
+            number=1,
+            repeat=REPEATS,
+        )
+    )
+    compiled = min(
+        timeit.repeat(
+            lambda: run_chain(compiled_fill, context, prompts, outputs),
+            number=1,
+            repeat=REPEATS,
+        )
+    )
+
+    print(f"chain length: {CHAIN_LENGTH}, file_content: {FILE_CONTENT_BYTES} bytes")
+    print(f"legacy str.replace fill: {legacy * 1000:.3f} ms per chain")
+    print(f"compiled template fill:  {compiled * 1000:.3f} ms per chain")
+    print(f"speedup: {legacy / compiled:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Compare two benchmarks/suite.py JSON reports, e.g. from two commits.
+
+Prints the median time change for every benchmark present in both reports and
+exits non-zero if any slowed down by more than --threshold (default 10%).
+
+    uv run python benchmarks/compare.py baseline.json bench.json
+"""
+
+import argparse
+import json
+import sys
+from typing import Any, Dict, Tuple
+
+
+def result_key(result: Dict[str, Any]) -> Tuple[str, str]:
+    return result["benchmark"], json.dumps(result["params"], sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args()
+
+    with open(args.baseline) as infile:
+        baseline = json.load(infile)
+    with open(args.current) as infile:
+        current = json.load(infile)
+
+    baseline_results = {result_key(r): r for r in baseline["results"]}
+    print(f"baseline {baseline['commit']} -> current {current['commit']}")
+
+    regressions = 0
+    for result in current["results"]:
+        before = baseline_results.get(result_key(result))
+        if before is None:
+            continue
+        change = result["median_seconds"] / before["median_seconds"] - 1
+        flag = ""
+        if change > args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        params = ", ".join(f"{key}={value}" for key, value in result["params"].items())
+        print(
+            f"{result['benchmark']:<11} {params:<60} "
+            f"{before['median_seconds'] * 1000:10.2f} ms -> "
+            f"{result['median_seconds'] * 1000:10.2f} ms ({change:+.1%}){flag}"
+        )
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
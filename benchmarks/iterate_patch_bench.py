@@ -0,0 +1,68 @@
+"""
+Microbenchmark: iterate_mermaid_agent full-chart mode vs edit (patch) mode.
+
+For flowcharts of 100 to 1000 nodes, compares the chart text the LLM reads and
+writes per change request: full mode sends the chart to a draft and a review
+step and gets a full chart back from each, edit mode sends the compact chart
+once and gets a small patch back. Also times the local parse, apply_patch and
+serialize work edit mode adds.
+
+    uv run python benchmarks/iterate_patch_bench.py
+"""
+
+import timeit
+
+from mermaid_agent.modules import mermaid_graph
+from mermaid_agent.modules.typings import MermaidPatch
+
+SIZES = [100, 300, 1000]
+NUMBER = 20
+
+PATCH = MermaidPatch.model_validate(
+    {
+        "operations": [
+            {"op": "add_node", "id": "Retry", "label": "Retry the failed step"},
+            {"op": "add_edge", "source": "N5", "target": "Retry", "label": "fails"},
+            {"op": "rename_node", "id": "N7", "label": "Publish the release notes"},
+            {"op": "remove_node", "id": "N9"},
+        ]
+    }
+)
+
+
+def build_chart(nodes: int) -> str:
+    lines = ["flowchart TD"]
+    for i in range(nodes - 1):
+        lines.append(
+            f'    N{i}["Check step {i} output"] --> N{i + 1}["Check step {i + 1} output"]'
+        )
+    return "\n".join(lines)
+
+
+def time_per_call(fn) -> float:
+    return min(timeit.repeat(fn, number=NUMBER, repeat=3)) / NUMBER
+
+
+def main():
+    patch_chars = len(PATCH.model_dump_json(exclude_defaults=True))
+    print(
+        f"{'nodes':>6} {'full in/out':>16} {'patch in/out':>16} "
+        f"{'parse':>10} {'apply':>10} {'serialize':>10}"
+    )
+    for size in SIZES:
+        chart = build_chart(size)
+        graph = mermaid_graph.parse(chart)
+        compact = mermaid_graph.serialize(graph)
+
+        parse = time_per_call(lambda: mermaid_graph.parse(chart))
+        apply = time_per_call(lambda: mermaid_graph.apply_patch(graph, PATCH))
+        serialize = time_per_call(lambda: mermaid_graph.serialize(graph))
+        print(
+            f"{size:>6} {2 * len(chart):>7}/{2 * len(chart):<8} "
+            f"{len(compact):>7}/{patch_chars:<8} "
+            f"{parse * 1e3:>7.2f} ms {apply * 1e3:>7.2f} ms {serialize * 1e3:>7.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
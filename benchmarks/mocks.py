@@ -0,0 +1,122 @@
+"""
+Deterministic offline stand-ins for the benchmark suite: llm.Model-like mocks
+with configurable latency/jitter and a local fake mermaid.ink server.
+"""
+
+import base64
+import io
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterator, Union
+
+from PIL import Image
+
+VALID_CHART = 'graph LR\n    A["Start"] --> B["Build"]\n    B --> C["Ship"]'
+# Rejected by mermaid_validator (unquoted parentheses in a label)
+INVALID_CHART = "graph LR\n    A[Start (here)] --> B"
+
+
+class MockResponse:
+    """Mimics llm.Response: text() and iteration over streamed chunks."""
+
+    def __init__(self, text: str, chunk_size: int = 16):
+        self._text = text
+        self._chunk_size = chunk_size
+
+    def text(self) -> str:
+        return self._text
+
+    def __iter__(self):
+        for i in range(0, len(self._text), self._chunk_size):
+            yield self._text[i : i + self._chunk_size]
+
+
+class MockModel:
+    """
+    llm.Model stand-in that sleeps latency +/- jitter seconds per prompt.
+
+    response is either a fixed string or a function of the prompt text. Jitter
+    comes from a seeded RNG so runs are repeatable.
+    """
+
+    def __init__(
+        self,
+        model_id: str = "mock-model",
+        response: Union[str, Callable[[str], str]] = VALID_CHART,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        seed: int = 0,
+    ):
+        self.model_id = model_id
+        self.response = response
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def prompt(self, prompt: str, stream: bool = False, **options) -> MockResponse:
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        text = self.response(prompt) if callable(self.response) else self.response
+        return MockResponse(text)
+
+    def __str__(self):
+        return self.model_id
+
+
+def build_png_bytes(size=(8, 8)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, "black").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class FakeMermaidInkHandler(BaseHTTPRequestHandler):
+    # Local stand-in for mermaid.ink: every graph renders as a small PNG
+    latency = 0.0
+    png = build_png_bytes()
+    requests_seen = 0
+
+    def do_GET(self):
+        encoded = self.path.split("/img/", 1)[-1].split("?", 1)[0]
+        base64.b64decode(encoded)
+        FakeMermaidInkHandler.requests_seen += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(self.png)))
+        self.end_headers()
+        self.wfile.write(self.png)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def fake_mermaid_ink(latency: float = 0.0) -> Iterator[str]:
+    """Serve a fake mermaid.ink on localhost, yielding its base URL."""
+    FakeMermaidInkHandler.latency = latency
+    FakeMermaidInkHandler.requests_seen = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeMermaidInkHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def broken_until_fixed(prompt: str) -> str:
+    """Respond with a broken chart unless asked to fix one (resolution prompt)."""
+    if "<damaged-mermaid-chart>" in prompt:
+        return VALID_CHART
+    return INVALID_CHART
@@ -0,0 +1,53 @@
+"""
+Startup benchmark: per-call model construction vs the llm_module model registry.
+
+Before the registry every agent call ran build_model(), i.e. llm.get_model plus
+os.getenv. A bulk run of 20 diagrams with retries built the model 40+ times.
+
+    uv run python benchmarks/model_registry_bench.py [model_id]
+"""
+
+import os
+import sys
+import time
+
+import llm
+
+from mermaid_agent.modules import llm_module
+
+MODEL_ID = sys.argv[1] if len(sys.argv) > 1 else llm_module.DEFAULT_MODEL
+CALLS = 40
+
+
+def build_model_per_call():
+    # The pre-registry mermaid_agent.build_model -> build_latest_openai path
+    model = llm.get_model(MODEL_ID)
+    model.key = os.getenv("OPENAI_API_KEY")
+    return model
+
+
+def time_calls(build) -> float:
+    start = time.perf_counter()
+    for _ in range(CALLS):
+        build()
+    return time.perf_counter() - start
+
+
+def main():
+    # First-ever call pays import-time plugin loading either way
+    start = time.perf_counter()
+    llm_module.get_model(MODEL_ID)
+    first_call = time.perf_counter() - start
+
+    per_call = time_calls(build_model_per_call)
+    registry = time_calls(lambda: llm_module.get_model(MODEL_ID))
+
+    print(f"model: {MODEL_ID}, calls: {CALLS}")
+    print(f"first registry build:   {first_call * 1000:.3f} ms")
+    print(f"build per call:         {per_call / CALLS * 1000:.3f} ms per call")
+    print(f"registry get_model:     {registry / CALLS * 1000:.6f} ms per call")
+    print(f"total overhead saved:   {(per_call - registry) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
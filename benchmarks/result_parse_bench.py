@@ -0,0 +1,101 @@
+"""
+Microbenchmark: MinimalChainable result parsing for multi-KB responses.
+
+Compares the original regex-then-json.loads parse with the auto-detect fast
+path and declared per-step output formats, for Mermaid, prose and JSON
+responses of 2, 16 and 64 KB, then pydantic schema validation of a node list.
+
+    uv run python benchmarks/result_parse_bench.py
+"""
+
+import json
+import re
+import timeit
+from typing import List
+
+from pydantic import BaseModel
+
+from mermaid_agent.modules.chain import MinimalChainable
+
+SIZES = [2 * 1024, 16 * 1024, 64 * 1024]
+NUMBER = 200
+
+
+class Node(BaseModel):
+    id: str
+    label: str
+
+
+class Graph(BaseModel):
+    nodes: List[Node]
+
+
+def legacy_parse(result):
+    # The MinimalChainable._parse_result body prior to output formats
+    try:
+        json_match = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", result)
+        if json_match:
+            result = json.loads(json_match.group(1))
+        else:
+            result = json.loads(result)
+    except json.JSONDecodeError:
+        pass
+    return result
+
+
+def build_responses(size: int):
+    edges = []
+    while sum(len(edge) for edge in edges) < size:
+        n = len(edges)
+        edges.append(f'    N{n}["Node {n}"] --> N{n + 1}["Node {n + 1}"]\n')
+    mermaid = "graph LR\n" + "".join(edges)
+
+    sentence = "The chart groups the setup steps by owner and stage. "
+    prose = (sentence * (size // len(sentence) + 1))[:size]
+
+    nodes = []
+    while len(json.dumps({"nodes": nodes})) < size:
+        nodes.append({"id": f"N{len(nodes)}", "label": f"Node {len(nodes)}"})
+    data = json.dumps({"nodes": nodes})
+
+    return {
+        "mermaid": (mermaid, "mermaid"),
+        "prose": (prose, "text"),
+        "json": (data, "json"),
+        "fenced_json": (f"Here you go:\n```json\n{data}\n```", "json"),
+    }
+
+
+def time_per_call(fn) -> float:
+    return min(timeit.repeat(fn, number=NUMBER, repeat=5)) / NUMBER
+
+
+def main():
+    print(f"{'response':<12} {'size':>6} {'legacy':>12} {'auto':>12} {'declared':>12}")
+    for size in SIZES:
+        for name, (response, declared) in build_responses(size).items():
+            legacy = time_per_call(lambda: legacy_parse(response))
+            auto = time_per_call(lambda: MinimalChainable._parse_result(response))
+            declared_time = time_per_call(
+                lambda: MinimalChainable._parse_result(response, declared)
+            )
+            print(
+                f"{name:<12} {size // 1024:>4}KB "
+                f"{legacy * 1e6:>9.1f} us {auto * 1e6:>9.1f} us {declared_time * 1e6:>9.1f} us"
+            )
+
+    # Schema steps validate the JSON text once instead of json.loads then validate
+    print(f"\n{'schema':<12} {'size':>6} {'loads+validate':>16} {'validate_json':>14}")
+    for size in SIZES:
+        data, _ = build_responses(size)["json"]
+        twice = time_per_call(lambda: Graph.model_validate(legacy_parse(data)))
+        once = time_per_call(
+            lambda: MinimalChainable._parse_result(data, "json", 0, Graph)
+        )
+        print(
+            f"{'Graph':<12} {size // 1024:>4}KB {twice * 1e6:>13.1f} us {once * 1e6:>11.1f} us"
+        )
+
+
+if __name__ == "__main__":
+    main()
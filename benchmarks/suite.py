@@ -0,0 +1,309 @@
+"""
+Offline benchmark suite for the chain engine, rendering and agents.
+
+Uses mock models (benchmarks/mocks.py) with configurable latency and a local
+fake mermaid.ink, so it needs no network or API keys. Results are printed as a
+table and written as JSON for benchmarks/compare.py:
+
+    uv run python benchmarks/suite.py --output bench.json
+    uv run python benchmarks/suite.py --only chain --only fusion --quick
+    uv run python benchmarks/compare.py baseline.json bench.json
+
+Benchmarks:
+    chain       MinimalChainable.run vs prompt size and chain length (no latency)
+    fusion      FusionChain.run vs run_parallel as the model count grows
+    bulk        bulk_mermaid_agent wall time vs diagram count
+    resolution  one_shot_mermaid_agent with and without a resolution retry
+    render      mermaid.render_many vs one build_image at a time, 25% duplicates
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+from mocks import MockModel, VALID_CHART, broken_until_fixed, fake_mermaid_ink
+
+from mermaid_agent import mermaid_agent
+from mermaid_agent.modules import llm_module, mermaid
+from mermaid_agent.modules.chain import FusionChain, MinimalChainable
+from mermaid_agent.modules.typings import BulkMermaidParams, OneShotMermaidParams
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """Run fn repeat times with agent output silenced; return timing stats in seconds."""
+    timings = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+    return {
+        "median_seconds": statistics.median(timings),
+        "min_seconds": min(timings),
+        "max_seconds": max(timings),
+        "repeat": repeat,
+    }
+
+
+def record(benchmark: str, params: Dict[str, Any], stats: Dict[str, float]):
+    return {"benchmark": benchmark, "params": params, **stats}
+
+
+def identity_evaluator(outputs: List[Any]):
+    return outputs[0], [1.0 for _ in outputs]
+
+
+def bench_chain(quick: bool, llm_latency: float, render_latency: float):
+    model = MockModel(response='{"nodes": "A --> B", "edges": 1}')
+    prompt_sizes = [1024, 16 * 1024] if quick else [1024, 16 * 1024, 64 * 1024]
+    chain_lengths = [1, 4] if quick else [1, 4, 16]
+
+    results = []
+    for prompt_bytes in prompt_sizes:
+        for chain_length in chain_lengths:
+            context = {"file_content": "x" * prompt_bytes, "topic": "setup"}
+            prompts = ["Chart {{topic}}: {{file_content}}"] + [
+                "Refine {{output[-1].nodes}} using {{file_content}}"
+            ] * (chain_length - 1)
+            runs = 20 if quick else 100
+
+            def run_chains():
+                for _ in range(runs):
+                    MinimalChainable.run(context, model, llm_module.prompt, prompts)
+
+            stats = measure(run_chains, repeat=3)
+            stats["chains_per_second"] = runs / stats["median_seconds"]
+            results.append(
+                record(
+                    "chain",
+                    {"prompt_bytes": prompt_bytes, "chain_length": chain_length},
+                    stats,
+                )
+            )
+    return results
+
+
+def bench_fusion(quick: bool, llm_latency: float, render_latency: float):
+    prompts = ["Chart {{topic}}", "Review {{output[-1]}}"]
+    model_counts = [1, 2, 4] if quick else [1, 2, 4, 8]
+
+    results = []
+    for model_count in model_counts:
+        models = [
+            MockModel(f"mock-{i}", latency=llm_latency, jitter=llm_latency / 5, seed=i)
+            for i in range(model_count)
+        ]
+        for method in ("run", "run_parallel"):
+            run = getattr(FusionChain, method)
+            stats = measure(
+                lambda: run(
+                    {"topic": "setup"},
+                    models,
+                    llm_module.prompt,
+                    prompts,
+                    identity_evaluator,
+                    llm_module.get_model_name,
+                ),
+                repeat=3,
+            )
+            results.append(
+                record(
+                    "fusion",
+                    {
+                        "method": method,
+                        "models": model_count,
+                        "llm_latency": llm_latency,
+                    },
+                    stats,
+                )
+            )
+    return results
+
+
+def register_mock_model(model: MockModel):
+    # Agents resolve models by id through the llm_module registry
+    llm_module._models[model.model_id] = model
+
+
+def bench_bulk(quick: bool, llm_latency: float, render_latency: float):
+    counts = [1, 4, 16] if quick else [1, 4, 16, 64]
+    register_mock_model(
+        MockModel("mock-bulk", latency=llm_latency, jitter=llm_latency / 5)
+    )
+
+    results = []
+    for count in counts:
+        params = BulkMermaidParams(
+            prompt="Flowchart of the setup",
+            output_file="bulk.png",
+            count=count,
+            concurrency=4,
+            model="mock-bulk",
+        )
+        stats = measure(lambda: mermaid_agent.bulk_mermaid_agent(params), repeat=3)
+        stats["diagrams_per_second"] = count / stats["median_seconds"]
+        results.append(
+            record(
+                "bulk",
+                {
+                    "count": count,
+                    "concurrency": 4,
+                    "llm_latency": llm_latency,
+                    "render_latency": render_latency,
+                },
+                stats,
+            )
+        )
+    return results
+
+
+def bench_resolution(quick: bool, llm_latency: float, render_latency: float):
+    register_mock_model(MockModel("mock-valid", VALID_CHART, latency=llm_latency))
+    register_mock_model(
+        MockModel("mock-broken", broken_until_fixed, latency=llm_latency)
+    )
+
+    results = []
+    for model_id, resolutions in (("mock-valid", 0), ("mock-broken", 1)):
+        params = OneShotMermaidParams(
+            prompt="Flowchart of the setup",
+            output_file="resolution.png",
+            model=model_id,
+        )
+        stats = measure(
+            lambda: mermaid_agent.one_shot_mermaid_agent(params),
+            repeat=3 if quick else 5,
+        )
+        results.append(
+            record(
+                "resolution",
+                {
+                    "resolutions": resolutions,
+                    "llm_latency": llm_latency,
+                    "render_latency": render_latency,
+                },
+                stats,
+            )
+        )
+    return results
+
+
+def bench_render(quick: bool, llm_latency: float, render_latency: float):
+    counts = [4, 16] if quick else [4, 16, 64]
+
+    results = []
+    for count in counts:
+        # Every fourth source repeats the one before it
+        sources = [
+            f'graph LR\n    A["Step {n - n % 4 // 3}"] --> B' for n in range(count)
+        ]
+        params = {"count": count, "render_latency": render_latency}
+        for mode, render in (
+            (
+                "sequential",
+                lambda: [mermaid.build_image(graph, "bench.png") for graph in sources],
+            ),
+            ("render_many", lambda: mermaid.render_many(sources)),
+        ):
+            stats = measure(render, repeat=3)
+            stats["diagrams_per_second"] = count / stats["median_seconds"]
+            results.append(record("render", {"mode": mode, **params}, stats))
+    return results
+
+
+BENCHMARKS = {
+    "chain": bench_chain,
+    "fusion": bench_fusion,
+    "bulk": bench_bulk,
+    "resolution": bench_resolution,
+    "render": bench_render,
+}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_table(results: List[Dict[str, Any]]):
+    for result in results:
+        params = ", ".join(f"{key}={value}" for key, value in result["params"].items())
+        print(
+            f"{result['benchmark']:<11} {params:<60} {result['median_seconds'] * 1000:10.2f} ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--only", action="append", choices=sorted(BENCHMARKS), help="repeatable"
+    )
+    parser.add_argument("--output", help="write JSON results to this path")
+    parser.add_argument("--quick", action="store_true", help="smaller grids")
+    parser.add_argument(
+        "--llm-latency", type=float, default=0.05, help="mock LLM seconds per call"
+    )
+    parser.add_argument(
+        "--render-latency", type=float, default=0.01, help="fake mermaid.ink seconds"
+    )
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+
+    # Exercise the real render path without caches or artifact files; rendered
+    # images land in a scratch directory
+    os.environ["MERMAID_RENDER_CACHE"] = "0"
+    os.environ["MERMAID_ARTIFACTS"] = "off"
+    cwd = os.getcwd()
+    results = []
+    with tempfile.TemporaryDirectory(prefix="mermaid_agent_bench_") as workdir:
+        os.chdir(workdir)
+        try:
+            with fake_mermaid_ink(args.render_latency) as base_url:
+                mermaid.set_renderer(mermaid.MermaidInkRenderer(base_url=base_url))
+                for name in args.only or BENCHMARKS:
+                    results.extend(
+                        BENCHMARKS[name](
+                            args.quick, args.llm_latency, args.render_latency
+                        )
+                    )
+        finally:
+            os.chdir(cwd)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "quick": args.quick,
+        "results": results,
+    }
+    print_table(results)
+    if output:
+        with open(output, "w") as outfile:
+            json.dump(report, outfile, indent=2)
+        print(f"Wrote {len(results)} results to {output}")
+    else:
+        print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,11 @@
-from mermaid_agent import mermaid_agent
-from mermaid_agent.modules import llm_module
-from mermaid_agent.modules import mermaid
-from mermaid_agent.modules import chain
-from mermaid_agent.modules.typings import (
-    OneShotMermaidParams,
-    IterateMermaidParams,
-    MermaidAgentResponse,
-    BulkMermaidParams,
-    BulkMermaidAgentResponse,
-)
-
 import os
 import typer
-from jinja2 import Template
-from PIL import Image
+from typing import Dict, List
 from mermaid_agent.modules.utils import build_file_path, current_date_time_str
 
+# Agents, llm, PIL and the renderer are imported inside the commands that use
+# them, so --help and other cheap invocations skip their import cost
+
 app = typer.Typer()
 
 # Constants for reusable options
@@ -28,6 +18,163 @@ OUTPUT_FILE_OPTION = typer.Option(
 INPUT_FILE_OPTION = typer.Option(
     None, "--input", "-i", help="Input file containing additional content"
 )
+CACHE_OPTION = typer.Option(
+    False,
+    "--cache/--no-cache",
+    envvar="LLM_RESPONSE_CACHE",
+    help="Reuse cached LLM responses for identical prompts (mer-iter change requests always bypass the cache)",
+)
+STREAM_OPTION = typer.Option(
+    False,
+    "--stream/--no-stream",
+    help="Stream LLM responses and report time to first token for each prompt step",
+)
+MODEL_OPTION = typer.Option(
+    None,
+    "--model",
+    "-m",
+    help="LLM model id to use, e.g. gpt-4o-mini or claude-3.5-sonnet (default: $MERMAID_AGENT_MODEL or gpt-4o-2024-08-06)",
+)
+
+FORMAT_OPTION = typer.Option(
+    None,
+    "--format",
+    "-f",
+    help="Render format: png, svg or pdf (default: from the output file's extension, else png). svg and pdf are written as the renderer's vector output",
+)
+WIDTH_OPTION = typer.Option(
+    None, "--width", help="Render width in pixels (default 500)"
+)
+HEIGHT_OPTION = typer.Option(
+    None, "--height", help="Render height in pixels (default 500)"
+)
+SCALE_OPTION = typer.Option(
+    None, "--scale", help="Render scale factor for png (default 2)"
+)
+THEME_OPTION = typer.Option(
+    None,
+    "--theme",
+    help="Mermaid theme: default, neutral, dark, forest or base (default dark)",
+)
+BACKGROUND_OPTION = typer.Option(
+    None,
+    "--background",
+    help="Background color as hex, e.g. ffffff (default 2a303c)",
+)
+
+RETRIES_OPTION = typer.Option(
+    2,
+    "--retries",
+    help="Rounds of fixes when a chart fails to render; each round fixes the previous round's chart",
+)
+FANOUT_OPTION = typer.Option(
+    1,
+    "--fanout",
+    help="Fix attempts run concurrently per round; the first that renders wins",
+)
+RESOLUTION_DEADLINE_OPTION = typer.Option(
+    None,
+    "--resolution-deadline",
+    help="Seconds all fix rounds together may take (default: no limit)",
+)
+RESOLUTION_MODEL_OPTION = typer.Option(
+    [],
+    "--resolution-model",
+    help="Model id for fix attempts, repeatable; cycled over a round's attempts (default: --model)",
+)
+TEMPERATURE_OPTION = typer.Option(
+    [],
+    "--temperature",
+    help="Temperature for fix attempts, repeatable; cycled over a round's attempts",
+)
+TIMEOUT_OPTION = typer.Option(
+    None,
+    "--timeout",
+    help="Seconds a request may take, LLM calls, review, fixes and renders included; the review and further fixes are skipped when time is short (default: no limit)",
+)
+
+
+def build_resolution_options(retries, fanout, deadline, models, temperatures):
+    from mermaid_agent.modules.typings import ResolutionOptions
+
+    return ResolutionOptions(
+        attempts=retries,
+        fanout=fanout,
+        deadline=deadline,
+        models=models,
+        temperatures=temperatures,
+    )
+
+
+def parse_rate_limits(limits: List[str]) -> Dict[str, float]:
+    """--rate-limit values, PROVIDER=REQUESTS_PER_MINUTE, as a dict."""
+    rate_limits = {}
+    for limit in limits:
+        provider, _, requests_per_minute = limit.rpartition("=")
+        try:
+            rate = float(requests_per_minute)
+        except ValueError:
+            rate = None
+        if not provider or rate is None or rate <= 0:
+            raise typer.BadParameter(
+                f"expected PROVIDER=REQUESTS_PER_MINUTE with a positive rate, got {limit!r}",
+                param_hint="--rate-limit",
+            )
+        rate_limits[provider] = rate
+    return rate_limits
+
+
+def build_render_options(format, width, height, scale, theme, background):
+    """RenderOptions from the CLI's render flags; unset flags keep their defaults."""
+    from mermaid_agent.modules.typings import RenderOptions
+
+    options = {
+        "format": format,
+        "width": width,
+        "height": height,
+        "scale": scale,
+        "theme": theme,
+        "bg_color": background.lstrip("#") if background else None,
+    }
+    return RenderOptions(
+        **{name: value for name, value in options.items() if value is not None}
+    )
+
+
+def get_agent():
+    """The daemon client while a daemon is running, else the in-process agents."""
+    from mermaid_agent.modules import daemon
+
+    client = daemon.connect()
+    if client is not None:
+        return client
+    from mermaid_agent import mermaid_agent
+
+    return mermaid_agent
+
+
+def profile_startup_callback(value: bool):
+    if value:
+        from mermaid_agent.modules import startup
+
+        print(startup.startup_report())
+        raise typer.Exit()
+
+
+@app.callback()
+def cli(
+    profile_startup: bool = typer.Option(
+        False,
+        "--profile-startup",
+        is_eager=True,
+        callback=profile_startup_callback,
+        help="Print an import-time report for CLI startup and exit",
+    ),
+):
+    """Generates Mermaid charts with LLM agents."""
+    from mermaid_agent.modules import llm_module
+
+    llm_module.load_env()
 
 
 @app.command()
@@ -35,12 +182,47 @@ def mer(
     prompt: str = PROMPT_OPTION,
     output_file: str = OUTPUT_FILE_OPTION,
     input_file: str = INPUT_FILE_OPTION,
-) -> MermaidAgentResponse:
+    model: str = MODEL_OPTION,
+    cache: bool = CACHE_OPTION,
+    stream: bool = STREAM_OPTION,
+    render_format: str = FORMAT_OPTION,
+    width: int = WIDTH_OPTION,
+    height: int = HEIGHT_OPTION,
+    scale: int = SCALE_OPTION,
+    theme: str = THEME_OPTION,
+    background: str = BACKGROUND_OPTION,
+    retries: int = RETRIES_OPTION,
+    fanout: int = FANOUT_OPTION,
+    resolution_deadline: float = RESOLUTION_DEADLINE_OPTION,
+    resolution_model: List[str] = RESOLUTION_MODEL_OPTION,
+    temperature: List[float] = TEMPERATURE_OPTION,
+    timeout: float = TIMEOUT_OPTION,
+):
     """Generates a Mermaid chart in one shot."""
+    from mermaid_agent.modules import mermaid
+    from mermaid_agent.modules.typings import (
+        MermaidAgentResponse,
+        OneShotMermaidParams,
+    )
+
     params = OneShotMermaidParams(
-        prompt=prompt, output_file=output_file, input_file=input_file
+        prompt=prompt,
+        output_file=output_file,
+        input_file=input_file,
+        model=model,
+        cache=cache,
+        stream=stream,
+        render_options=build_render_options(
+            render_format, width, height, scale, theme, background
+        ),
+        resolution=build_resolution_options(
+            retries, fanout, resolution_deadline, resolution_model, temperature
+        ),
+        timeout=timeout,
     )
-    response: MermaidAgentResponse = mermaid_agent.one_shot_mermaid_agent(params)
+    response: MermaidAgentResponse = get_agent().one_shot_mermaid_agent(params)
+    if response.timed_out:
+        print(f"Timed out: {response.error}")
     if response.img:
         mermaid.show_image(response.img)
     return response
@@ -51,10 +233,49 @@ def mer_iter(
     prompt: str = PROMPT_OPTION,
     output_file: str = OUTPUT_FILE_OPTION,
     input_file: str = INPUT_FILE_OPTION,
-) -> MermaidAgentResponse:
+    model: str = MODEL_OPTION,
+    cache: bool = CACHE_OPTION,
+    stream: bool = STREAM_OPTION,
+    render_format: str = FORMAT_OPTION,
+    width: int = WIDTH_OPTION,
+    height: int = HEIGHT_OPTION,
+    scale: int = SCALE_OPTION,
+    theme: str = THEME_OPTION,
+    background: str = BACKGROUND_OPTION,
+    retries: int = RETRIES_OPTION,
+    fanout: int = FANOUT_OPTION,
+    resolution_deadline: float = RESOLUTION_DEADLINE_OPTION,
+    resolution_model: List[str] = RESOLUTION_MODEL_OPTION,
+    temperature: List[float] = TEMPERATURE_OPTION,
+    timeout: float = TIMEOUT_OPTION,
+    patch: bool = typer.Option(
+        False,
+        "--patch/--no-patch",
+        help="Ask for edit operations on the parsed flowchart instead of a full chart per change (other diagram types regenerate the full chart)",
+    ),
+):
     """Generates a Mermaid chart iteratively, allowing for user refinement."""
+    from mermaid_agent.modules import mermaid
+    from mermaid_agent.modules.typings import (
+        IterateMermaidParams,
+        MermaidAgentResponse,
+        OneShotMermaidParams,
+    )
+
     params = OneShotMermaidParams(
-        prompt=prompt, output_file=output_file, input_file=input_file
+        prompt=prompt,
+        output_file=output_file,
+        input_file=input_file,
+        model=model,
+        cache=cache,
+        stream=stream,
+        render_options=build_render_options(
+            render_format, width, height, scale, theme, background
+        ),
+        resolution=build_resolution_options(
+            retries, fanout, resolution_deadline, resolution_model, temperature
+        ),
+        timeout=timeout,
     )
 
     if not params.prompt.strip():
@@ -64,11 +285,12 @@ def mer_iter(
     print(f"Output file: {params.output_file}")
     print(f"Input file: {params.input_file}")
 
-    response: MermaidAgentResponse = mermaid_agent.one_shot_mermaid_agent(params)
+    agent = get_agent()
+    response: MermaidAgentResponse = agent.one_shot_mermaid_agent(params)
     if response.img:
         mermaid.show_image(response.img)
     else:
-        raise Exception("Failed to generate Mermaid chart")
+        raise Exception(f"Failed to generate Mermaid chart: {response.error}")
 
     print(f"BUILT one shot mermaid chart: {response}")
 
@@ -79,7 +301,7 @@ def mer_iter(
     # Save the initial chart
     iteration_count = 0
     initial_output_file = os.path.join(
-        session_dir, f"iteration_{iteration_count}_{output_file}"
+        session_dir, f"iteration_{iteration_count}_{params.output_file}"
     )
     response.img.save(initial_output_file)
 
@@ -88,8 +310,12 @@ def mer_iter(
         base_prompt=prompt,
         current_mermaid_chart=response.mermaid,
         current_mermaid_img=response.img,
-        output_file=output_file,
+        output_file=params.output_file,
+        render_options=params.render_options,
         input_file=input_file,
+        model=model,
+        edit_mode=patch,
+        timeout=timeout,
     )
 
     while True:
@@ -101,7 +327,11 @@ def mer_iter(
 
         iterate_params.change_prompt = user_input
 
-        response = mermaid_agent.iterate_mermaid_agent(iterate_params)
+        response = agent.iterate_mermaid_agent(iterate_params)
+        if response.timed_out:
+            # Keep the current chart; the change can be requested again
+            print(f"Timed out: {response.error}")
+            continue
         iterate_params.current_mermaid_chart = response.mermaid
         if response.img:
             iterate_params.current_mermaid_img = response.img
@@ -109,7 +339,7 @@ def mer_iter(
 
             iteration_count += 1
             iteration_output_file = os.path.join(
-                session_dir, f"iteration_{iteration_count}_{output_file}"
+                session_dir, f"iteration_{iteration_count}_{params.output_file}"
             )
             response.img.save(iteration_output_file)
 
@@ -121,20 +351,159 @@ def mer_bulk(
     prompt: str = PROMPT_OPTION,
     output_file: str = OUTPUT_FILE_OPTION,
     input_file: str = INPUT_FILE_OPTION,
-    count: int = typer.Option(5, "--count", "-c", help="Number of diagrams to generate"),
-) -> BulkMermaidAgentResponse:
+    model: str = MODEL_OPTION,
+    render_format: str = FORMAT_OPTION,
+    width: int = WIDTH_OPTION,
+    height: int = HEIGHT_OPTION,
+    scale: int = SCALE_OPTION,
+    theme: str = THEME_OPTION,
+    background: str = BACKGROUND_OPTION,
+    retries: int = RETRIES_OPTION,
+    fanout: int = FANOUT_OPTION,
+    resolution_deadline: float = RESOLUTION_DEADLINE_OPTION,
+    resolution_model: List[str] = RESOLUTION_MODEL_OPTION,
+    temperature: List[float] = TEMPERATURE_OPTION,
+    timeout: float = TIMEOUT_OPTION,
+    count: int = typer.Option(
+        5, "--count", "-c", help="Number of diagrams to generate"
+    ),
+    concurrency: int = typer.Option(
+        4, "--concurrency", "-j", help="Number of diagrams to generate in parallel"
+    ),
+    rate_limit: List[str] = typer.Option(
+        [],
+        "--rate-limit",
+        help="Per-provider limit as PROVIDER=REQUESTS_PER_MINUTE (model id or mermaid.ink), repeatable",
+    ),
+):
     """Generates multiple Mermaid charts in one shot."""
+    from mermaid_agent.modules import mermaid
+    from mermaid_agent.modules.typings import (
+        BulkMermaidAgentResponse,
+        BulkMermaidParams,
+        MermaidAgentResponse,
+    )
+
+    rate_limits = parse_rate_limits(rate_limit)
+
     params = BulkMermaidParams(
-        prompt=prompt, output_file=output_file, input_file=input_file, count=count
+        prompt=prompt,
+        output_file=output_file,
+        input_file=input_file,
+        count=count,
+        concurrency=concurrency,
+        rate_limits=rate_limits,
+        model=model,
+        render_options=build_render_options(
+            render_format, width, height, scale, theme, background
+        ),
+        resolution=build_resolution_options(
+            retries, fanout, resolution_deadline, resolution_model, temperature
+        ),
+        timeout=timeout,
     )
-    response: BulkMermaidAgentResponse = mermaid_agent.bulk_mermaid_agent(params)
-    for i, res in enumerate(response.responses):
+
+    completed = 0
+
+    def on_complete(index: int, res: MermaidAgentResponse):
+        nonlocal completed
+        completed += 1
+        status = "Generated" if res.img else "Timed out" if res.timed_out else "Failed"
+        print(f"{status} diagram {index+1} ({completed}/{count} complete)")
+
+    response: BulkMermaidAgentResponse = get_agent().bulk_mermaid_agent(
+        params, on_complete
+    )
+    for res in response.responses:
         if res.img:
             mermaid.show_image(res.img)
-            print(f"Generated diagram {i+1}/{count}")
     return response
 
 
+@app.command("render")
+def render_directory(
+    directory: str = typer.Argument(
+        ..., help="Directory searched recursively for .mmd files"
+    ),
+    output_dir: str = typer.Option(
+        None,
+        "--output-dir",
+        "-o",
+        help="Write images here, mirroring the source tree (default: next to each .mmd file)",
+    ),
+    concurrency: int = typer.Option(
+        None,
+        "--concurrency",
+        "-j",
+        help="Renders in flight at once (default: what the renderer supports)",
+    ),
+    render_format: str = FORMAT_OPTION,
+    width: int = WIDTH_OPTION,
+    height: int = HEIGHT_OPTION,
+    scale: int = SCALE_OPTION,
+    theme: str = THEME_OPTION,
+    background: str = BACKGROUND_OPTION,
+):
+    """Re-renders every .mmd file under a directory, without any LLM calls."""
+    import glob
+    from mermaid_agent.modules import mermaid
+
+    options = build_render_options(
+        render_format, width, height, scale, theme, background
+    ).for_file("")
+    sources = sorted(glob.glob(os.path.join(directory, "**", "*.mmd"), recursive=True))
+    if not sources:
+        print(f"No .mmd files under {directory}")
+        raise typer.Exit(1)
+
+    graphs = []
+    for source in sources:
+        with open(source, "r") as infile:
+            graphs.append(infile.read())
+    response = mermaid.render_many(graphs, options, concurrency)
+
+    failed = 0
+    for source, result in zip(sources, response.results):
+        if result.img is None:
+            failed += 1
+            print(f"Failed {source}: {result.error}")
+            continue
+        output_file = f"{os.path.splitext(source)[0]}.{options.format}"
+        if output_dir:
+            output_file = os.path.join(
+                output_dir, os.path.relpath(output_file, directory)
+            )
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        result.img.save(output_file)
+        print(f"Wrote {output_file} ({result.seconds:.3f}s)")
+
+    duplicates = sum(result.duplicate for result in response.results)
+    print(
+        f"Rendered {len(sources) - failed}/{len(sources)} diagrams "
+        f"({duplicates} duplicates) in {response.seconds:.2f}s"
+    )
+    if failed:
+        raise typer.Exit(1)
+
+
+@app.command("daemon")
+def run_daemon(
+    host: str = typer.Option(
+        None, "--host", help="Bind address (default: from $MERMAID_DAEMON_URL)"
+    ),
+    port: int = typer.Option(
+        None, "--port", help="Port (default: from $MERMAID_DAEMON_URL, 8765)"
+    ),
+    model: List[str] = typer.Option(
+        [], "--model", "-m", help="Model id to build at startup, repeatable"
+    ),
+):
+    """Serves mer, mer-bulk and mer-iter with warm models; the other commands use it while it runs."""
+    from mermaid_agent.modules import daemon
+
+    daemon.serve(host, port, model)
+
+
 def main():
     """Entry point for the Mermaid agent CLI."""
     app()
@@ -1,7 +1,14 @@
-from typing import Optional
-from mermaid_agent.modules import llm_module, utils
-from mermaid_agent.modules import mermaid
+import concurrent.futures
+import functools
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from mermaid_agent.modules import artifacts, deadlines, llm_module, rate_limit, tracing
+from mermaid_agent.modules import mermaid, mermaid_graph, mermaid_validator
 from mermaid_agent.modules import chain
+from mermaid_agent.modules.deadlines import DeadlineExceeded
+from mermaid_agent.modules.utils import build_file_path
 from mermaid_agent.modules.typings import (
     OneShotMermaidParams,
     ResolutionMermaidParams,
@@ -9,20 +16,104 @@ from mermaid_agent.modules.typings import (
     MermaidAgentResponse,
     BulkMermaidParams,
     BulkMermaidAgentResponse,
+    MermaidPatch,
+    RenderedImage,
+    RenderOptions,
 )
-from PIL import Image
 
+# Library callers get the .env settings (model, renderer, caches) before any agent runs
+llm_module.load_env()
 
-def build_model():
-    # see llm_module.py for model options
-    # return llm_module.build_sonnet_3_5()
-    return llm_module.build_latest_openai()
-    # return llm_module.build_mini_model()
 
+def build_model(model_id: Optional[str] = None):
+    # see llm_module.py for model options, e.g. "claude-3.5-sonnet" or "gpt-4o-mini"
+    # models are built once per process and shared between agent calls
+    return llm_module.get_model(
+        model_id or os.getenv("MERMAID_AGENT_MODEL", llm_module.DEFAULT_MODEL)
+    )
+
+
+def validate_and_render(
+    res: str, output_file: str, render_options: Optional[RenderOptions] = None
+) -> Tuple[Optional[str], Optional[RenderedImage]]:
+    """
+    Render res and save it to output_file. mermaid.render_image validates
+    locally first, so syntax errors skip the render round-trip and the
+    resolution agent gets the precise error. Returns (error, img); error is the
+    validation or render error when img is None.
+    """
+    try:
+        img = mermaid.render_image(res, render_options or RenderOptions(), output_file)
+    except mermaid.InvalidMermaidError as e:
+        print(f"Error: Invalid Mermaid diagram '{output_file}':\n{e}")
+        return str(e), None
+    except mermaid.MermaidRenderError as e:
+        print(f"Error: Unable to render the image '{output_file}': {e}")
+        return str(e), None
+    mermaid.save_image_locally(img, build_file_path(output_file))
+    return None, img
+
+
+def stream_monitor(
+    final_step: int, on_block: Callable[[str], None]
+) -> Callable[[int, str], None]:
+    """
+    Build an on_chunk callback for MinimalChainable.run that prints the time to
+    first token of each prompt step and passes the final step's Mermaid block to
+    on_block as soon as its closing backticks arrive.
+    """
+    step_started = time.perf_counter()
+    last_chunk_at = step_started
+    current_step = -1
+    extractor = llm_module.MermaidStreamExtractor()
+
+    def on_chunk(step: int, chunk: str):
+        nonlocal step_started, last_chunk_at, current_step
+        now = time.perf_counter()
+        if step != current_step:
+            # A step's prompt is issued right after the previous step's last chunk
+            if current_step != -1:
+                step_started = last_chunk_at
+            current_step = step
+            print(
+                f"Time to first token (step {step + 1}): {now - step_started:.2f} seconds"
+            )
+        last_chunk_at = now
+
+        if step == final_step:
+            block = extractor.feed(chunk)
+            if block is not None:
+                on_block(block)
+
+    return on_chunk
+
+
+def with_timeout(agent: Callable) -> Callable:
+    """
+    Run agent(params) within params.timeout seconds, and within any deadline
+    already current. A request that runs out of time, or is cancelled, returns
+    a response with timed_out set instead of raising DeadlineExceeded.
+    """
+
+    @functools.wraps(agent)
+    def run(params):
+        with deadlines.start(params.timeout):
+            try:
+                return agent(params)
+            except DeadlineExceeded as e:
+                print(f"{e}; giving up")
+                return MermaidAgentResponse(
+                    img=None, mermaid=None, error=str(e), timed_out=True
+                )
+
+    return run
 
+
+@tracing.traced("one_shot_mermaid_agent")
+@with_timeout
 def one_shot_mermaid_agent(params: OneShotMermaidParams) -> MermaidAgentResponse:
 
-    model = build_model()
+    model = build_model(params.model)
 
     base_prompt = params.prompt
     output_file = params.output_file
@@ -155,56 +246,204 @@ Your correction of the mermaid chart if needed:"""
         mermaid_prompt_1, {"file_content": file_content}
     )
 
-    chain.MinimalChainable.to_delim_text_file(
-        utils.build_file_path("rendered_mermaid_prompt_1"), [rendered_mermaid_prompt_1]
+    request_id = artifacts.new_request_id()
+    artifacts.write(
+        request_id, "rendered_mermaid_prompt_1", [rendered_mermaid_prompt_1]
     )
 
-    prompt_response, ctx_filled_prompts = chain.MinimalChainable.run(
-        context,
-        model,
-        llm_module.prompt,
-        prompts=[rendered_mermaid_prompt_1, mermaid_prompt_2],
-    )
+    prompts = [rendered_mermaid_prompt_1, mermaid_prompt_2]
+
+    # When streaming, start validating and rendering the final chart as soon as
+    # its block is complete rather than after the whole response has arrived
+    early_renders: Dict[str, concurrent.futures.Future] = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as render_executor:
+        on_chunk = None
+        if params.stream:
+            on_chunk = stream_monitor(
+                len(prompts) - 1,
+                lambda block: early_renders.setdefault(
+                    block,
+                    render_executor.submit(
+                        tracing.in_current_context(validate_and_render),
+                        block,
+                        output_file,
+                        params.render_options,
+                    ),
+                ),
+            )
 
-    chain.MinimalChainable.to_delim_text_file(
-        utils.build_file_path("mermaid_prompt_1_results"), prompt_response
-    )
+        prompt_response, ctx_filled_prompts = chain.MinimalChainable.run(
+            context,
+            model,
+            llm_module.prompt_callable(params.cache, params.stream),
+            prompts=prompts,
+            on_chunk=on_chunk,
+            output_formats=["mermaid", "mermaid"],
+            # The review is dropped when there isn't time for it
+            optional_steps=[1],
+        )
 
-    chain.MinimalChainable.to_delim_text_file(
-        utils.build_file_path("mermaid_prompt_1_ctx_filled_prompts"), ctx_filled_prompts
+    artifacts.write(request_id, "mermaid_prompt_1_results", prompt_response)
+    artifacts.write(
+        request_id, "mermaid_prompt_1_ctx_filled_prompts", ctx_filled_prompts
     )
 
     res = llm_module.parse_markdown_backticks(prompt_response[-1])
 
-    img = mermaid.mm(res, output_file)
-
-    for _ in range(2):
+    # Leaving the executor block above waited for any early render, so reusing
+    # its result can't race with a fresh render of the same output file
+    if res in early_renders:
+        error, img = early_renders[res].result()
+    else:
+        error, img = validate_and_render(res, output_file, params.render_options)
+
+    if img is None:
+        print("Failed to generate image - running resolution agent")
+        res, img, _ = resolve_mermaid_chart(
+            params,
+            res,
+            error or "Error: Failed to generate Mermaid diagram",
+            request_id,
+        )
         if img is None:
-            print("Failed to generate image - running resolution agent")
+            deadlines.current().check("resolution")
+
+    return MermaidAgentResponse(img=img, mermaid=res)
 
+
+def resolve_mermaid_chart(
+    params: OneShotMermaidParams, res: str, error: str, request_id: str
+) -> Tuple[str, Optional[RenderedImage], Optional[str]]:
+    """
+    Fix a chart that failed to render, per params.resolution.
+
+    Each round runs resolution.fanout fix attempts concurrently, cycling over
+    resolution.models and resolution.temperatures. Every attempt validates and
+    renders its own fix, and the first one that renders wins: it's saved to
+    params.output_file and the rest of the round is cancelled, dropping their
+    fixes unrendered. A failed round's charts and errors are what the next round fixes.
+    Rounds stop at resolution.deadline or the request's deadline, whichever
+    comes first, and a round is not started when the time left is less than
+    the slowest round so far took.
+
+    Returns (chart, img, error); img is None when no attempt rendered, and then
+    chart and error are the latest failed attempt's.
+    """
+    resolution = params.resolution
+    fanout = max(1, resolution.fanout)
+    deadline = deadlines.current().child(resolution.deadline)
+    failures = [(res, error)]
+    slowest_round = 0.0
+
+    def run_attempt(attempt: int, candidate: int, cancel_event):
+        damaged_chart, damaged_error = failures[candidate % len(failures)]
+        model_ids = resolution.models or [params.model]
+        temperatures = resolution.temperatures or [None]
+        # The first generation is attempt 1, so resolutions start at attempt 2
+        with tracing.span(
+            "resolution", attempt=attempt + 2, candidate=candidate
+        ) as resolution_span:
             resolution_params = ResolutionMermaidParams(
-                error="Error: Failed to generate Mermaid diagram",
-                damaged_mermaid_chart=res,
-                base_prompt=base_prompt,
-                output_file=output_file,
-                input_file=input_file,
+                error=damaged_error,
+                damaged_mermaid_chart=damaged_chart,
+                base_prompt=params.prompt,
+                output_file=params.output_file,
+                render_options=params.render_options,
+                input_file=params.input_file,
+                model=model_ids[candidate % len(model_ids)],
+                cache=params.cache,
+                request_id=request_id,
+                temperature=temperatures[candidate % len(temperatures)],
             )
+            chart = fix_mermaid_chart(resolution_params, cancel_event)
+            img, render_error = None, None
+            try:
+                img = mermaid.render_image(
+                    chart, params.render_options, params.output_file
+                )
+            except mermaid.MermaidRenderError as e:
+                render_error = str(e)
+            resolution_span.set(resolved=img is not None)
+            return chart, img, render_error
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=fanout)
+    try:
+        for attempt in range(resolution.attempts):
+            if deadline.expired() or not deadline.has_time(slowest_round):
+                print(f"Out of time for resolution after {attempt} round(s)")
+                break
+            round_start = time.perf_counter()
+            cancel_event = threading.Event()
+            # Cancelled with the round, so abandoned attempts stop early
+            round_deadline = deadline.child()
+            with deadlines.scope(round_deadline):
+                futures = [
+                    executor.submit(
+                        tracing.in_current_context(run_attempt),
+                        attempt,
+                        candidate,
+                        cancel_event,
+                    )
+                    for candidate in range(fanout)
+                ]
+            round_failures = []
+            try:
+                for future in concurrent.futures.as_completed(
+                    futures, timeout=round_deadline.remaining()
+                ):
+                    try:
+                        chart, img, render_error = future.result()
+                    except chain.ChainCancelledError:
+                        continue
+                    except Exception as e:
+                        print(f"Resolution attempt failed: {e}")
+                        continue
+                    if img is not None:
+                        cancel_event.set()
+                        mermaid.save_image_locally(
+                            img, build_file_path(params.output_file)
+                        )
+                        return chart, img, None
+                    round_failures.append((chart, render_error))
+            except concurrent.futures.TimeoutError:
+                failures = round_failures or failures
+                print(f"Out of time for resolution after {attempt + 1} round(s)")
+                break
+            finally:
+                cancel_event.set()
+                round_deadline.cancel()
+            failures = round_failures or failures
+            slowest_round = max(slowest_round, time.perf_counter() - round_start)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    chart, error = failures[-1]
+    return chart, None, error
+
+
+@tracing.traced("resolution_mermaid_agent")
+def resolution_mermaid_agent(params: ResolutionMermaidParams) -> MermaidAgentResponse:
+    res = fix_mermaid_chart(params)
 
-            resolution_response = resolution_mermaid_agent(resolution_params)
-            img = resolution_response.img
-        else:
-            break
+    img = mermaid.mm(res, params.output_file, params.render_options)
 
     return MermaidAgentResponse(img=img, mermaid=res)
 
 
-def resolution_mermaid_agent(params: ResolutionMermaidParams) -> MermaidAgentResponse:
-    model = build_model()
+def fix_mermaid_chart(
+    params: ResolutionMermaidParams,
+    cancel_event: Optional[threading.Event] = None,
+) -> str:
+    """
+    Ask the model to fix params.damaged_mermaid_chart and return the fixed
+    chart. Raises chain.ChainCancelledError if cancel_event is set before the
+    model answers.
+    """
+    model = build_model(params.model)
 
     error = params.error
     damaged_mermaid_chart = params.damaged_mermaid_chart
     prompt = params.base_prompt
-    output_file = params.output_file
     input_file = params.input_file
 
     file_content = ""
@@ -257,42 +496,197 @@ Your corrected mermaid chart:"""
         correction_prompt, {"file_content": file_content}
     )
 
-    prompt_response, ctx_filled_prompts = chain.MinimalChainable.run(
-        context, model, llm_module.prompt, prompts=[rendered_correction_prompt]
-    )
+    prompt_fn = llm_module.prompt_callable(params.cache)
+    if params.temperature is not None:
+        prompt_fn = functools.partial(prompt_fn, temperature=params.temperature)
 
-    chain.MinimalChainable.to_delim_text_file(
-        utils.build_file_path("resolution_mermaid_results"), prompt_response
+    prompt_response, ctx_filled_prompts = chain.MinimalChainable.run(
+        context,
+        model,
+        prompt_fn,
+        prompts=[rendered_correction_prompt],
+        cancel_event=cancel_event,
+        output_formats=["mermaid"],
     )
-
-    chain.MinimalChainable.to_delim_text_file(
-        utils.build_file_path("resolution_mermaid_ctx_filled_prompts"),
-        ctx_filled_prompts,
+    # Another attempt won while this one waited on the model; drop its fix
+    if cancel_event is not None and cancel_event.is_set():
+        raise chain.ChainCancelledError(len(prompt_response))
+
+    # Resolutions run for a one shot request share its artifact directory
+    request_id = params.request_id or artifacts.new_request_id()
+    artifacts.write(request_id, "resolution_mermaid_results", prompt_response)
+    artifacts.write(
+        request_id, "resolution_mermaid_ctx_filled_prompts", ctx_filled_prompts
     )
 
-    res = llm_module.parse_markdown_backticks(prompt_response[-1])
+    return llm_module.parse_markdown_backticks(prompt_response[-1])
 
-    img = mermaid.mm(res, output_file)
 
-    return MermaidAgentResponse(img=img, mermaid=res)
+@tracing.traced("bulk_mermaid_agent")
+def bulk_mermaid_agent(
+    params: BulkMermaidParams,
+    on_complete: Optional[Callable[[int, MermaidAgentResponse], None]] = None,
+) -> BulkMermaidAgentResponse:
+    """
+    Generate params.count diagrams, up to params.concurrency at a time.
 
+    Responses come back in index order. A diagram that raises is returned as a
+    response with its error set instead of aborting the rest. on_complete is
+    called with (index, response) as each diagram finishes. Diagrams still
+    running, or not started, when params.timeout passes come back timed out.
+    """
 
-def bulk_mermaid_agent(params: BulkMermaidParams) -> BulkMermaidAgentResponse:
-    responses = []
-    for i in range(params.count):
+    def run_one(i: int) -> MermaidAgentResponse:
         one_shot_params = OneShotMermaidParams(
             prompt=params.prompt,
             output_file=f"{i+1}_{params.output_file}",
+            render_options=params.render_options,
             input_file=params.input_file,
+            model=params.model,
+            # Every diagram sends the same prompts, so a cached response
+            # would turn the whole batch into copies of one diagram
+            cache=False,
+            resolution=params.resolution,
         )
-        response = one_shot_mermaid_agent(one_shot_params)
-        responses.append(response)
+        try:
+            return one_shot_mermaid_agent(one_shot_params)
+        except Exception as e:
+            print(f"Failed to generate diagram {i+1}: {e}")
+            return MermaidAgentResponse(img=None, mermaid=None, error=str(e))
+
+    responses: List[Optional[MermaidAgentResponse]] = [None] * params.count
+    with (
+        concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, params.concurrency)
+        ) as executor,
+        deadlines.start(params.timeout),
+        # The batch's limits apply to its own calls only
+        rate_limit.scope(params.rate_limits),
+    ):
+        future_to_index = {
+            executor.submit(tracing.in_current_context(run_one), i): i
+            for i in range(params.count)
+        }
+        for future in concurrent.futures.as_completed(future_to_index):
+            index = future_to_index[future]
+            responses[index] = future.result()
+            if on_complete:
+                on_complete(index, responses[index])
 
     return BulkMermaidAgentResponse(responses=responses)
 
 
+def patch_mermaid_chart(
+    params: IterateMermaidParams, model, file_content: str
+) -> Optional[str]:
+    """
+    Edit mode for iterate_mermaid_agent: send the compact serialized flowchart
+    and ask for a MermaidPatch instead of a full chart, then apply and validate
+    the patch locally. Returns the patched chart, or None when the chart is not
+    a parseable flowchart or the patch does not apply or validate, so the
+    caller can fall back to regenerating the full chart.
+    """
+    try:
+        graph = mermaid_graph.parse(params.current_mermaid_chart)
+    except mermaid_graph.MermaidGraphError as e:
+        print(f"Edit mode unavailable ({e}); regenerating the full chart")
+        return None
+
+    patch_prompt = """You are a world-class expert at modifying mermaid charts.
+
+You have been given a mermaid flowchart and a request for changes. Instead of rewriting the chart, respond with the smallest list of edit operations that makes the requested changes.
+
+<instructions>
+    <instruction>Respond with JSON only, in the form {"operations": [...]}.</instruction>
+    <instruction>Refer to nodes and subgraphs by their ids in the current chart.</instruction>
+    <instruction>Ensure the updated chart still fulfills the original base prompt.</instruction>
+</instructions>
+
+<operations>
+    {"op": "add_node", "id": "...", "label": "...", "shape": "[]", "subgraph": "optional subgraph id"}
+    {"op": "remove_node", "id": "..."}
+    {"op": "rename_node", "id": "...", "new_id": "optional", "label": "optional", "shape": "optional"}
+    {"op": "add_edge", "source": "...", "target": "...", "label": "optional", "arrow": "-->"}
+    {"op": "remove_edge", "source": "...", "target": "..."}
+    {"op": "add_subgraph", "id": "...", "label": "title", "nodes": ["node ids to move in"], "subgraph": "optional parent id"}
+    {"op": "remove_subgraph", "id": "..."}
+    {"op": "add_style", "style": "classDef, class, style or linkStyle statement"}
+</operations>
+
+<shapes>[] () ([]) [[]] [()] (()) {} {{}} >] [//] [\\\\]</shapes>
+
+<current-mermaid-chart>
+{{compact_chart}}
+</current-mermaid-chart>
+
+<base-prompt>
+{{base_prompt}}
+</base-prompt>
+
+<change-request>
+{{change_prompt}}
+</change-request>
+
+% if file_content:
+<file-content>
+${file_content}
+</file-content>
+% endif
+
+Your edit operations:"""
+
+    context = {
+        "compact_chart": mermaid_graph.serialize(graph),
+        "base_prompt": params.base_prompt,
+        "change_prompt": params.change_prompt,
+    }
+    rendered_patch_prompt = llm_module.conditional_render(
+        patch_prompt, {"file_content": file_content}
+    )
+
+    with tracing.span("patch") as patch_span:
+        try:
+            prompt_response, ctx_filled_prompts = chain.MinimalChainable.run(
+                context,
+                model,
+                llm_module.prompt,
+                prompts=[rendered_patch_prompt],
+                output_formats=["json"],
+                output_schemas=[MermaidPatch],
+            )
+        except chain.ChainOutputError as e:
+            print(f"Edit mode failed ({e}); regenerating the full chart")
+            return None
+
+        request_id = artifacts.new_request_id()
+        artifacts.write(request_id, "patch_mermaid_results", prompt_response)
+        artifacts.write(
+            request_id, "patch_mermaid_ctx_filled_prompts", ctx_filled_prompts
+        )
+
+        patch: MermaidPatch = prompt_response[-1]
+        patch_span.set(operations=len(patch.operations))
+        try:
+            res = mermaid_graph.serialize(mermaid_graph.apply_patch(graph, patch))
+        except mermaid_graph.MermaidPatchError as e:
+            print(f"Edit mode failed ({e}); regenerating the full chart")
+            return None
+
+    validation_error = mermaid_validator.format_errors(
+        res, mermaid_validator.validate(res)
+    )
+    if validation_error is not None:
+        print(
+            f"Patched chart is invalid; regenerating the full chart\n{validation_error}"
+        )
+        return None
+    return res
+
+
+@tracing.traced("iterate_mermaid_agent")
+@with_timeout
 def iterate_mermaid_agent(params: IterateMermaidParams) -> MermaidAgentResponse:
-    model = build_model()
+    model = build_model(params.model)
 
     change_prompt = params.change_prompt
     base_prompt = params.base_prompt
@@ -306,6 +700,13 @@ def iterate_mermaid_agent(params: IterateMermaidParams) -> MermaidAgentResponse:
         with open(input_file, "r") as file:
             file_content = file.read()
 
+    if params.edit_mode:
+        res = patch_mermaid_chart(params, model, file_content)
+        if res is not None:
+            return MermaidAgentResponse(
+                img=mermaid.mm(res, output_file, params.render_options), mermaid=res
+            )
+
     iteration_prompt_1 = """You are a world-class expert at creating and modifying mermaid charts.
 
 You have been given a current mermaid chart and a request for changes. Your task is to update the chart according to the requested changes.
@@ -378,24 +779,24 @@ Your final mermaid chart:"""
     )
     rendered_iteration_prompt_2 = iteration_prompt_2
 
+    # Interactive iterations always bypass the LLM response cache
     prompt_response, ctx_filled_prompts = chain.MinimalChainable.run(
         context,
         model,
         llm_module.prompt,
         prompts=[rendered_iteration_prompt_1, rendered_iteration_prompt_2],
+        output_formats=["mermaid", "mermaid"],
+        optional_steps=[1],
     )
 
-    chain.MinimalChainable.to_delim_text_file(
-        utils.build_file_path("iteration_mermaid_results"), prompt_response
-    )
-
-    chain.MinimalChainable.to_delim_text_file(
-        utils.build_file_path("iteration_mermaid_ctx_filled_prompts"),
-        ctx_filled_prompts,
+    request_id = artifacts.new_request_id()
+    artifacts.write(request_id, "iteration_mermaid_results", prompt_response)
+    artifacts.write(
+        request_id, "iteration_mermaid_ctx_filled_prompts", ctx_filled_prompts
     )
 
     res = llm_module.parse_markdown_backticks(prompt_response[-1])
 
-    img = mermaid.mm(res, output_file)
+    img = mermaid.mm(res, output_file, params.render_options)
 
     return MermaidAgentResponse(img=img, mermaid=res)
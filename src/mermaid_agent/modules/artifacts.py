@@ -0,0 +1,167 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Any, List, Optional, Tuple
+from mermaid_agent.modules.chain import MinimalChainable
+from mermaid_agent.modules.utils import OUTPUT_DIR, current_date_time_str
+
+ARTIFACTS_DIR = os.path.join(OUTPUT_DIR, "artifacts")
+ARTIFACT_MODES = ("text", "jsonl")
+
+# (request_id, name, content, created_at)
+Artifact = Tuple[str, str, List[Any], float]
+
+
+def _json_default(obj: Any) -> Any:
+    # Schema-validated chain outputs are pydantic models
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    return str(obj)
+
+
+def new_request_id() -> str:
+    """A unique id naming one agent request's artifacts."""
+    return f"{current_date_time_str()}_{uuid.uuid4().hex[:8]}"
+
+
+class ArtifactSink:
+    """
+    Background writer for the debug artifacts of agent requests.
+
+    write only enqueues; a writer thread drains the queue in batches of up to
+    max_batch artifacts, waiting at most flush_interval seconds to fill a batch.
+    In "text" mode each artifact is a delimited text file under
+    output_dir/<request_id>/, so concurrent requests never overwrite each
+    other. In "jsonl" mode each batch is appended to output_dir/artifacts.jsonl
+    with a single write.
+    """
+
+    def __init__(
+        self,
+        output_dir: str = ARTIFACTS_DIR,
+        mode: str = "text",
+        flush_interval: float = 0.25,
+        max_batch: int = 256,
+    ):
+        if mode not in ARTIFACT_MODES:
+            raise ValueError(
+                f"Unknown artifact mode {mode!r}, expected one of {ARTIFACT_MODES}"
+            )
+        self.output_dir = output_dir
+        self.mode = mode
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.batches_written = 0
+        self._queue: "queue.Queue[Optional[Artifact]]" = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="artifact-sink", daemon=True
+        )
+        self._thread.start()
+
+    def write(self, request_id: str, name: str, content: List[Any]):
+        if self._closed:
+            return
+        self._queue.put((request_id, name, list(content), time.time()))
+
+    def flush(self):
+        """Block until every artifact written so far is on disk."""
+        self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not None and len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            artifacts = [artifact for artifact in batch if artifact is not None]
+            try:
+                if artifacts:
+                    self._write_batch(artifacts)
+                    self.batches_written += 1
+            except (OSError, TypeError, ValueError) as e:
+                print(f"Failed to write {len(artifacts)} artifacts: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+            if batch[-1] is None:
+                return
+
+    def _write_batch(self, artifacts: List[Artifact]):
+        if self.mode == "jsonl":
+            os.makedirs(self.output_dir, exist_ok=True)
+            lines = [
+                json.dumps(
+                    {
+                        "request_id": request_id,
+                        "name": name,
+                        "created_at": created_at,
+                        "content": content,
+                    },
+                    default=_json_default,
+                )
+                + "\n"
+                for request_id, name, content, created_at in artifacts
+            ]
+            with open(os.path.join(self.output_dir, "artifacts.jsonl"), "a") as outfile:
+                outfile.write("".join(lines))
+            return
+
+        for request_id, name, content, _ in artifacts:
+            request_dir = os.path.join(self.output_dir, request_id)
+            os.makedirs(request_dir, exist_ok=True)
+            with open(os.path.join(request_dir, f"{name}.txt"), "w") as outfile:
+                outfile.write(MinimalChainable.format_delim_text(content))
+
+
+_artifact_sink: Optional[ArtifactSink] = None
+_artifact_sink_lock = threading.Lock()
+
+
+def get_artifact_sink() -> Optional[ArtifactSink]:
+    """The shared artifact sink, or None when MERMAID_ARTIFACTS=off."""
+    global _artifact_sink
+    mode = os.getenv("MERMAID_ARTIFACTS", "text")
+    if mode == "off":
+        return None
+    with _artifact_sink_lock:
+        if _artifact_sink is None:
+            _artifact_sink = ArtifactSink(
+                output_dir=os.getenv("MERMAID_ARTIFACTS_DIR", ARTIFACTS_DIR),
+                mode=mode,
+            )
+            # Drain pending artifacts before the interpreter exits
+            atexit.register(_artifact_sink.close)
+        return _artifact_sink
+
+
+def set_artifact_sink(sink: Optional[ArtifactSink]):
+    global _artifact_sink
+    with _artifact_sink_lock:
+        _artifact_sink = sink
+
+
+def write(request_id: str, name: str, content: List[Any]):
+    """Queue an artifact on the shared sink; a no-op when artifacts are off."""
+    sink = get_artifact_sink()
+    if sink is not None:
+        sink.write(request_id, name, content)
@@ -1,9 +1,101 @@
+import asyncio
 import json
 import re
-from typing import List, Dict, Callable, Any, Tuple, Union
-from .typings import FusionChainResult
+import threading
+import time
+from typing import (
+    List,
+    Dict,
+    Callable,
+    Any,
+    Tuple,
+    Union,
+    Awaitable,
+    Optional,
+    Iterator,
+    Sequence,
+    Type,
+)
+from pydantic import BaseModel, ValidationError
+from .typings import FusionChainResult, FusionChainModelResult, FusionChainRaceResult
+from .prompt_template import compile_prompt
+from . import deadlines, tracing
+from .deadlines import Deadline, DeadlineExceeded
 import concurrent.futures
 
+# Declared per prompt step; see MinimalChainable.run
+OUTPUT_FORMATS = ("auto", "text", "json", "mermaid")
+# Characters a JSON document can start with, besides the true/false/null literals
+JSON_START_CHARS = frozenset('{["-0123456789')
+JSON_LITERALS = ("true", "false", "null")
+FIRST_CHAR_PATTERN = re.compile(r"\S")
+
+
+class ChainCancelledError(Exception):
+    """Raised by MinimalChainable.run when its cancel_event is set before a prompt step."""
+
+    def __init__(self, step: int):
+        super().__init__(f"Chain cancelled before prompt step {step}")
+        self.step = step
+
+
+class ChainOutputError(ValueError):
+    """Raised when a prompt step's response doesn't match its declared output format."""
+
+    def __init__(self, step: int, message: str):
+        super().__init__(f"Prompt step {step}: {message}")
+        self.step = step
+
+
+# Shared by every to_async_callable adapter without an executor of its own
+ASYNC_LLM_WORKERS = 8
+_async_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_async_executor_lock = threading.Lock()
+
+
+def get_async_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """The thread pool async adapters offload sync LLM calls to, created once per process."""
+    global _async_executor
+    with _async_executor_lock:
+        if _async_executor is None:
+            _async_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=ASYNC_LLM_WORKERS, thread_name_prefix="async_llm"
+            )
+        return _async_executor
+
+
+def to_async_callable(
+    callable: Callable[[Any, str], Any],
+    executor: Optional[concurrent.futures.Executor] = None,
+) -> Callable[[Any, str], Awaitable[Any]]:
+    """
+    Adapt a sync callable (e.g. llm_module.prompt) for MinimalChainable.arun / FusionChain.arun.
+
+    Calls are offloaded to a bounded thread pool so at most ASYNC_LLM_WORKERS
+    blocking LLM calls are in flight, however many chains are awaiting on the
+    event loop. Adapters share that pool, so building one per request starts
+    no threads of its own. Calls run in the caller's context, so the current
+    deadline and span reach callable.
+
+    Args:
+        callable (Callable): The sync function to call for each prompt.
+        executor (Optional[concurrent.futures.Executor]): Executor to use instead of the shared pool; the caller owns its shutdown.
+
+    Returns:
+        Callable[[Any, str], Awaitable[Any]]: An async callable with the same (model, prompt) signature.
+    """
+
+    async def async_callable(model: Any, prompt: str) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor or get_async_executor(),
+            tracing.in_current_context(callable),
+            model,
+            prompt,
+        )
+
+    return async_callable
+
 
 class FusionChain:
 
@@ -15,6 +107,7 @@ class FusionChain:
         prompts: List[str],
         evaluator: Callable[[List[Any]], Tuple[Any, List[float]]],
         get_model_name: Callable[[Any], str],
+        deadline: Optional[Deadline] = None,
     ) -> FusionChainResult:
         """
         Run a competition between models on a list of prompts.
@@ -32,6 +125,7 @@ class FusionChain:
             prompts (List[str]): List of prompts to process.
             evaluator (Callable[[List[str]], Tuple[Any, List[float]]]): Function to evaluate model outputs, returning the top response and the scores.
             get_model_name (Callable[[Any], str]): Function to get the name of a model. Defaults to str(model).
+            deadline (Optional[Deadline]): Bounds every model's chain. Defaults to the current request's.
 
         Returns:
             FusionChainResult: A FusionChainResult object containing the top response, all outputs, all context-filled prompts, performance scores, and model names.
@@ -41,7 +135,7 @@ class FusionChain:
 
         for model in models:
             outputs, context_filled_prompts = MinimalChainable.run(
-                context, model, callable, prompts
+                context, model, callable, prompts, deadline=deadline
             )
             all_outputs.append(outputs)
             all_context_filled_prompts.append(context_filled_prompts)
@@ -69,12 +163,14 @@ class FusionChain:
         evaluator: Callable[[List[Any]], Tuple[Any, List[float]]],
         get_model_name: Callable[[Any], str],
         num_workers: int = 4,
+        deadline: Optional[Deadline] = None,
     ) -> FusionChainResult:
         """
         Run a competition between models on a list of prompts in parallel.
 
         This method is similar to the 'run' method but utilizes parallel processing
-        to improve performance when dealing with multiple models.
+        to improve performance when dealing with multiple models. Outputs stay in the
+        order of models, whichever model finishes first.
 
         Args:
             context (Dict[str, Any]): The context for the prompts.
@@ -84,28 +180,274 @@ class FusionChain:
             evaluator (Callable[[List[str]], Tuple[Any, List[float]]]): Function to evaluate model outputs, returning the top response and the scores.
             num_workers (int): Number of parallel workers to use. Defaults to 4.
             get_model_name (Callable[[Any], str]): Function to get the name of a model. Defaults to str(model).
+            deadline (Optional[Deadline]): Bounds the whole run; see iter_parallel. Defaults to the current request's.
 
         Returns:
             FusionChainResult: A FusionChainResult object containing the top response, all outputs, all context-filled prompts, performance scores, and model names.
         """
+        all_outputs: List[List[Any]] = [[] for _ in models]
+        all_context_filled_prompts: List[List[str]] = [[] for _ in models]
+
+        # Results arrive in completion order; slot them back by model index
+        for model_result in FusionChain.iter_parallel(
+            context, models, callable, prompts, get_model_name, num_workers, deadline
+        ):
+            all_outputs[model_result.model_index] = model_result.outputs
+            all_context_filled_prompts[model_result.model_index] = (
+                model_result.context_filled_prompts
+            )
+
+        # Evaluate the last output of each model
+        last_outputs = [outputs[-1] for outputs in all_outputs]
+        top_response, performance_scores = evaluator(last_outputs)
+
+        model_names = [get_model_name(model) for model in models]
+
+        return FusionChainResult(
+            top_response=top_response,
+            all_prompt_responses=all_outputs,
+            all_context_filled_prompts=all_context_filled_prompts,
+            performance_scores=performance_scores,
+            model_names=model_names,
+        )
+
+    @staticmethod
+    def iter_parallel(
+        context: Dict[str, Any],
+        models: List[Any],
+        callable: Callable,
+        prompts: List[str],
+        get_model_name: Callable[[Any], str],
+        num_workers: int = 4,
+        deadline: Optional[Deadline] = None,
+    ) -> Iterator[FusionChainModelResult]:
+        """
+        Run each model's chain in parallel and yield its result as soon as it finishes.
+
+        Results are yielded in completion order; model_index ties each one back to models.
+        Abandoning the iterator early drops chains that have not started yet and
+        cancels running ones before their next prompt step.
+
+        Once the deadline passes, DeadlineExceeded is raised without waiting for
+        the chains still running, which stop before their next prompt step.
+
+        Args:
+            context (Dict[str, Any]): The context for the prompts.
+            models (List[Any]): List of models to compete.
+            callable (Callable): The function to call for each prompt.
+            prompts (List[str]): List of prompts to process.
+            get_model_name (Callable[[Any], str]): Function to get the name of a model.
+            num_workers (int): Number of parallel workers to use. Defaults to 4.
+            deadline (Optional[Deadline]): Bounds the whole run. Defaults to the current request's.
+
+        Yields:
+            FusionChainModelResult: The model's name, outputs, context-filled prompts and latency in seconds.
+        """
+        # Cancelling this child stops the workers without cancelling the caller's deadline
+        run_deadline = (deadline or deadlines.current()).child()
 
         def process_model(model):
+            start = time.perf_counter()
             outputs, context_filled_prompts = MinimalChainable.run(
-                context, model, callable, prompts
+                context, model, callable, prompts, deadline=run_deadline
             )
-            return outputs, context_filled_prompts
+            return outputs, context_filled_prompts, time.perf_counter() - start
 
-        all_outputs = []
-        all_context_filled_prompts = []
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=num_workers)
+        try:
+            future_to_index = {
+                executor.submit(tracing.in_current_context(process_model), model): index
+                for index, model in enumerate(models)
+            }
+            completed = concurrent.futures.as_completed(
+                future_to_index, timeout=run_deadline.remaining()
+            )
+            while True:
+                try:
+                    future = next(completed)
+                except StopIteration:
+                    return
+                except concurrent.futures.TimeoutError:
+                    raise DeadlineExceeded("fusion chain") from None
+                index = future_to_index[future]
+                outputs, context_filled_prompts, latency = future.result()
+                yield FusionChainModelResult(
+                    model_index=index,
+                    model_name=get_model_name(models[index]),
+                    outputs=outputs,
+                    context_filled_prompts=context_filled_prompts,
+                    latency=latency,
+                )
+        finally:
+            run_deadline.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def run_race(
+        context: Dict[str, Any],
+        models: List[Any],
+        callable: Callable,
+        prompts: List[str],
+        accept: Callable[[Any], bool],
+        get_model_name: Callable[[Any], str],
+        num_workers: int = 4,
+        deadline: Optional[Deadline] = None,
+    ) -> FusionChainRaceResult:
+        """
+        Race models on a list of prompts and return the first final output that passes accept.
+
+        Once a winner is found the remaining chains are cancelled before they issue their
+        next prompt step, and the call returns without waiting for slower models.
+        For example, accept could check that a Mermaid chart renders without error.
+
+        Args:
+            context (Dict[str, Any]): The context for the prompts.
+            models (List[Any]): List of models to race.
+            callable (Callable): The function to call for each prompt.
+            prompts (List[str]): List of prompts to process.
+            accept (Callable[[Any], bool]): Acceptance predicate run on each model's last output.
+            get_model_name (Callable[[Any], str]): Function to get the name of a model.
+            num_workers (int): Number of parallel workers to use. Defaults to 4.
+            deadline (Optional[Deadline]): Bounds the race. Once it passes the remaining chains are cancelled and the result has timed_out set. Defaults to the current request's.
+
+        Returns:
+            FusionChainRaceResult: The winning model and response (None if no output was accepted), the rejected models, and the cancelled models with the prompt step each was stopped before.
+        """
+        cancel_event = threading.Event()
+        run_deadline = (deadline or deadlines.current()).child()
+        # Number of prompt steps each model has issued so far
+        steps_issued = [0 for _ in models]
+
+        def process_model(index, model):
+            def tracked_callable(model, prompt):
+                steps_issued[index] += 1
+                return callable(model, prompt)
+
+            start = time.perf_counter()
+            outputs, context_filled_prompts = MinimalChainable.run(
+                context,
+                model,
+                tracked_callable,
+                prompts,
+                cancel_event,
+                deadline=run_deadline,
+            )
+            return outputs, context_filled_prompts, time.perf_counter() - start
+
+        def unfinished_models(future_to_index):
+            return {
+                get_model_name(models[index]): steps_issued[index]
+                for future, index in future_to_index.items()
+                if not future.done()
+            }
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
-            future_to_model = {
-                executor.submit(process_model, model): model for model in models
+        rejected_model_names = []
+        cancelled_models: Dict[str, int] = {}
+        timed_out = False
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=num_workers)
+        try:
+            future_to_index = {
+                executor.submit(
+                    tracing.in_current_context(process_model), index, model
+                ): index
+                for index, model in enumerate(models)
             }
-            for future in concurrent.futures.as_completed(future_to_model):
-                outputs, context_filled_prompts = future.result()
-                all_outputs.append(outputs)
-                all_context_filled_prompts.append(context_filled_prompts)
+            completed = concurrent.futures.as_completed(
+                future_to_index, timeout=run_deadline.remaining()
+            )
+            while True:
+                try:
+                    future = next(completed)
+                except StopIteration:
+                    break
+                except concurrent.futures.TimeoutError:
+                    cancel_event.set()
+                    cancelled_models = unfinished_models(future_to_index)
+                    timed_out = True
+                    break
+                index = future_to_index[future]
+                model_name = get_model_name(models[index])
+                try:
+                    outputs, context_filled_prompts, latency = future.result()
+                except Exception as e:
+                    print(f"Model {model_name} failed during race: {e}")
+                    rejected_model_names.append(model_name)
+                    continue
+
+                if not accept(outputs[-1]):
+                    rejected_model_names.append(model_name)
+                    continue
+
+                cancel_event.set()
+                return FusionChainRaceResult(
+                    top_response=outputs[-1],
+                    winner_model_name=model_name,
+                    winner_prompt_responses=outputs,
+                    winner_context_filled_prompts=context_filled_prompts,
+                    latency=latency,
+                    rejected_model_names=rejected_model_names,
+                    cancelled_models=unfinished_models(future_to_index),
+                )
+        finally:
+            cancel_event.set()
+            run_deadline.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return FusionChainRaceResult(
+            top_response=None,
+            winner_model_name=None,
+            winner_prompt_responses=[],
+            winner_context_filled_prompts=[],
+            latency=None,
+            rejected_model_names=rejected_model_names,
+            cancelled_models=cancelled_models,
+            timed_out=timed_out,
+        )
+
+    @staticmethod
+    async def arun(
+        context: Dict[str, Any],
+        models: List[Any],
+        callable: Callable[[Any, str], Awaitable[Any]],
+        prompts: List[str],
+        evaluator: Callable[[List[Any]], Tuple[Any, List[float]]],
+        get_model_name: Callable[[Any], str],
+        deadline: Optional[Deadline] = None,
+    ) -> FusionChainResult:
+        """
+        Run a competition between models on a list of prompts concurrently on the event loop.
+
+        Each model's chain runs through MinimalChainable.arun; results keep the order of models.
+        Once the deadline passes DeadlineExceeded is raised and the other chains stop.
+
+        Args:
+            context (Dict[str, Any]): The context for the prompts.
+            models (List[Any]): List of models to compete.
+            callable (Callable[[Any, str], Awaitable[Any]]): The async function to call for each prompt.
+            prompts (List[str]): List of prompts to process.
+            evaluator (Callable[[List[str]], Tuple[Any, List[float]]]): Function to evaluate model outputs, returning the top response and the scores.
+            get_model_name (Callable[[Any], str]): Function to get the name of a model.
+            deadline (Optional[Deadline]): Bounds every model's chain. Defaults to the current request's.
+
+        Returns:
+            FusionChainResult: A FusionChainResult object containing the top response, all outputs, all context-filled prompts, performance scores, and model names.
+        """
+        # Cancelling this child stops the other chains without cancelling the caller's deadline
+        run_deadline = (deadline or deadlines.current()).child()
+        try:
+            results = await asyncio.gather(
+                *(
+                    MinimalChainable.arun(
+                        context, model, callable, prompts, deadline=run_deadline
+                    )
+                    for model in models
+                )
+            )
+        finally:
+            run_deadline.cancel()
+
+        all_outputs = [outputs for outputs, _ in results]
+        all_context_filled_prompts = [filled for _, filled in results]
 
         # Evaluate the last output of each model
         last_outputs = [outputs[-1] for outputs in all_outputs]
@@ -129,101 +471,323 @@ class MinimalChainable:
 
     @staticmethod
     def run(
-        context: Dict[str, Any], model: Any, callable: Callable, prompts: List[str]
+        context: Dict[str, Any],
+        model: Any,
+        callable: Callable,
+        prompts: List[str],
+        cancel_event: Optional[threading.Event] = None,
+        on_chunk: Optional[Callable[[int, str], None]] = None,
+        output_formats: Optional[List[str]] = None,
+        output_schemas: Optional[List[Optional[Type[BaseModel]]]] = None,
+        deadline: Optional[Deadline] = None,
+        optional_steps: Sequence[int] = (),
     ) -> Tuple[List[Any], List[str]]:
+        """
+        callable may return the response text or, like llm_module.stream_prompt,
+        an iterator of text chunks; on_chunk(step, chunk) sees each chunk as it
+        arrives.
+
+        output_formats declares how each step's response is parsed:
+        "text" keeps it as is, "mermaid" strips a markdown code block, "json"
+        must parse (else ChainOutputError) and "auto", the default, parses JSON
+        only when the response looks like JSON.
+
+        output_schemas optionally gives a pydantic model per step. The step's
+        JSON is validated straight into that model once (else ChainOutputError)
+        and later prompts can reference its fields, e.g. {{output[-1].nodes[0].id}}.
+
+        deadline (default: the current request's, see deadlines.current) bounds
+        the whole chain: it is checked before each step, raising
+        DeadlineExceeded, and is current while callable runs so LLM calls are
+        bounded too. A step listed in optional_steps, e.g. a review step, is
+        skipped with every step after it when the time left is less than the
+        slowest step so far took; the outputs then end at the last step run.
+        """
+        output_formats, output_schemas = MinimalChainable._output_specs(
+            prompts, output_formats, output_schemas
+        )
+        deadline = deadline or deadlines.current()
+
         # Initialize an empty list to store the outputs
         output = []
         context_filled_prompts = []
+        model_id = tracing.model_id(model)
+        slowest_step = 0.0
 
         # Iterate over each prompt with its index
         for i, prompt in enumerate(prompts):
-            # Iterate over each key-value pair in the context
-            for key, value in context.items():
-                # Check if the key is in the prompt
-                if "{{" + key + "}}" in prompt:
-                    # Replace the key with its value
-                    prompt = prompt.replace("{{" + key + "}}", str(value))
-
-            # Replace references to previous outputs
-            # Iterate from the current index down to 1
-            for j in range(i, 0, -1):
-                # Get the previous output
-                previous_output = output[i - j]
-
-                # Handle JSON (dict) output references
-                # Check if the previous output is a dictionary
-                if isinstance(previous_output, dict):
-                    # Check if the reference is in the prompt
-                    if f"{{{{output[-{j}]}}}}" in prompt:
-                        # Replace the reference with the JSON string
-                        prompt = prompt.replace(
-                            f"{{{{output[-{j}]}}}}", json.dumps(previous_output)
-                        )
-                    # Iterate over each key-value pair in the previous output
-                    for key, value in previous_output.items():
-                        # Check if the key reference is in the prompt
-                        if f"{{{{output[-{j}].{key}}}}}" in prompt:
-                            # Replace the key reference with its value
-                            prompt = prompt.replace(
-                                f"{{{{output[-{j}].{key}}}}}", str(value)
-                            )
-                # If not a dict, use the original string
-                else:
-                    # Check if the reference is in the prompt
-                    if f"{{{{output[-{j}]}}}}" in prompt:
-                        # Replace the reference with the previous output
-                        prompt = prompt.replace(
-                            f"{{{{output[-{j}]}}}}", str(previous_output)
+            # Stop before issuing the next prompt once the chain is cancelled
+            if cancel_event is not None and cancel_event.is_set():
+                raise ChainCancelledError(i)
+
+            deadline.check(f"prompt step {i}")
+            if i in optional_steps and not deadline.has_time(slowest_step):
+                print(
+                    f"Skipping prompt step {i} and later: {deadline.remaining():.1f}s "
+                    f"left, slowest step took {slowest_step:.1f}s"
+                )
+                break
+
+            step_start = time.perf_counter()
+            with (
+                tracing.span("chain_step", model_id=model_id, step=i),
+                deadlines.scope(deadline),
+            ):
+                # Fill context and output references in a single pass over the
+                # compiled template (parsed once per distinct prompt text)
+                with tracing.span(
+                    "template_fill", template_chars=len(prompt)
+                ) as fill_span:
+                    prompt = compile_prompt(prompt).fill(context, output)
+                    fill_span.set(prompt_chars=len(prompt))
+
+                # Append the context filled prompt to the list
+                context_filled_prompts.append(prompt)
+
+                # Call the provided callable with the processed prompt
+                # Get the result by calling the callable with the model and prompt
+                with tracing.span("llm_call", prompt_chars=len(prompt)) as llm_span:
+                    result = callable(model, prompt)
+
+                    # Join streamed responses, reporting chunks as they arrive
+                    if isinstance(result, Iterator):
+                        result = MinimalChainable._consume_stream(i, result, on_chunk)
+                    llm_span.set(response_chars=MinimalChainable._size(result))
+
+                # Try to parse the result as JSON, handling markdown-wrapped JSON
+                with tracing.span(
+                    "json_parse",
+                    response_chars=MinimalChainable._size(result),
+                    output_format=output_formats[i],
+                ) as parse_span:
+                    result = MinimalChainable._parse_result(
+                        result, output_formats[i], i, output_schemas[i]
+                    )
+                    parse_span.set(
+                        parsed_json=isinstance(result, (dict, list, BaseModel))
+                    )
+
+            # Append the result to the output list
+            output.append(result)
+            slowest_step = max(slowest_step, time.perf_counter() - step_start)
+
+        # Return the list of outputs
+        return output, context_filled_prompts
+
+    @staticmethod
+    async def arun(
+        context: Dict[str, Any],
+        model: Any,
+        callable: Callable[[Any, str], Awaitable[Any]],
+        prompts: List[str],
+        output_formats: Optional[List[str]] = None,
+        output_schemas: Optional[List[Optional[Type[BaseModel]]]] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Tuple[List[Any], List[str]]:
+        """
+        Async counterpart of run. Awaits callable(model, prompt) for each step,
+        so many chains can share one event loop without a thread per LLM call.
+
+        Wrap a sync callable such as llm_module.prompt with to_async_callable.
+
+        deadline (default: the current request's) bounds the chain as in run:
+        it is checked before each step and each call is abandoned with
+        DeadlineExceeded once it passes.
+        """
+        output_formats, output_schemas = MinimalChainable._output_specs(
+            prompts, output_formats, output_schemas
+        )
+        deadline = deadline or deadlines.current()
+        output = []
+        context_filled_prompts = []
+        model_id = tracing.model_id(model)
+
+        for i, prompt in enumerate(prompts):
+            deadline.check(f"prompt step {i}")
+            with (
+                tracing.span("chain_step", model_id=model_id, step=i),
+                deadlines.scope(deadline),
+            ):
+                with tracing.span(
+                    "template_fill", template_chars=len(prompt)
+                ) as fill_span:
+                    prompt = compile_prompt(prompt).fill(context, output)
+                    fill_span.set(prompt_chars=len(prompt))
+                context_filled_prompts.append(prompt)
+
+                with tracing.span("llm_call", prompt_chars=len(prompt)) as llm_span:
+                    result = await deadlines.acall(
+                        lambda: callable(model, prompt), "llm_call"
+                    )
+                    llm_span.set(response_chars=MinimalChainable._size(result))
+
+                with tracing.span(
+                    "json_parse",
+                    response_chars=MinimalChainable._size(result),
+                    output_format=output_formats[i],
+                ):
+                    output.append(
+                        MinimalChainable._parse_result(
+                            result, output_formats[i], i, output_schemas[i]
                         )
+                    )
 
-            # Append the context filled prompt to the list
-            context_filled_prompts.append(prompt)
+        return output, context_filled_prompts
+
+    @staticmethod
+    def _consume_stream(
+        step: int,
+        chunks: Iterator[str],
+        on_chunk: Optional[Callable[[int, str], None]],
+    ) -> str:
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk)
+            if on_chunk is not None:
+                on_chunk(step, chunk)
+        return "".join(parts)
 
-            # Call the provided callable with the processed prompt
-            # Get the result by calling the callable with the model and prompt
-            result = callable(model, prompt)
+    @staticmethod
+    def _size(result: Any) -> Optional[int]:
+        return len(result) if isinstance(result, str) else None
+
+    @staticmethod
+    def _output_specs(
+        prompts: List[str],
+        output_formats: Optional[List[str]],
+        output_schemas: Optional[List[Optional[Type[BaseModel]]]],
+    ) -> Tuple[List[str], List[Optional[Type[BaseModel]]]]:
+        if output_formats is None:
+            output_formats = ["auto"] * len(prompts)
+        if output_schemas is None:
+            output_schemas = [None] * len(prompts)
+        for name, specs in (
+            ("output formats", output_formats),
+            ("output schemas", output_schemas),
+        ):
+            if len(specs) != len(prompts):
+                raise ValueError(f"Got {len(specs)} {name} for {len(prompts)} prompts")
+
+        for output_format, output_schema in zip(output_formats, output_schemas):
+            if output_format not in OUTPUT_FORMATS:
+                raise ValueError(
+                    f"Unknown output format {output_format!r}, expected one of {OUTPUT_FORMATS}"
+                )
+            if output_schema is not None and output_format not in ("auto", "json"):
+                raise ValueError(
+                    f"Output schema {output_schema.__name__} needs a json output format, got {output_format!r}"
+                )
+        return output_formats, output_schemas
+
+    @staticmethod
+    def _parse_result(
+        result: Any,
+        output_format: str = "auto",
+        step: int = 0,
+        output_schema: Optional[Type[BaseModel]] = None,
+    ) -> Any:
+        if not isinstance(result, str) or output_format == "text":
+            return result
 
-            print("result", result)
+        if output_format == "mermaid":
+            from .llm_module import parse_markdown_backticks
 
-            # Try to parse the result as JSON, handling markdown-wrapped JSON
+            return parse_markdown_backticks(result)
+
+        if output_schema is not None:
+            return MinimalChainable._validate_schema(result, step, output_schema)
+
+        parsed, is_json = MinimalChainable._parse_json(result)
+        if output_format == "json" and not is_json:
+            raise ChainOutputError(step, "expected a JSON response")
+        return parsed if is_json else result
+
+    @staticmethod
+    def _validate_schema(
+        result: str, step: int, output_schema: Type[BaseModel]
+    ) -> BaseModel:
+        # pydantic parses and validates the JSON text in one pass
+        error = None
+        for candidate in MinimalChainable._json_candidates(result):
             try:
-                # First, attempt to extract JSON from markdown code blocks
-                # Search for JSON in markdown code blocks
-                json_match = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", result)
-                # If a match is found
-                if json_match:
-                    # Parse the JSON from the match
-                    result = json.loads(json_match.group(1))
-                else:
-                    # If no markdown block found, try parsing the entire result
-                    # Parse the entire result as JSON
-                    result = json.loads(result)
+                return output_schema.model_validate_json(candidate)
+            except ValidationError as e:
+                error = e
+        if error is None:
+            raise ChainOutputError(step, "expected a JSON response")
+        raise ChainOutputError(
+            step, f"response does not match {output_schema.__name__}: {error}"
+        )
+
+    @staticmethod
+    def _parse_json(result: str) -> Tuple[Any, bool]:
+        """
+        Parse a bare or markdown-wrapped JSON response, returning (value, True),
+        or (None, False) when it isn't JSON.
+        """
+        for candidate in MinimalChainable._json_candidates(result):
+            try:
+                return json.loads(candidate), True
             except json.JSONDecodeError:
-                # Not JSON, keep as is
                 pass
+        return None, False
 
-            # Append the result to the output list
-            output.append(result)
+    @staticmethod
+    def _json_candidates(result: str) -> Iterator[str]:
+        """
+        Yield the texts in result that may be JSON: the whole response, then
+        its first markdown code block.
 
-        # Return the list of outputs
-        return output, context_filled_prompts
+        Cheap character checks run before any scan, so prose and Mermaid
+        responses don't pay for a regex plus a failed parse.
+        """
+        first_char = FIRST_CHAR_PATTERN.search(result)
+        if first_char is None:
+            return
+
+        # A bare JSON document; json.loads skips the surrounding whitespace itself
+        if first_char.group() in JSON_START_CHARS or (
+            len(result) < 16 and result.strip() in JSON_LITERALS
+        ):
+            yield result
+
+        # A single character search is much cheaper than scanning for "```"
+        if "`" not in result:
+            return
+
+        # Only the first code block is considered, sliced out with str.find
+        # rather than the lazy ```(?:json)?\s*(...)\s*``` regex
+        open_index = result.find("```")
+        if open_index != -1:
+            start = open_index + 3
+            if result.startswith("json", start):
+                start += 4
+            close_index = result.find("```", start)
+            if close_index != -1:
+                block = result[start:close_index].strip()
+                if block[:1] in JSON_START_CHARS or block in JSON_LITERALS:
+                    yield block
 
     @staticmethod
     def to_delim_text_file(name: str, content: List[Union[str, dict, list]]) -> str:
-        result_string = ""
+        text = MinimalChainable.format_delim_text(content)
         with open(f"{name}.txt", "w") as outfile:
-            for i, item in enumerate(content, 1):
-                if isinstance(item, (dict, list)):
-                    item = json.dumps(item)
-                elif not isinstance(item, str):
-                    item = str(item)
-                chain_text_delim = (
-                    f"{'🔗' * i} -------- Prompt Chain Result #{i} -------------\n\n"
-                )
-                outfile.write(chain_text_delim)
-                outfile.write(item)
-                outfile.write("\n\n")
-
-                result_string += chain_text_delim + item + "\n\n"
+            outfile.write(text)
+        return text
 
-        return result_string
+    @staticmethod
+    def format_delim_text(content: List[Union[str, dict, list]]) -> str:
+        parts = []
+        for i, item in enumerate(content, 1):
+            if isinstance(item, BaseModel):
+                item = item.model_dump_json()
+            elif isinstance(item, (dict, list)):
+                item = json.dumps(item)
+            elif not isinstance(item, str):
+                item = str(item)
+            parts.append(
+                f"{'🔗' * i} -------- Prompt Chain Result #{i} -------------\n\n"
+            )
+            parts.append(item)
+            parts.append("\n\n")
+        return "".join(parts)
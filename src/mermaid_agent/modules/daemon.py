@@ -0,0 +1,364 @@
+import base64
+import hmac
+import http.client
+import json
+import os
+import secrets
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+from urllib.parse import urlsplit
+from pydantic import BaseModel, ValidationError
+from mermaid_agent.modules.typings import (
+    BulkMermaidAgentResponse,
+    BulkMermaidParams,
+    IterateMermaidParams,
+    MermaidAgentResponse,
+    OneShotMermaidParams,
+    RenderedImage,
+)
+from mermaid_agent.modules.utils import build_file_path
+
+DAEMON_URL = "http://127.0.0.1:8765"
+# Written by the daemon at startup and read by its clients; only the user can read it
+TOKEN_FILE = os.path.join("~", ".mermaid_agent", "daemon_token")
+# Host headers the daemon answers to, so DNS-rebound pages are refused
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "[::1]")
+
+
+class DaemonError(RuntimeError):
+    """The daemon rejected or failed a request."""
+
+
+def daemon_address() -> Tuple[str, int]:
+    url = urlsplit(os.getenv("MERMAID_DAEMON_URL", DAEMON_URL))
+    return url.hostname or "127.0.0.1", url.port or 8765
+
+
+def token_file() -> str:
+    return os.path.expanduser(os.getenv("MERMAID_DAEMON_TOKEN_FILE", TOKEN_FILE))
+
+
+def write_token(token: str):
+    path = token_file()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Created owner-only so other local users can't borrow the daemon
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(fd, 0o600)
+    with os.fdopen(fd, "w") as file:
+        file.write(token)
+
+
+def read_token() -> Optional[str]:
+    try:
+        with open(token_file()) as file:
+            return file.read().strip() or None
+    except OSError:
+        return None
+
+
+def unsafe_output_file(output_file: str) -> bool:
+    # Output files must stay under the daemon's output directory
+    parts = output_file.replace("\\", "/").split("/")
+    return os.path.isabs(output_file) or ".." in parts
+
+
+def _agent_result(response: MermaidAgentResponse) -> Dict[str, Any]:
+    # Images are sent back for the client to save under its own output
+    # directory, wherever the daemon was started
+    image = None
+    if response.img is not None:
+        image = {
+            "content": base64.b64encode(response.img.content).decode(),
+            "format": response.img.format,
+        }
+    return {
+        "mermaid": response.mermaid,
+        "error": response.error,
+        "image": image,
+        "timed_out": response.timed_out,
+    }
+
+
+# The agents are imported on first request so the client side of this module
+# stays cheap to import
+def _run_mer(params: OneShotMermaidParams) -> Dict[str, Any]:
+    from mermaid_agent import mermaid_agent
+
+    response = mermaid_agent.one_shot_mermaid_agent(params)
+    return _agent_result(response)
+
+
+def _run_mer_bulk(params: BulkMermaidParams) -> Dict[str, Any]:
+    from mermaid_agent import mermaid_agent
+
+    response = mermaid_agent.bulk_mermaid_agent(params)
+    return {"responses": [_agent_result(res) for res in response.responses]}
+
+
+def _run_mer_iter(params: IterateMermaidParams) -> Dict[str, Any]:
+    from mermaid_agent import mermaid_agent
+
+    response = mermaid_agent.iterate_mermaid_agent(params)
+    return _agent_result(response)
+
+
+ROUTES: Dict[str, Tuple[Type[BaseModel], Callable[[Any], Dict[str, Any]]]] = {
+    "/mer": (OneShotMermaidParams, _run_mer),
+    "/mer-bulk": (BulkMermaidParams, _run_mer_bulk),
+    "/mer-iter": (IterateMermaidParams, _run_mer_iter),
+}
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON over HTTP: POST an agent's params model to /mer, /mer-bulk or
+    /mer-iter; GET /health to check the daemon is up.
+
+    Every request needs a loopback Host header and the daemon's token as
+    "Authorization: Bearer <token>", and POSTs need an application/json
+    body. Web pages can't send any of these cross-origin without a CORS
+    preflight, which the daemon never answers.
+    """
+
+    def _authorized(self) -> bool:
+        host = self.headers.get("Host", "")
+        hostname = host.rsplit(":", 1)[0] if not host.endswith("]") else host
+        if hostname not in LOOPBACK_HOSTS:
+            self._send(403, {"error": f"Host {host!r} is not a loopback address"})
+            return False
+        authorization = self.headers.get("Authorization", "")
+        expected = f"Bearer {self.server.token}"
+        if not hmac.compare_digest(authorization.encode(), expected.encode()):
+            self._send(401, {"error": "Missing or wrong daemon token"})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path != "/health":
+            self._send(404, {"error": f"Unknown path {self.path}"})
+            return
+        from mermaid_agent.modules import llm_module
+
+        self._send(
+            200,
+            {"status": "ok", "pid": os.getpid(), "models": sorted(llm_module._models)},
+        )
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.split(";")[0].strip() != "application/json":
+            self._send(415, {"error": "Expected an application/json body"})
+            return
+        route = ROUTES.get(self.path)
+        if route is None:
+            self._send(404, {"error": f"Unknown path {self.path}"})
+            return
+        params_type, run = route
+
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            params = params_type.model_validate_json(body)
+        except ValidationError as e:
+            self._send(400, {"error": str(e)})
+            return
+        if unsafe_output_file(params.output_file):
+            self._send(
+                400,
+                {
+                    "error": "output_file must be a relative path without '..', "
+                    f"got {params.output_file!r}"
+                },
+            )
+            return
+        try:
+            result = run(params)
+        except Exception as e:
+            self._send(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        self._send(200, result)
+
+    def _send(self, status: int, body: Dict[str, Any]):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def build_server(
+    host: Optional[str] = None,
+    port: Optional[int] = None,
+    token: Optional[str] = None,
+) -> ThreadingHTTPServer:
+    """A daemon server; clients must send token, a fresh random one by default."""
+    default_host, default_port = daemon_address()
+    server = ThreadingHTTPServer(
+        (host or default_host, default_port if port is None else port),
+        DaemonRequestHandler,
+    )
+    server.daemon_threads = True
+    server.token = token or secrets.token_urlsafe(32)
+    return server
+
+
+def serve(
+    host: Optional[str] = None,
+    port: Optional[int] = None,
+    model_ids: Optional[List[str]] = None,
+):
+    """
+    Run the daemon until interrupted.
+
+    Models are built up front, and the renderer, its pooled connections and
+    the render and LLM caches live for the whole process, so each request
+    skips the CLI's import and setup cost.
+    """
+    from mermaid_agent import mermaid_agent
+    from mermaid_agent.modules import mermaid
+
+    server = build_server(host, port)
+    write_token(server.token)
+    for model_id in model_ids or [None]:
+        mermaid_agent.build_model(model_id)
+    mermaid.get_renderer()
+
+    bound_host, bound_port = server.server_address[:2]
+    print(f"Mermaid agent daemon listening on http://{bound_host}:{bound_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if read_token() == server.token:
+            os.remove(token_file())
+
+
+class DaemonClient:
+    """
+    Runs agent requests on a daemon. Its methods match the mermaid_agent
+    functions the CLI calls, so the CLI can use either one.
+    """
+
+    def __init__(self, host: str, port: int, token: str):
+        self.host = host
+        self.port = port
+        self.token = token
+
+    def _headers(self) -> Dict[str, str]:
+        # An explicit loopback Host, whatever address the daemon listens on
+        return {
+            "Host": f"127.0.0.1:{self.port}",
+            "Authorization": f"Bearer {self.token}",
+        }
+
+    def health(self, timeout: float = 0.5) -> Optional[Dict[str, Any]]:
+        """The daemon's /health body, or None if no daemon is listening."""
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+        try:
+            connection.request("GET", "/health", headers=self._headers())
+            response = connection.getresponse()
+            if response.status != 200:
+                return None
+            return json.loads(response.read())
+        except (OSError, http.client.HTTPException, ValueError):
+            return None
+        finally:
+            connection.close()
+
+    def _post(self, path: str, params: BaseModel, **dump_options) -> Dict[str, Any]:
+        # No timeout: LLM calls and renders can take minutes
+        connection = http.client.HTTPConnection(self.host, self.port)
+        try:
+            connection.request(
+                "POST",
+                path,
+                body=params.model_dump_json(**dump_options),
+                headers={**self._headers(), "Content-Type": "application/json"},
+            )
+            response = connection.getresponse()
+            body = json.loads(response.read())
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise DaemonError(
+                f"Daemon {path} failed ({response.status}): {body['error']}"
+            )
+        return body
+
+    @staticmethod
+    def _response(result: Dict[str, Any], output_file: str) -> MermaidAgentResponse:
+        # Saved where the agent would have saved it running in-process
+        img = None
+        if result["image"]:
+            img = RenderedImage(
+                content=base64.b64decode(result["image"]["content"]),
+                format=result["image"]["format"],
+            )
+            img.save(build_file_path(output_file))
+        return MermaidAgentResponse(
+            img=img,
+            mermaid=result["mermaid"],
+            error=result["error"],
+            timed_out=result.get("timed_out", False),
+        )
+
+    @staticmethod
+    def _absolute_input(params: BaseModel) -> BaseModel:
+        # The daemon may run from another directory
+        if params.input_file:
+            return params.model_copy(
+                update={"input_file": os.path.abspath(params.input_file)}
+            )
+        return params
+
+    def one_shot_mermaid_agent(
+        self, params: OneShotMermaidParams
+    ) -> MermaidAgentResponse:
+        return self._response(
+            self._post("/mer", self._absolute_input(params)), params.output_file
+        )
+
+    def bulk_mermaid_agent(
+        self,
+        params: BulkMermaidParams,
+        on_complete: Optional[Callable[[int, MermaidAgentResponse], None]] = None,
+    ) -> BulkMermaidAgentResponse:
+        # The daemon answers once the whole batch is done
+        result = self._post("/mer-bulk", self._absolute_input(params))
+        responses = [
+            self._response(res, f"{i+1}_{params.output_file}")
+            for i, res in enumerate(result["responses"])
+        ]
+        if on_complete:
+            for index, response in enumerate(responses):
+                on_complete(index, response)
+        return BulkMermaidAgentResponse(responses=responses)
+
+    def iterate_mermaid_agent(
+        self, params: IterateMermaidParams
+    ) -> MermaidAgentResponse:
+        result = self._post(
+            "/mer-iter", self._absolute_input(params), exclude={"current_mermaid_img"}
+        )
+        return self._response(result, params.output_file)
+
+
+def connect() -> Optional[DaemonClient]:
+    """
+    A client for the daemon at $MERMAID_DAEMON_URL if one is running and its
+    token file is readable, else None. MERMAID_DAEMON=off always runs agents
+    in-process.
+    """
+    if os.getenv("MERMAID_DAEMON", "auto") == "off":
+        return None
+    token = read_token()
+    if token is None:
+        return None
+    client = DaemonClient(*daemon_address(), token)
+    return client if client.health() is not None else None
@@ -0,0 +1,211 @@
+import asyncio
+import contextlib
+import contextvars
+import queue
+import threading
+import time
+from typing import Any, Awaitable, Callable, Iterator, Optional
+
+# How often a caller blocked on a bounded call re-checks for cancellation
+POLL_SECONDS = 0.05
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a request runs out of time or is cancelled, naming the stage it stopped in."""
+
+    def __init__(self, stage: str, cancelled: bool = False):
+        reason = "cancelled" if cancelled else "deadline exceeded"
+        super().__init__(f"Request {reason} during {stage}")
+        self.stage = stage
+        self.cancelled = cancelled
+
+
+class Deadline:
+    """
+    The time a request must finish by, and a flag to cancel it sooner.
+
+    A timeout of None never expires, though it can still be cancelled. A child
+    deadline expires no later than its parent and is cancelled with it, so a
+    step can get a tighter budget, or be cancelled on its own, without
+    affecting the rest of the request.
+    """
+
+    def __init__(
+        self, timeout: Optional[float] = None, parent: Optional["Deadline"] = None
+    ):
+        expires_at = None if timeout is None else time.monotonic() + timeout
+        if parent is not None and parent.expires_at is not None:
+            expires_at = (
+                parent.expires_at
+                if expires_at is None
+                else min(expires_at, parent.expires_at)
+            )
+        self.expires_at = expires_at
+        self.parent = parent
+        self._cancelled = threading.Event()
+
+    def child(self, timeout: Optional[float] = None) -> "Deadline":
+        return Deadline(timeout, parent=self)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set() or (
+            self.parent is not None and self.parent.cancelled
+        )
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left, or None without a time limit."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.cancelled or self.remaining() == 0.0
+
+    def has_time(self, seconds: float) -> bool:
+        """Whether work expected to take seconds can finish in time."""
+        remaining = self.remaining()
+        return not self.cancelled and (remaining is None or remaining >= seconds)
+
+    def cap(self, seconds: float) -> float:
+        """seconds, or the time left if that is shorter."""
+        remaining = self.remaining()
+        return seconds if remaining is None else min(seconds, remaining)
+
+    def check(self, stage: str):
+        """Raise DeadlineExceeded if the deadline has passed or was cancelled."""
+        if self.cancelled:
+            raise DeadlineExceeded(stage, cancelled=True)
+        if self.remaining() == 0.0:
+            raise DeadlineExceeded(stage)
+
+
+_current_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar(
+    "deadline", default=None
+)
+
+
+def current() -> Deadline:
+    """The deadline of the request running in this context, else an unlimited one."""
+    deadline = _current_deadline.get()
+    return deadline if deadline is not None else Deadline()
+
+
+@contextlib.contextmanager
+def scope(deadline: Deadline) -> Iterator[Deadline]:
+    """
+    Make deadline the current one for the enclosed block. Like tracing spans,
+    it reaches worker threads through tracing.in_current_context.
+    """
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def start(timeout: Optional[float]) -> contextlib.AbstractContextManager:
+    """Scope a request: timeout seconds from now, within any enclosing deadline."""
+    return scope(current().child(timeout))
+
+
+def call(fn: Callable[[], Any], stage: str) -> Any:
+    """
+    Run fn() within the current deadline.
+
+    Without a time limit fn runs on the calling thread. With one, fn runs on a
+    daemon thread and the caller stops waiting with DeadlineExceeded once the
+    deadline passes or is cancelled; the abandoned call finishes in the
+    background and its result is dropped. Use it for blocking calls, like a
+    provider's HTTP request, that have no timeout of their own.
+    """
+    deadline = current()
+    deadline.check(stage)
+    if deadline.expires_at is None:
+        return fn()
+
+    outcome = {}
+    context = contextvars.copy_context()
+
+    def run():
+        try:
+            outcome["value"] = context.run(fn)
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=run, name=f"deadline-{stage}", daemon=True)
+    thread.start()
+    # Wake up regularly so cancellation is noticed before the deadline
+    thread.join(deadline.cap(POLL_SECONDS))
+    while thread.is_alive():
+        deadline.check(stage)
+        thread.join(deadline.cap(POLL_SECONDS))
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["value"]
+
+
+async def acall(make_awaitable: Callable[[], Awaitable[Any]], stage: str) -> Any:
+    """
+    Await make_awaitable() within the current deadline, like call but without
+    blocking the event loop: once the deadline passes or is cancelled the
+    awaitable is cancelled and DeadlineExceeded is raised.
+    """
+    deadline = current()
+    deadline.check(stage)
+    if deadline.expires_at is None:
+        return await make_awaitable()
+
+    task = asyncio.ensure_future(make_awaitable())
+    try:
+        # Wake up regularly so cancellation is noticed before the deadline
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=deadline.cap(POLL_SECONDS))
+            if done:
+                return task.result()
+            deadline.check(stage)
+    finally:
+        task.cancel()
+
+
+def iterate(make_iterator: Callable[[], Iterator[Any]], stage: str) -> Iterator[Any]:
+    """
+    Yield from make_iterator() within the current deadline, like call but
+    for a stream: each item must arrive before the deadline.
+    """
+    deadline = current()
+    deadline.check(stage)
+    if deadline.expires_at is None:
+        for item in make_iterator():
+            deadline.check(stage)
+            yield item
+        return
+
+    items: "queue.Queue[tuple]" = queue.Queue()
+    context = contextvars.copy_context()
+
+    def produce():
+        try:
+            for item in make_iterator():
+                items.put(("item", item))
+            items.put(("end", None))
+        except BaseException as e:
+            items.put(("error", e))
+
+    threading.Thread(
+        target=context.run, args=(produce,), name=f"deadline-{stage}", daemon=True
+    ).start()
+    while True:
+        try:
+            kind, value = items.get(timeout=deadline.cap(POLL_SECONDS))
+        except queue.Empty:
+            deadline.check(stage)
+            continue
+        if kind == "end":
+            return
+        if kind == "error":
+            raise value
+        yield value
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+from mermaid_agent.modules.utils import OUTPUT_DIR
+
+LLM_CACHE_PATH = os.path.join(OUTPUT_DIR, "llm_cache.sqlite")
+
+
+class LLMResponseCache:
+    """
+    SQLite-backed cache of LLM responses.
+
+    Entries are keyed on the model id, a hash of the fully context-filled prompt
+    and the generation options. Entries older than ttl_seconds are treated as
+    misses, and least recently used entries are evicted once the cache holds
+    more than max_entries or max_bytes of responses.
+    """
+
+    def __init__(
+        self,
+        path: str = LLM_CACHE_PATH,
+        ttl_seconds: float = 7 * 24 * 60 * 60,
+        max_entries: int = 10_000,
+        max_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    model_id TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """)
+
+    @staticmethod
+    def key(model_id: str, prompt: str, options: Dict[str, Any]) -> str:
+        digest = hashlib.sha256(prompt.encode("utf8")).hexdigest()
+        options_json = json.dumps(options, sort_keys=True, default=str)
+        return hashlib.sha256(
+            f"{model_id}\0{digest}\0{options_json}".encode("utf8")
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._connection.execute(
+                        "DELETE FROM responses WHERE key = ?", (key,)
+                    )
+                self.misses += 1
+                return None
+
+            self._connection.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, model_id: str, response: str):
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_id, response, len(response.encode("utf8")), now, now),
+            )
+            self._evict()
+
+    def _evict(self):
+        # Keep the most recently used entries within both the count and byte budgets
+        self._connection.execute(
+            """
+            DELETE FROM responses WHERE key IN (
+                SELECT key FROM (
+                    SELECT
+                        key,
+                        ROW_NUMBER() OVER (ORDER BY accessed_at DESC) AS position,
+                        SUM(size) OVER (ORDER BY accessed_at DESC) AS running_size
+                    FROM responses
+                )
+                WHERE position > ? OR running_size > ?
+            )
+            """,
+            (self.max_entries, self.max_bytes),
+        )
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries, size = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": entries,
+                "bytes": size,
+            }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+_llm_cache: Optional[LLMResponseCache] = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMResponseCache:
+    global _llm_cache
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = LLMResponseCache(
+                path=os.getenv("LLM_CACHE_PATH", LLM_CACHE_PATH),
+                ttl_seconds=float(os.getenv("LLM_CACHE_TTL_SECONDS", 7 * 24 * 60 * 60)),
+            )
+        return _llm_cache
+
+
+def set_llm_cache(cache: Optional[LLMResponseCache]):
+    global _llm_cache
+    with _llm_cache_lock:
+        _llm_cache = cache
@@ -1,13 +1,29 @@
-import llm
-from dotenv import load_dotenv
 import os
-from mako.template import Template
+import threading
+from typing import TYPE_CHECKING, Dict, Iterator, Optional
+from mermaid_agent.modules import deadlines, llm_cache, rate_limit
 
-# Load environment variables from .env file
-load_dotenv()
+# llm (with its provider plugins), mako and dotenv are imported on first use so
+# CLI startup does not pay for them
+if TYPE_CHECKING:
+    import llm
+
+_env_loaded = False
+
+
+def load_env():
+    """Load environment variables from the .env file, once per process."""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        _env_loaded = True
 
 
 def conditional_render(prompt, context, start_delim="% if", end_delim="% endif"):
+    from mako.template import Template
+
     template = Template(prompt)
     return template.render(**context)
 
@@ -23,76 +39,169 @@ def parse_markdown_backticks(str) -> str:
     return str.strip()
 
 
-def prompt(model: llm.Model, prompt: str):
-    res = model.prompt(prompt)
-    return res.text()
+class MermaidStreamExtractor:
+    """
+    Incremental counterpart to parse_markdown_backticks for streamed responses.
+
+    feed returns the fenced block as soon as its closing backticks arrive, so
+    validation and rendering can start before the stream ends. Unfenced
+    responses are only complete once the stream ends; finish returns the
+    result for either case.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.block: Optional[str] = None
+        self._body_start: Optional[int] = None
+        self._search_from = 0
+
+    def feed(self, chunk: str) -> Optional[str]:
+        self.text += chunk
+        if self.block is not None:
+            return None
+
+        if self._body_start is None:
+            open_index = self.text.find("```", self._search_from)
+            newline_index = (
+                self.text.find("\n", open_index + 3) if open_index != -1 else -1
+            )
+            if newline_index == -1:
+                # Backticks or the language line may be split across chunks
+                self._search_from = (
+                    max(0, len(self.text) - 3) if open_index == -1 else open_index
+                )
+                return None
+            self._body_start = newline_index + 1
+            self._search_from = self._body_start
+
+        close_index = self.text.find("```", self._search_from)
+        if close_index == -1:
+            self._search_from = max(self._body_start, len(self.text) - 2)
+            return None
+
+        self.block = self.text[self._body_start : close_index].strip()
+        return self.block
+
+    def finish(self) -> str:
+        if self.block is not None:
+            return self.block
+        return parse_markdown_backticks(self.text)
+
+
+def prompt(model: "llm.Model", prompt: str, **options):
+    rate_limit.acquire(model.model_id)
+    # Bounded by the request's deadline; providers may otherwise never answer
+    return deadlines.call(
+        lambda: model.prompt(prompt, **options).text(), f"llm_call {model.model_id}"
+    )
 
 
-def get_model_name(model: llm.Model):
-    return model.model_id
+def stream_prompt(model: "llm.Model", prompt: str, **options) -> Iterator[str]:
+    """Like prompt, but yields text chunks as the model streams them."""
+    rate_limit.acquire(model.model_id)
+    yield from deadlines.iterate(
+        lambda: iter(model.prompt(prompt, stream=True, **options)),
+        f"llm_call {model.model_id}",
+    )
 
 
-def build_sonnet_3_5():
-    ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+def cached_prompt(model: "llm.Model", prompt_text: str, **options):
+    """
+    prompt, memoized in the persistent LLM response cache.
 
-    sonnet_3_5_model: llm.Model = llm.get_model("claude-3.5-sonnet")
-    sonnet_3_5_model.key = ANTHROPIC_API_KEY
+    Keyed on the model id, the filled prompt and the generation options, so
+    re-running an unchanged chain (e.g. CI diagram regeneration) skips the LLM.
+    """
+    cache = llm_cache.get_llm_cache()
+    key = llm_cache.LLMResponseCache.key(model.model_id, prompt_text, options)
+    response = cache.get(key)
+    if response is None:
+        response = prompt(model, prompt_text, **options)
+        cache.put(key, model.model_id, response)
+    return response
 
-    return sonnet_3_5_model
 
+def prompt_callable(use_cache: bool, stream: bool = False):
+    """
+    The chain callable for an agent call.
 
-def build_mini_model():
-    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-    gpt4_o_mini_model: llm.Model = llm.get_model("gpt-4o-mini")
-    gpt4_o_mini_model.key = OPENAI_API_KEY
-    return gpt4_o_mini_model
+    Cached responses return at once, so caching takes precedence over streaming.
+    """
+    if use_cache:
+        return cached_prompt
+    return stream_prompt if stream else prompt
 
 
-def build_big_3_models():
-    ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
-    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+def get_model_name(model: "llm.Model"):
+    return model.model_id
 
-    sonnet_3_5_model: llm.Model = llm.get_model("claude-3.5-sonnet")
-    sonnet_3_5_model.key = ANTHROPIC_API_KEY
 
-    gpt4_o_model: llm.Model = llm.get_model("4o")
-    gpt4_o_model.key = OPENAI_API_KEY
+DEFAULT_MODEL = "gpt-4o-2024-08-06"
 
-    gemini_1_5_pro_model: llm.Model = llm.get_model("gemini-1.5-pro-latest")
-    gemini_1_5_pro_model.key = GEMINI_API_KEY
+_models: Dict[str, "llm.Model"] = {}
+_models_lock = threading.Lock()
 
-    return sonnet_3_5_model, gpt4_o_model, gemini_1_5_pro_model
 
+def api_key_env(model_id: str) -> str:
+    if model_id.startswith("claude"):
+        return "ANTHROPIC_API_KEY"
+    if model_id.startswith("gemini"):
+        return "GEMINI_API_KEY"
+    return "OPENAI_API_KEY"
 
-def build_latest_openai():
-    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-    # chatgpt_4o_latest_model: llm.Model = llm.get_model("chatgpt-4o-latest") - experimental
-    chatgpt_4o_latest_model: llm.Model = llm.get_model("gpt-4o-2024-08-06")
-    chatgpt_4o_latest_model.key = OPENAI_API_KEY
-    return chatgpt_4o_latest_model
+def get_model(model_id: str = DEFAULT_MODEL) -> "llm.Model":
+    """
+    Return the llm.Model for model_id, building it once per process.
 
+    llm.get_model runs plugin discovery, so agents share the built model
+    instead of rebuilding it on every call. Safe to call from many threads.
+    """
+    model = _models.get(model_id)
+    if model is not None:
+        return model
 
-def build_big_3_plus_mini_models():
+    with _models_lock:
+        model = _models.get(model_id)
+        if model is None:
+            import llm
 
-    ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
-    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+            load_env()
+            model = llm.get_model(model_id)
+            model.key = os.getenv(api_key_env(model_id))
+            _models[model_id] = model
+        return model
 
-    sonnet_3_5_model: llm.Model = llm.get_model("claude-3.5-sonnet")
-    sonnet_3_5_model.key = ANTHROPIC_API_KEY
 
-    gpt4_o_model: llm.Model = llm.get_model("4o")
-    gpt4_o_model.key = OPENAI_API_KEY
+def build_sonnet_3_5():
+    sonnet_3_5_model: llm.Model = get_model("claude-3.5-sonnet")
+    return sonnet_3_5_model
+
 
-    gemini_1_5_pro_model: llm.Model = llm.get_model("gemini-1.5-pro-latest")
-    gemini_1_5_pro_model.key = GEMINI_API_KEY
+def build_mini_model():
+    gpt4_o_mini_model: llm.Model = get_model("gpt-4o-mini")
+    return gpt4_o_mini_model
 
-    gpt4_o_mini_model: llm.Model = llm.get_model("gpt-4o-mini")
-    gpt4_o_mini_model.key = OPENAI_API_KEY
 
-    chatgpt_4o_latest_model = build_latest_openai()
+def build_big_3_models():
+    sonnet_3_5_model: llm.Model = get_model("claude-3.5-sonnet")
+    gpt4_o_model: llm.Model = get_model("4o")
+    gemini_1_5_pro_model: llm.Model = get_model("gemini-1.5-pro-latest")
+
+    return sonnet_3_5_model, gpt4_o_model, gemini_1_5_pro_model
+
+
+def build_latest_openai():
+    # chatgpt_4o_latest_model: llm.Model = get_model("chatgpt-4o-latest") - experimental
+    chatgpt_4o_latest_model: llm.Model = get_model("gpt-4o-2024-08-06")
+    return chatgpt_4o_latest_model
+
+
+def build_big_3_plus_mini_models():
+    sonnet_3_5_model: llm.Model = get_model("claude-3.5-sonnet")
+    gpt4_o_model: llm.Model = get_model("4o")
+    gemini_1_5_pro_model: llm.Model = get_model("gemini-1.5-pro-latest")
+    gpt4_o_mini_model: llm.Model = get_model("gpt-4o-mini")
 
     return (
         sonnet_3_5_model,
@@ -103,12 +212,7 @@ def build_big_3_plus_mini_models():
 
 
 def build_gemini_duo():
-    gemini_1_5_pro: llm.Model = llm.get_model("gemini-1.5-pro-latest")
-    gemini_1_5_flash: llm.Model = llm.get_model("gemini-1.5-flash-latest")
-
-    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-
-    gemini_1_5_pro.key = GEMINI_API_KEY
-    gemini_1_5_flash.key = GEMINI_API_KEY
+    gemini_1_5_pro: llm.Model = get_model("gemini-1.5-pro-latest")
+    gemini_1_5_flash: llm.Model = get_model("gemini-1.5-flash-latest")
 
     return gemini_1_5_pro, gemini_1_5_flash
@@ -1,38 +1,487 @@
+import abc
 import base64
-from typing import Optional
-import requests
-from PIL import Image, UnidentifiedImageError
-import io
+import concurrent.futures
+import json
+import os
+import queue
+import random
+import subprocess
+import threading
+import time
+from typing import TYPE_CHECKING, List, Optional
+from mermaid_agent.modules import deadlines, mermaid_validator, rate_limit, tracing
+from mermaid_agent.modules.deadlines import DeadlineExceeded
+from mermaid_agent.modules.render_cache import RenderCache, get_render_cache
+from mermaid_agent.modules.typings import (
+    RenderBatchResponse,
+    RenderedImage,
+    RenderOptions,
+    RenderResult,
+    image_format,
+)
 from mermaid_agent.modules.utils import build_file_path
 
+# requests is only needed to render through mermaid.ink; import it on first use
+if TYPE_CHECKING:
+    import requests
 
-def build_image(graph, filename):
-    graphbytes = graph.encode("utf8")
-    base64_bytes = base64.b64encode(graphbytes)
-    base64_string = base64_bytes.decode("ascii")
+MERMAID_INK_URL = "https://mermaid.ink"
+WORKER_SCRIPT = os.path.join(os.path.dirname(__file__), "mermaid_worker.mjs")
 
-    width = 500
-    height = 500
-    scale = 2
-    theme = "dark"  # Options: "default", "neutral", "dark", "forest", "base"
 
-    url = (
-        "https://mermaid.ink/img/"
-        + base64_string
-        + f"?width={width}&height={height}&scale={scale}&theme={theme}&bgColor=2a303c"
+class MermaidRenderError(Exception):
+    """Raised by a renderer when a Mermaid graph cannot be rendered."""
+
+
+class InvalidMermaidError(MermaidRenderError):
+    """Raised for charts that fail local validation, before any render."""
+
+
+class MermaidRenderer(abc.ABC):
+    """
+    Renders Mermaid graph text to encoded image bytes.
+    """
+
+    # Renders this renderer can usefully run at once
+    max_concurrency = 1
+
+    @abc.abstractmethod
+    def render(self, graph: str, options: RenderOptions) -> bytes:
+        """Render graph, raising MermaidRenderError if it cannot be rendered."""
+
+    def close(self):
+        pass
+
+
+_http_session: Optional["requests.Session"] = None
+_http_session_lock = threading.Lock()
+
+# Statuses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def get_http_session(max_connections: int = 16) -> "requests.Session":
+    """
+    The shared keep-alive session for mermaid.ink, created once per process.
+
+    Its connection pool holds up to max_connections sockets per host so parallel
+    renders reuse TCP/TLS connections instead of a fresh handshake per diagram.
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            import requests
+            import requests.adapters
+
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=4, pool_maxsize=max_connections
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _http_session = session
+        return _http_session
+
+
+class MermaidInkRenderer(MermaidRenderer):
+    """
+    Renders through the mermaid.ink HTTP API over the shared pooled session.
+
+    base_url can point at the public service, a self-hosted mermaid.ink or a local stand-in.
+    Connection errors, timeouts, 429 and 5xx responses are retried up to max_retries
+    times with jittered exponential backoff.
+    """
+
+    def __init__(
+        self,
+        base_url: str = MERMAID_INK_URL,
+        connect_timeout: float = 5,
+        read_timeout: float = 30,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        max_connections: int = 16,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_connections = max_connections
+
+    @property
+    def max_concurrency(self) -> int:
+        return self.max_connections
+
+    def build_url(self, graph: str, options: RenderOptions) -> str:
+        graphbytes = graph.encode("utf8")
+        base64_bytes = base64.b64encode(graphbytes)
+        base64_string = base64_bytes.decode("ascii")
+
+        # /svg and /pdf return the vector document; /img rasterizes
+        render_format = options.format or "png"
+        if render_format == "pdf":
+            return (
+                f"{self.base_url}/pdf/"
+                + base64_string
+                + f"?fit&theme={options.theme}&bgColor={options.bg_color}"
+            )
+        endpoint = "svg" if render_format == "svg" else "img"
+        url = (
+            f"{self.base_url}/{endpoint}/"
+            + base64_string
+            + f"?width={options.width}&height={options.height}&scale={options.scale}"
+            + f"&theme={options.theme}&bgColor={options.bg_color}"
+        )
+        return url if render_format == "svg" else url + "&type=png"
+
+    def _backoff_delay(self, attempt: int, response=None) -> float:
+        # Not `if response`: a Response is falsy for the 429/5xx statuses retried here
+        retry_after = (
+            response.headers.get("Retry-After") if response is not None else None
+        )
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.read_timeout)
+        # Full jitter: spreads retries from parallel renders apart
+        return random.uniform(0, self.backoff * (2**attempt))
+
+    @staticmethod
+    def _wait_to_retry(delay: float, deadline: deadlines.Deadline):
+        # A retry that cannot start before the deadline is not worth waiting for
+        if not deadline.has_time(delay):
+            raise DeadlineExceeded("render")
+        time.sleep(delay)
+
+    def render(self, graph: str, options: RenderOptions) -> bytes:
+        import requests
+
+        session = get_http_session(self.max_connections)
+        url = self.build_url(graph, options)
+        deadline = deadlines.current()
+
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            rate_limit.acquire("mermaid.ink")
+            deadline.check("render")
+            try:
+                response = session.get(
+                    url,
+                    timeout=(
+                        deadline.cap(self.connect_timeout),
+                        deadline.cap(self.read_timeout),
+                    ),
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                deadline.check("render")
+                if last_attempt:
+                    raise MermaidRenderError(f"mermaid.ink request failed: {e}") from e
+                self._wait_to_retry(self._backoff_delay(attempt), deadline)
+                continue
+            except requests.RequestException as e:
+                raise MermaidRenderError(f"mermaid.ink request failed: {e}") from e
+
+            if response.status_code == 200:
+                return response.content
+
+            if response.status_code in RETRY_STATUSES and not last_attempt:
+                self._wait_to_retry(self._backoff_delay(attempt, response), deadline)
+                continue
+
+            raise MermaidRenderError(
+                f"mermaid.ink returned {response.status_code}: {response.text[:200]}"
+            )
+
+
+class MermaidCliRenderer(MermaidRenderer):
+    """
+    Renders offline through a long-lived local worker process.
+
+    The default worker (mermaid_worker.mjs) keeps one headless browser open with
+    @mermaid-js/mermaid-cli, so each render skips process and browser start-up.
+    Requests and responses are JSON lines over the worker's stdin/stdout:
+
+        {"id": 1, "graph": "...", "format": "png", "width": 500, ...}
+        {"id": 1, "ok": true, "data": "<base64>"} or {"id": 1, "ok": false, "error": "..."}
+    """
+
+    def __init__(self, command: Optional[List[str]] = None):
+        self.command = command or ["node", WORKER_SCRIPT]
+        self._process: Optional[subprocess.Popen] = None
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def _ensure_process(self) -> subprocess.Popen:
+        if self._process is None or self._process.poll() is not None:
+            self._process = subprocess.Popen(
+                self.command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                text=True,
+                bufsize=1,
+            )
+        return self._process
+
+    def render(self, graph: str, options: RenderOptions) -> bytes:
+        deadline = deadlines.current()
+        # One request in flight per worker; the worker answers in order
+        with self._lock:
+            deadline.check("render")
+            process = self._ensure_process()
+            self._next_id += 1
+            request = {
+                "id": self._next_id,
+                "graph": graph,
+                "format": options.format or "png",
+                "width": options.width,
+                "height": options.height,
+                "scale": options.scale,
+                "theme": options.theme,
+                "bgColor": f"#{options.bg_color}",
+            }
+            # Past the deadline the worker is killed, ending the blocked read;
+            # the next render starts a new one
+            remaining = deadline.remaining()
+            timer = threading.Timer(remaining, process.kill) if remaining else None
+            if timer:
+                timer.start()
+            try:
+                process.stdin.write(json.dumps(request) + "\n")
+                process.stdin.flush()
+                line = process.stdout.readline()
+            except (BrokenPipeError, OSError) as e:
+                deadline.check("render")
+                raise MermaidRenderError(f"Mermaid worker failed: {e}") from e
+            finally:
+                if timer:
+                    timer.cancel()
+
+            if not line:
+                deadline.check("render")
+                raise MermaidRenderError("Mermaid worker exited without a response")
+
+            try:
+                response = json.loads(line)
+            except ValueError:
+                # Out of step with the worker (a stray log line or a partial
+                # response); the next render starts a fresh one
+                process.kill()
+                process.wait()
+                raise MermaidRenderError(
+                    f"Mermaid worker sent an invalid response: {line[:200]!r}"
+                ) from None
+
+        if not response.get("ok"):
+            raise MermaidRenderError(response.get("error", "Unknown render error"))
+        return base64.b64decode(response["data"])
+
+    def close(self):
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                self._process.stdin.close()
+                try:
+                    self._process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self._process.kill()
+            self._process = None
+
+
+class MermaidRendererPool(MermaidRenderer):
+    """
+    Spreads renders over several renderers, e.g. one MermaidCliRenderer per
+    worker process, handing each render to whichever renderer is idle.
+    """
+
+    def __init__(self, renderers: List[MermaidRenderer]):
+        self.renderers = renderers
+        self._idle: "queue.Queue[MermaidRenderer]" = queue.Queue()
+        for renderer in renderers:
+            self._idle.put(renderer)
+
+    @property
+    def max_concurrency(self) -> int:
+        return sum(renderer.max_concurrency for renderer in self.renderers)
+
+    def render(self, graph: str, options: RenderOptions) -> bytes:
+        renderer = self._idle.get()
+        try:
+            return renderer.render(graph, options)
+        finally:
+            self._idle.put(renderer)
+
+    def close(self):
+        for renderer in self.renderers:
+            renderer.close()
+
+
+_renderer: Optional[MermaidRenderer] = None
+_renderer_lock = threading.Lock()
+
+
+def build_renderer() -> MermaidRenderer:
+    # MERMAID_RENDERER=local renders offline through the mermaid-cli worker, or
+    # a pool of MERMAID_RENDER_WORKERS workers
+    if os.getenv("MERMAID_RENDERER", "ink") == "local":
+        workers = int(os.getenv("MERMAID_RENDER_WORKERS", "1"))
+        if workers > 1:
+            return MermaidRendererPool([MermaidCliRenderer() for _ in range(workers)])
+        return MermaidCliRenderer()
+    return MermaidInkRenderer(
+        base_url=os.getenv("MERMAID_INK_URL", MERMAID_INK_URL),
+        connect_timeout=float(os.getenv("MERMAID_INK_CONNECT_TIMEOUT", "5")),
+        read_timeout=float(os.getenv("MERMAID_INK_READ_TIMEOUT", "30")),
+        max_retries=int(os.getenv("MERMAID_INK_MAX_RETRIES", "3")),
+        max_connections=int(os.getenv("MERMAID_INK_MAX_CONNECTIONS", "16")),
     )
 
-    response = requests.get(url)
+
+def get_renderer() -> MermaidRenderer:
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = build_renderer()
+        return _renderer
+
+
+def set_renderer(renderer: Optional[MermaidRenderer]):
+    global _renderer
+    with _renderer_lock:
+        if _renderer is not None and _renderer is not renderer:
+            _renderer.close()
+        _renderer = renderer
+
+
+def build_image(graph, filename, options: Optional[RenderOptions] = None):
+    # Without an explicit format, render the format filename's extension names
+    options = (options or RenderOptions()).for_file(filename)
     try:
-        return Image.open(io.BytesIO(response.content))
-    except UnidentifiedImageError:
+        return render_image(graph, options, filename)
+    except InvalidMermaidError as e:
+        print(f"Error: Invalid Mermaid diagram '{filename}':\n{e}")
+    except MermaidRenderError as e:
         print(
-            f"Error: Unable to identify the image. The Mermaid diagram might be invalid. '{filename}'"
+            f"Error: Unable to render the image. The Mermaid diagram might be invalid. '{filename}': {e}"
         )
-        return None
+    return None
+
+
+def _rendered_image(content: bytes, options: RenderOptions) -> RenderedImage:
+    # Keep the encoded bytes; decoding waits until the image is viewed
+    content_format = image_format(content)
+    if content_format is None:
+        raise MermaidRenderError(
+            f"Renderer returned {len(content)} bytes that are not an image"
+        )
+    if content_format != options.format:
+        raise MermaidRenderError(
+            f"Renderer returned {content_format} instead of {options.format}"
+        )
+    return RenderedImage(content=content, format=content_format)
+
+
+def render_image(graph: str, options: RenderOptions, name: str = "") -> RenderedImage:
+    """
+    Render graph through the render cache and the configured renderer.
+    Raises InvalidMermaidError for charts that fail local validation,
+    MermaidRenderError for failed renders and DeadlineExceeded once the
+    current request's deadline passes. name is the output file the format is
+    resolved against when options leave it unset.
+    """
+    options = options.for_file(name)
+    deadlines.current().check("render")
+    with tracing.span(
+        "render", graph_chars=len(graph), format=options.format
+    ) as render_span:
+        try:
+            return _render_image(graph, options, render_span)
+        except MermaidRenderError as e:
+            render_span.set(render_error=str(e))
+            raise
+
+
+def _render_image(graph, options: RenderOptions, render_span) -> RenderedImage:
+    # Invalid charts never reach the renderer
+    validation = mermaid_validator.validate(graph)
+    render_span.set(valid=validation.valid)
+    if not validation.valid:
+        raise InvalidMermaidError(mermaid_validator.format_errors(graph, validation))
+
+    cache = get_render_cache()
+    cache_key = RenderCache.key(graph, options) if cache else None
+    try:
+        content = cache.get(cache_key) if cache else None
+        render_span.set(cache_hit=content is not None)
+        if content is not None:
+            render_span.set(image_bytes=len(content))
+            return _rendered_image(content, options)
+
+        render_start = time.perf_counter()
+        content = get_renderer().render(graph, options)
+        render_seconds = time.perf_counter() - render_start
+        render_span.set(image_bytes=len(content), render_seconds=render_seconds)
+
+        # Only cache bytes with a known image signature
+        img = _rendered_image(content, options)
+        if cache:
+            cache.put(cache_key, content)
+        return img
+    except OSError as e:
+        raise MermaidRenderError(str(e)) from e
+
+
+def render_many(
+    sources: List[str],
+    options: Optional[RenderOptions] = None,
+    max_workers: Optional[int] = None,
+) -> RenderBatchResponse:
+    """
+    Render every source concurrently, up to max_workers at a time (default:
+    what the configured renderer can run at once).
+
+    Identical sources in the batch are rendered once and share the result.
+    Results come back in source order; a failed render, or one cut short by
+    the current deadline, sets that result's error instead of raising.
+    """
+    options = (options or RenderOptions()).for_file("")
+    renderer = get_renderer()
+    batch_start = time.perf_counter()
+
+    def render_one(graph: str) -> RenderResult:
+        start = time.perf_counter()
+        img, error = None, None
+        try:
+            img = render_image(graph, options)
+        except (MermaidRenderError, DeadlineExceeded) as e:
+            error = str(e)
+        return RenderResult(img=img, error=error, seconds=time.perf_counter() - start)
+
+    unique_sources = list(dict.fromkeys(sources))
+    with (
+        tracing.span(
+            "render_many", sources=len(sources), unique_sources=len(unique_sources)
+        ),
+        concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, max_workers or renderer.max_concurrency)
+        ) as executor,
+    ):
+        futures = {
+            graph: executor.submit(tracing.in_current_context(render_one), graph)
+            for graph in unique_sources
+        }
+        rendered = {graph: future.result() for graph, future in futures.items()}
+
+    results = []
+    first_seen = set()
+    for graph in sources:
+        result = rendered[graph]
+        if graph in first_seen:
+            result = result.model_copy(update={"duplicate": True})
+        first_seen.add(graph)
+        results.append(result)
+    return RenderBatchResponse(
+        results=results, seconds=time.perf_counter() - batch_start
+    )
 
 
-def save_image_locally(img, filename):
+def save_image_locally(img: RenderedImage, filename):
     img.save(filename)
 
 
@@ -43,8 +492,10 @@ def show_image(img):
         print("Error: No image to display")
 
 
-def mm(graph, filename) -> Optional[Image.Image]:
-    img = build_image(graph, filename)
+def mm(
+    graph, filename, options: Optional[RenderOptions] = None
+) -> Optional[RenderedImage]:
+    img = build_image(graph, filename, options)
     if img:
         output_path = build_file_path(filename)
         save_image_locally(img, output_path)
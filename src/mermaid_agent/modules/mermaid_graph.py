@@ -0,0 +1,598 @@
+import re
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from mermaid_agent.modules.typings import (
+    MermaidEdge,
+    MermaidGraph,
+    MermaidNode,
+    MermaidPatch,
+    MermaidPatchOperation,
+    MermaidSubgraph,
+)
+
+FLOWCHART_HEADERS = ("flowchart", "graph")
+FLOWCHART_DIRECTIONS = ("TB", "TD", "BT", "RL", "LR")
+STYLE_KEYWORDS = ("style", "classDef", "class", "click", "linkStyle")
+ACCESSIBILITY_PATTERN = re.compile(r"^(accTitle\s*:|accDescr\s*:)")
+
+# Node shape openers and their closers, longest first
+SHAPE_DELIMITERS = [
+    ("(((", (")))",)),
+    ("((", ("))",)),
+    ("([", ("])",)),
+    ("[[", ("]]",)),
+    ("[(", (")]",)),
+    ("[/", ("/]", "\\]")),
+    ("[\\", ("\\]", "/]")),
+    ("{{", ("}}",)),
+    ("[", ("]",)),
+    ("(", (")",)),
+    ("{", ("}",)),
+    (">", ("]",)),
+]
+SHAPES: Dict[str, Tuple[str, str]] = {
+    opener + closer: (opener, closer)
+    for opener, closers in SHAPE_DELIMITERS
+    for closer in closers
+}
+
+NODE_ID_PATTERN = re.compile(r"\s*(\w+)")
+CLASS_SUFFIX_PATTERN = re.compile(r":::([\w-]+)")
+ARROW_PATTERN = re.compile(r"[<ox]?(?:-{2,}|={2,}|-\.+-|~{3,})[>ox]?")
+# "-- text -->" style links first, so "--" is not taken for a bare arrow
+LINK_PATTERN = re.compile(
+    r"\s*(?:"
+    r"(?P<open>[<ox]?(?:--|==|-\.))\s+(?P<text>[^|]*?)\s+(?P<close>-{2,}[>ox]?|={2,}[>ox]?|\.+-[>ox]?)"
+    r"|(?P<arrow>" + ARROW_PATTERN.pattern + r")(?:\s*\|(?P<pipe>[^|]*)\|)?"
+    r")"
+)
+SUBGRAPH_PATTERN = re.compile(r"^([\w-]+)\s*\[(.*)\]$")
+LINK_STYLE_PATTERN = re.compile(r"^linkStyle(\s+)(\d+(?:\s*,\s*\d+)*)(\s.*)$")
+NODE_REFERENCE_PATTERN = re.compile(r"^(style|click|class)(\s+)(\S+)(.*)$")
+PLAIN_LABEL_PATTERN = re.compile(r"\w[\w ,.:!?']*")
+
+INDENT = "    "
+
+
+class MermaidGraphError(ValueError):
+    """The chart is not a flowchart this module can parse."""
+
+
+class MermaidPatchError(ValueError):
+    """A patch operation does not apply to the graph."""
+
+    def __init__(self, index: int, op: str, message: str):
+        self.index = index
+        super().__init__(f"Operation {index + 1} ({op}): {message}")
+
+
+def _split_statements(text: str) -> List[str]:
+    # Split on ';' outside of quotes
+    statements = []
+    start = 0
+    in_quotes = False
+    for i, char in enumerate(text):
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == ";" and not in_quotes:
+            statements.append(text[start:i])
+            start = i + 1
+    statements.append(text[start:])
+    return [statement.strip() for statement in statements if statement.strip()]
+
+
+def _unquote(text: str) -> str:
+    text = text.strip()
+    if len(text) >= 2 and text[0] == '"' and text[-1] == '"':
+        return text[1:-1]
+    return text
+
+
+def _quote(text: str) -> str:
+    if PLAIN_LABEL_PATTERN.fullmatch(text) and text == text.strip():
+        return text
+    return '"' + text.replace('"', "#quot;") + '"'
+
+
+class _Parser:
+    """Builds a MermaidGraph one flowchart statement at a time."""
+
+    def __init__(self, header: str, direction: Optional[str], preamble: List[str]):
+        self.graph = MermaidGraph(header=header, direction=direction, preamble=preamble)
+        # Open subgraphs, innermost last, with the ids mentioned inside each
+        self.open_subgraphs: List[Tuple[MermaidSubgraph, List[str]]] = []
+        self.assigned: Set[str] = set()
+
+    def statement(self, text: str):
+        keyword = re.split(r"[\s:]", text, maxsplit=1)[0]
+        if keyword == "subgraph":
+            self._open_subgraph(text[len("subgraph") :].strip())
+        elif text == "end":
+            self._close_subgraph()
+        elif keyword == "direction":
+            direction = text.split()[-1]
+            if self.open_subgraphs:
+                self.open_subgraphs[-1][0].direction = direction
+            else:
+                self.graph.direction = direction
+        elif keyword in STYLE_KEYWORDS or ACCESSIBILITY_PATTERN.match(text):
+            self.graph.styles.append(text)
+        else:
+            self._links(text)
+
+    def finish(self) -> MermaidGraph:
+        if self.open_subgraphs:
+            raise MermaidGraphError(
+                f"'subgraph {self.open_subgraphs[-1][0].id}' is missing its 'end'"
+            )
+        # Links to a subgraph mention its id; that is not a node
+        for subgraph_id in self.graph.subgraphs:
+            node = self.graph.nodes.get(subgraph_id)
+            if node is not None and node.shape is None:
+                del self.graph.nodes[subgraph_id]
+        return self.graph
+
+    def _mention(self, node_id: str):
+        if self.open_subgraphs:
+            self.open_subgraphs[-1][1].append(node_id)
+
+    def _open_subgraph(self, rest: str):
+        match = SUBGRAPH_PATTERN.match(rest)
+        if match:
+            subgraph = MermaidSubgraph(
+                id=match.group(1), title=_unquote(match.group(2))
+            )
+        elif rest:
+            subgraph = MermaidSubgraph(id=rest)
+        else:
+            raise MermaidGraphError("'subgraph' needs an id or title")
+        if subgraph.id in self.graph.subgraphs:
+            raise MermaidGraphError(f"Duplicate subgraph '{subgraph.id}'")
+        self._mention(subgraph.id)
+        self.graph.subgraphs[subgraph.id] = subgraph
+        self.open_subgraphs.append((subgraph, []))
+
+    def _close_subgraph(self):
+        if not self.open_subgraphs:
+            raise MermaidGraphError("'end' without a matching 'subgraph'")
+        # Mermaid keeps a node in the first subgraph to close that mentions it
+        subgraph, mentioned = self.open_subgraphs.pop()
+        for node_id in dict.fromkeys(mentioned):
+            if node_id not in self.assigned:
+                subgraph.members.append(node_id)
+                self.assigned.add(node_id)
+
+    def _node(self, text: str, i: int) -> Tuple[str, int]:
+        match = NODE_ID_PATTERN.match(text, i)
+        if not match:
+            raise MermaidGraphError(f"Expected a node id in '{text}'")
+        node_id = match.group(1)
+        i = match.end()
+
+        label = shape = None
+        for opener, closers in SHAPE_DELIMITERS:
+            if not text.startswith(opener, i):
+                continue
+            label_start = i + len(opener)
+            stripped = text[label_start:].lstrip()
+            if stripped.startswith('"'):
+                quote_start = len(text) - len(stripped)
+                quote_end = text.find('"', quote_start + 1)
+                if quote_end == -1:
+                    raise MermaidGraphError(f"Unterminated string in '{text}'")
+                label = text[quote_start + 1 : quote_end]
+                close_at = len(text) - len(text[quote_end + 1 :].lstrip())
+                closer = next(
+                    (c for c in closers if text.startswith(c, close_at)), None
+                )
+            else:
+                close_at, closer = min(
+                    (
+                        (text.find(c, label_start), c)
+                        for c in closers
+                        if text.find(c, label_start) != -1
+                    ),
+                    default=(-1, None),
+                )
+                label = text[label_start:close_at].strip()
+            if closer is None:
+                raise MermaidGraphError(f"Unclosed node shape '{opener}' in '{text}'")
+            shape = opener + closer
+            i = close_at + len(closer)
+            break
+
+        classes = []
+        while True:
+            match = CLASS_SUFFIX_PATTERN.match(text, i)
+            if not match:
+                break
+            classes.append(match.group(1))
+            i = match.end()
+
+        node = self.graph.nodes.get(node_id)
+        if node is None:
+            node = self.graph.nodes[node_id] = MermaidNode(id=node_id)
+        if shape is not None:
+            node.label, node.shape = label, shape
+        node.classes.extend(c for c in classes if c not in node.classes)
+        self._mention(node_id)
+        return node_id, i
+
+    def _group(self, text: str, i: int) -> Tuple[List[str], int]:
+        node_ids = []
+        while True:
+            node_id, i = self._node(text, i)
+            node_ids.append(node_id)
+            rest = text[i:].lstrip()
+            if not rest.startswith("&"):
+                return node_ids, i
+            i = len(text) - len(rest) + 1
+
+    def _links(self, text: str):
+        sources, i = self._group(text, 0)
+        while text[i:].strip():
+            match = LINK_PATTERN.match(text, i)
+            if not match:
+                raise MermaidGraphError(f"Unexpected '{text[i:].strip()}' in '{text}'")
+            if match.group("arrow"):
+                arrow = match.group("arrow")
+                label = match.group("pipe")
+            else:
+                opener, close = match.group("open"), match.group("close")
+                # The closing half carries the arrow head: "-- a -->" is "-->",
+                # "-. a .->" is "-.->"
+                arrow = (
+                    opener[:-1] + close if opener.endswith(".") else opener[:-2] + close
+                )
+                label = match.group("text")
+            targets, i = self._group(text, match.end())
+            label = _unquote(label) if label is not None and label.strip() else None
+            for source in sources:
+                for target in targets:
+                    self.graph.edges.append(
+                        MermaidEdge(
+                            source=source, target=target, arrow=arrow, label=label
+                        )
+                    )
+            sources = targets
+
+
+def parse(text: str) -> MermaidGraph:
+    """
+    Parse flowchart/graph Mermaid text into a MermaidGraph.
+
+    Comments are dropped. Statements the IR does not model (the "A@{...}" shape
+    syntax, multi-line statements) raise MermaidGraphError, as do other
+    diagram types.
+    """
+    lines = text.splitlines()
+    preamble: List[str] = []
+    index = 0
+    while index < len(lines):
+        stripped = lines[index].strip()
+        if not stripped or (
+            stripped.startswith("%%") and not stripped.startswith("%%{")
+        ):
+            index += 1
+        elif stripped.startswith("%%{"):
+            preamble.append(stripped)
+            index += 1
+        elif stripped == "---" and not preamble:
+            end = next(
+                (j for j in range(index + 1, len(lines)) if lines[j].strip() == "---"),
+                None,
+            )
+            if end is None:
+                raise MermaidGraphError("Unterminated front matter")
+            preamble.extend(lines[index : end + 1])
+            index = end + 1
+        else:
+            break
+    if index == len(lines):
+        raise MermaidGraphError("Empty diagram")
+
+    header_statements = _split_statements(lines[index])
+    header_parts = header_statements[0].split()
+    if header_parts[0] not in FLOWCHART_HEADERS:
+        raise MermaidGraphError(
+            f"Only flowcharts can be parsed, not '{header_parts[0]}' diagrams"
+        )
+    direction = header_parts[1] if len(header_parts) > 1 else None
+    if direction is not None and direction not in FLOWCHART_DIRECTIONS:
+        raise MermaidGraphError(f"Unknown direction '{direction}'")
+
+    parser = _Parser(header_parts[0], direction, preamble)
+    for statement in header_statements[1:]:
+        parser.statement(statement)
+    for line in lines[index + 1 :]:
+        if line.strip().startswith("%%"):
+            continue
+        for statement in _split_statements(line):
+            parser.statement(statement)
+    return parser.finish()
+
+
+def _node_text(node: MermaidNode) -> str:
+    text = node.id
+    if node.shape is not None:
+        opener, closer = SHAPES[node.shape]
+        label = node.label if node.label is not None else node.id
+        text += f"{opener}{_quote(label)}{closer}"
+    return text + "".join(f":::{name}" for name in node.classes)
+
+
+def _edge_text(edge: MermaidEdge) -> str:
+    label = f"|{_quote(edge.label)}|" if edge.label else ""
+    return f"{edge.source} {edge.arrow}{label} {edge.target}"
+
+
+def serialize(graph: MermaidGraph) -> str:
+    """
+    Compact Mermaid text for a MermaidGraph.
+
+    Each labelled node is declared once and edges refer to node ids only, so
+    labels are not repeated per edge. Nodes are declared inside their
+    subgraphs; edges follow the declarations in their original order, which
+    keeps linkStyle indexes valid.
+    """
+    lines = list(graph.preamble)
+    lines.append(
+        f"{graph.header} {graph.direction}" if graph.direction else graph.header
+    )
+
+    members = {
+        member for subgraph in graph.subgraphs.values() for member in subgraph.members
+    }
+    linked = {edge.source for edge in graph.edges} | {
+        edge.target for edge in graph.edges
+    }
+
+    def declare(node_id: str, depth: int, in_subgraph: bool):
+        if node_id in graph.subgraphs:
+            subgraph = graph.subgraphs[node_id]
+            title = f" [{_quote(subgraph.title)}]" if subgraph.title else ""
+            lines.append(f"{INDENT * depth}subgraph {subgraph.id}{title}")
+            if subgraph.direction:
+                lines.append(f"{INDENT * (depth + 1)}direction {subgraph.direction}")
+            for member in subgraph.members:
+                declare(member, depth + 1, True)
+            lines.append(f"{INDENT * depth}end")
+            return
+        node = graph.nodes.get(node_id)
+        if node is None:
+            return
+        # Bare top-level nodes are declared by their edges
+        if (
+            in_subgraph
+            or node.shape is not None
+            or node.classes
+            or node_id not in linked
+        ):
+            lines.append(f"{INDENT * depth}{_node_text(node)}")
+
+    for node_id in graph.nodes:
+        if node_id not in members:
+            declare(node_id, 1, False)
+    for subgraph_id in graph.subgraphs:
+        if subgraph_id not in members:
+            declare(subgraph_id, 1, False)
+    lines.extend(f"{INDENT}{_edge_text(edge)}" for edge in graph.edges)
+    lines.extend(f"{INDENT}{style}" for style in graph.styles)
+    return "\n".join(lines)
+
+
+def _rewrite_references(graph: MermaidGraph, old_id: str, new_id: Optional[str]):
+    # Point style/click/class statements at new_id, or drop old_id when None
+    styles = []
+    for style in graph.styles:
+        match = NODE_REFERENCE_PATTERN.match(style)
+        if match is None:
+            styles.append(style)
+            continue
+        keyword, space, targets, rest = match.groups()
+        ids = targets.split(",") if keyword == "class" else [targets]
+        if old_id not in ids:
+            styles.append(style)
+            continue
+        ids = [new_id if i == old_id else i for i in ids if new_id or i != old_id]
+        if ids:
+            styles.append(f"{keyword}{space}{','.join(ids)}{rest}")
+    graph.styles = styles
+
+
+def _remove_edges(graph: MermaidGraph, removed: List[int]):
+    # linkStyle addresses edges by index; renumber around the removed edges
+    removed_set = set(removed)
+    graph.edges = [e for i, e in enumerate(graph.edges) if i not in removed_set]
+    styles = []
+    for style in graph.styles:
+        match = LINK_STYLE_PATTERN.match(style)
+        if match is None:
+            styles.append(style)
+            continue
+        indexes = [
+            index - sum(1 for r in removed_set if r < index)
+            for index in map(int, match.group(2).split(","))
+            if index not in removed_set
+        ]
+        if indexes:
+            styles.append(
+                f"linkStyle{match.group(1)}{','.join(map(str, indexes))}{match.group(3)}"
+            )
+    graph.styles = styles
+
+
+def _require(op: MermaidPatchOperation, *fields: str):
+    missing = [field for field in fields if not getattr(op, field)]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+
+
+def _check_shape(shape: Optional[str]):
+    if shape is not None and shape not in SHAPES:
+        raise ValueError(
+            f"unknown shape '{shape}', expected one of {', '.join(SHAPES)}"
+        )
+
+
+def _check_endpoint(graph: MermaidGraph, node_id: str):
+    if node_id not in graph.nodes and node_id not in graph.subgraphs:
+        raise ValueError(f"no node or subgraph '{node_id}'")
+
+
+def _detach(graph: MermaidGraph, member_id: str):
+    for subgraph in graph.subgraphs.values():
+        if member_id in subgraph.members:
+            subgraph.members.remove(member_id)
+
+
+def _add_node(graph: MermaidGraph, op: MermaidPatchOperation):
+    _require(op, "id")
+    if op.id in graph.nodes or op.id in graph.subgraphs:
+        raise ValueError(f"'{op.id}' already exists; use rename_node to change it")
+    if op.subgraph and op.subgraph not in graph.subgraphs:
+        raise ValueError(f"no subgraph '{op.subgraph}'")
+    _check_shape(op.shape)
+    shape = op.shape or ("[]" if op.label is not None else None)
+    graph.nodes[op.id] = MermaidNode(id=op.id, label=op.label, shape=shape)
+    if op.subgraph:
+        graph.subgraphs[op.subgraph].members.append(op.id)
+
+
+def _remove_node(graph: MermaidGraph, op: MermaidPatchOperation):
+    _require(op, "id")
+    if op.id not in graph.nodes:
+        raise ValueError(f"no node '{op.id}'")
+    del graph.nodes[op.id]
+    _remove_edges(
+        graph,
+        [i for i, e in enumerate(graph.edges) if op.id in (e.source, e.target)],
+    )
+    _detach(graph, op.id)
+    _rewrite_references(graph, op.id, None)
+
+
+def _rename_node(graph: MermaidGraph, op: MermaidPatchOperation):
+    _require(op, "id")
+    node = graph.nodes.get(op.id)
+    if node is None:
+        raise ValueError(f"no node '{op.id}'")
+    if op.new_id is None and op.label is None and op.shape is None:
+        raise ValueError("expected new_id, label or shape")
+    _check_shape(op.shape)
+
+    if op.label is not None:
+        node.label = op.label
+        node.shape = node.shape or "[]"
+    if op.shape is not None:
+        node.shape = op.shape
+    if op.new_id and op.new_id != op.id:
+        if op.new_id in graph.nodes or op.new_id in graph.subgraphs:
+            raise ValueError(f"'{op.new_id}' already exists")
+        node.id = op.new_id
+        graph.nodes = {
+            (op.new_id if key == op.id else key): value
+            for key, value in graph.nodes.items()
+        }
+        for edge in graph.edges:
+            edge.source = op.new_id if edge.source == op.id else edge.source
+            edge.target = op.new_id if edge.target == op.id else edge.target
+        for subgraph in graph.subgraphs.values():
+            subgraph.members = [
+                op.new_id if member == op.id else member for member in subgraph.members
+            ]
+        _rewrite_references(graph, op.id, op.new_id)
+
+
+def _add_edge(graph: MermaidGraph, op: MermaidPatchOperation):
+    _require(op, "source", "target")
+    _check_endpoint(graph, op.source)
+    _check_endpoint(graph, op.target)
+    arrow = op.arrow or "-->"
+    if not ARROW_PATTERN.fullmatch(arrow):
+        raise ValueError(f"unknown arrow '{arrow}'")
+    graph.edges.append(
+        MermaidEdge(source=op.source, target=op.target, arrow=arrow, label=op.label)
+    )
+
+
+def _remove_edge(graph: MermaidGraph, op: MermaidPatchOperation):
+    _require(op, "source", "target")
+    removed = [
+        i
+        for i, e in enumerate(graph.edges)
+        if e.source == op.source
+        and e.target == op.target
+        and (op.label is None or e.label == op.label)
+    ]
+    if not removed:
+        raise ValueError(f"no edge from '{op.source}' to '{op.target}'")
+    _remove_edges(graph, removed)
+
+
+def _add_subgraph(graph: MermaidGraph, op: MermaidPatchOperation):
+    _require(op, "id")
+    if op.id in graph.nodes or op.id in graph.subgraphs:
+        raise ValueError(f"'{op.id}' already exists")
+    if op.subgraph and op.subgraph not in graph.subgraphs:
+        raise ValueError(f"no subgraph '{op.subgraph}'")
+    for member in op.nodes:
+        _check_endpoint(graph, member)
+        _detach(graph, member)
+    graph.subgraphs[op.id] = MermaidSubgraph(
+        id=op.id, title=op.label, members=list(op.nodes)
+    )
+    if op.subgraph:
+        graph.subgraphs[op.subgraph].members.append(op.id)
+
+
+def _remove_subgraph(graph: MermaidGraph, op: MermaidPatchOperation):
+    # The subgraph's members move up to its parent, or to the top level
+    _require(op, "id")
+    subgraph = graph.subgraphs.pop(op.id, None)
+    if subgraph is None:
+        raise ValueError(f"no subgraph '{op.id}'")
+    for parent in graph.subgraphs.values():
+        if op.id in parent.members:
+            at = parent.members.index(op.id)
+            parent.members[at : at + 1] = subgraph.members
+    _remove_edges(
+        graph,
+        [i for i, e in enumerate(graph.edges) if op.id in (e.source, e.target)],
+    )
+
+
+def _add_style(graph: MermaidGraph, op: MermaidPatchOperation):
+    _require(op, "style")
+    style = op.style.strip()
+    if style.split()[0] not in STYLE_KEYWORDS:
+        raise ValueError(f"expected a {', '.join(STYLE_KEYWORDS)} statement")
+    graph.styles.append(style)
+
+
+PATCH_OPERATIONS: Dict[str, Callable[[MermaidGraph, MermaidPatchOperation], None]] = {
+    "add_node": _add_node,
+    "remove_node": _remove_node,
+    "rename_node": _rename_node,
+    "add_edge": _add_edge,
+    "remove_edge": _remove_edge,
+    "add_subgraph": _add_subgraph,
+    "remove_subgraph": _remove_subgraph,
+    "add_style": _add_style,
+}
+
+
+def apply_patch(graph: MermaidGraph, patch: MermaidPatch) -> MermaidGraph:
+    """
+    Apply patch operations in order to a copy of graph.
+
+    Removing a node also removes its edges, subgraph memberships and
+    style/class/click references; renaming a node's id updates them. Raises
+    MermaidPatchError naming the first operation that does not apply.
+    """
+    patched = graph.model_copy(deep=True)
+    for index, op in enumerate(patch.operations):
+        try:
+            PATCH_OPERATIONS[op.op](patched, op)
+        except ValueError as e:
+            raise MermaidPatchError(index, op.op, str(e)) from e
+    return patched
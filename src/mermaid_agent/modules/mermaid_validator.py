@@ -0,0 +1,543 @@
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+from mermaid_agent.modules.typings import (
+    MermaidValidationError,
+    MermaidValidationResult,
+)
+
+# Diagram types checked by this module, keyed by their header keyword
+FLOWCHART_HEADERS = ("flowchart", "flowchart-elk", "graph")
+SEQUENCE_HEADERS = ("sequenceDiagram",)
+CLASS_HEADERS = ("classDiagram", "classDiagram-v2")
+STATE_HEADERS = ("stateDiagram", "stateDiagram-v2")
+PIE_HEADERS = ("pie",)
+ER_HEADERS = ("erDiagram",)
+GANTT_HEADERS = ("gantt",)
+
+FLOWCHART_DIRECTIONS = ("TB", "TD", "BT", "RL", "LR")
+
+# Lines every diagram type accepts
+ACCESSIBILITY_PATTERN = re.compile(r"^\s*(accTitle\s*:|accDescr\s*[:{])")
+
+# Flowchart node shape openers and their closers, longest first
+SHAPE_DELIMITERS = [
+    ("(((", (")))",)),
+    ("((", ("))",)),
+    ("([", ("])",)),
+    ("[[", ("]]",)),
+    ("[(", (")]",)),
+    ("[/", ("/]", "\\]")),
+    ("[\\", ("\\]", "/]")),
+    ("{{", ("}}",)),
+    ("[", ("]",)),
+    ("(", (")",)),
+    ("{", ("}",)),
+    (">", ("]",)),
+]
+FLOWCHART_KEYWORDS = ("style", "classDef", "class", "click", "linkStyle", "direction")
+DANGLING_LINK_PATTERN = re.compile(
+    r"(-->|---|==>|===|-\.->|-\.-|--[ox]|<-->)\s*(\|[^|]*\|)?\s*$"
+)
+LEADING_LINK_PATTERN = re.compile(r"^(-->|---|==>|===|-\.->|-\.-|<-->)")
+
+SEQUENCE_BLOCKS = ("loop", "alt", "opt", "par", "critical", "break", "rect", "box")
+SEQUENCE_BLOCK_BRANCHES = {"else": "alt", "and": "par", "option": "critical"}
+SEQUENCE_STATEMENT_PATTERN = re.compile(
+    r"^(participant|actor|autonumber|activate|deactivate|title|link|links|create|destroy|properties|details)\b"
+)
+SEQUENCE_NOTE_PATTERN = re.compile(
+    r"^note\s+(left of|right of|over)\s+[^:]+:.*$", re.IGNORECASE
+)
+SEQUENCE_MESSAGE_PATTERN = re.compile(
+    r"^[^:]+?\s*(<<-{1,2}>>|-{1,2}>>|-{1,2}>|-{1,2}x|-{1,2}\))\s*[+-]?\s*[^:\s][^:]*(:.*)?$"
+)
+
+ER_RELATIONSHIP_PATTERN = re.compile(
+    r'^("[^"]+"|[\w-]+)\s*(\|o|\|\||\}o|\}\||one or zero|one or more|zero or more|only one|zero or one|one or many|zero or many|many\(\d*\)|1\+?|0\+)'
+    r"\s*(--|\.\.|to|optionally to)\s*"
+    r'(o\||\|\||o\{|\|\{|one or zero|one or more|zero or more|only one|zero or one|one or many|zero or many|many\(\d*\)|1\+?|0\+)\s*("[^"]+"|[\w-]+)\s*:\s*\S.*$'
+)
+
+PIE_SLICE_PATTERN = re.compile(r'^"[^"]*"\s*:\s*(\S+)\s*$')
+
+GANTT_KEYWORDS = (
+    "title",
+    "dateFormat",
+    "axisFormat",
+    "tickInterval",
+    "excludes",
+    "includes",
+    "todayMarker",
+    "section",
+    "weekday",
+    "weekend",
+    "inclusiveEndDates",
+    "topAxis",
+    "displayMode",
+    "click",
+)
+
+
+class _Checker:
+    """Collects errors for one diagram while its body lines are checked."""
+
+    def __init__(self):
+        self.errors: List[MermaidValidationError] = []
+
+    def error(self, line: int, column: int, message: str):
+        self.errors.append(
+            MermaidValidationError(line=line, column=column, message=message)
+        )
+
+
+def _strip_frontmatter(lines: List[str]) -> int:
+    # Skip a leading "---" YAML front-matter block; returns the first body line index
+    index = 0
+    while index < len(lines) and not lines[index].strip():
+        index += 1
+    if index < len(lines) and lines[index].strip() == "---":
+        for end in range(index + 1, len(lines)):
+            if lines[end].strip() == "---":
+                return end + 1
+    return 0
+
+
+def _is_skippable(text: str) -> bool:
+    stripped = text.strip()
+    return not stripped or stripped.startswith("%%")
+
+
+def _indent(text: str) -> int:
+    return len(text) - len(text.lstrip())
+
+
+def _check_quotes(checker: _Checker, line_no: int, text: str) -> bool:
+    if text.count('"') % 2:
+        checker.error(
+            line_no, text.rindex('"') + 1, "Unterminated string: missing '\"'"
+        )
+        return False
+    return True
+
+
+def _split_statements(text: str) -> List[Tuple[int, str]]:
+    # Split on ';' outside of quotes, keeping each statement's start column
+    statements = []
+    start = 0
+    in_quotes = False
+    for i, char in enumerate(text):
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == ";" and not in_quotes:
+            statements.append((start, text[start:i]))
+            start = i + 1
+    statements.append((start, text[start:]))
+    return [(col, stmt) for col, stmt in statements if stmt.strip()]
+
+
+def _check_node_shapes(checker: _Checker, line_no: int, offset: int, text: str):
+    i = 0
+    in_pipe_label = False
+    while i < len(text):
+        char = text[i]
+        if char == '"':
+            end = text.find('"', i + 1)
+            i = len(text) if end == -1 else end + 1
+            continue
+        if char == "|":
+            in_pipe_label = not in_pipe_label
+            i += 1
+            continue
+        if in_pipe_label or i == 0 or not (text[i - 1].isalnum() or text[i - 1] in "_"):
+            i += 1
+            continue
+
+        opener, closers = next(
+            ((o, c) for o, c in SHAPE_DELIMITERS if text.startswith(o, i)),
+            (None, None),
+        )
+        if opener is None:
+            i += 1
+            continue
+
+        label_start = i + len(opener)
+        stripped_label = text[label_start:].lstrip()
+        if stripped_label.startswith('"'):
+            quote_start = label_start + (len(text[label_start:]) - len(stripped_label))
+            quote_end = text.find('"', quote_start + 1)
+            if quote_end == -1:
+                checker.error(
+                    line_no,
+                    offset + quote_start + 1,
+                    "Unterminated string: missing '\"'",
+                )
+                return
+            after = text[quote_end + 1 :].lstrip()
+            if not any(after.startswith(closer) for closer in closers):
+                checker.error(
+                    line_no,
+                    offset + quote_end + 2,
+                    f"Expected '{closers[0]}' to close '{opener}' after quoted label",
+                )
+                return
+            i = (
+                len(text)
+                - len(after)
+                + len(next(c for c in closers if after.startswith(c)))
+            )
+            continue
+
+        close_index, closer = min(
+            (
+                (text.find(closer, label_start), closer)
+                for closer in closers
+                if text.find(closer, label_start) != -1
+            ),
+            default=(-1, None),
+        )
+        if close_index == -1:
+            checker.error(
+                line_no,
+                offset + i + 1,
+                f"Unclosed node shape '{opener}': missing '{closers[0]}'",
+            )
+            return
+
+        label = text[label_start:close_index]
+        for position, label_char in enumerate(label):
+            if label_char in "[](){}":
+                checker.error(
+                    line_no,
+                    offset + label_start + position + 1,
+                    f"Unexpected '{label_char}' in node label; wrap the label in double quotes",
+                )
+                return
+        i = close_index + len(closer)
+
+
+def _check_flowchart(
+    checker: _Checker, header: str, header_line: int, body: List[Tuple[int, str]]
+):
+    parts = header.split()
+    if len(parts) > 1 and parts[1].rstrip(";") not in FLOWCHART_DIRECTIONS:
+        checker.error(
+            header_line,
+            header.index(parts[1]) + 1,
+            f"Unknown direction '{parts[1]}'; expected one of {', '.join(FLOWCHART_DIRECTIONS)}",
+        )
+
+    open_subgraphs: List[int] = []
+    for line_no, text in body:
+        if not _check_quotes(checker, line_no, text):
+            continue
+        for column, statement in _split_statements(text):
+            stripped = statement.strip()
+            column += _indent(statement)
+            keyword = stripped.split()[0]
+
+            if keyword == "subgraph":
+                open_subgraphs.append(line_no)
+                continue
+            if stripped == "end":
+                if not open_subgraphs:
+                    checker.error(
+                        line_no, column + 1, "'end' without a matching 'subgraph'"
+                    )
+                else:
+                    open_subgraphs.pop()
+                continue
+            if keyword in FLOWCHART_KEYWORDS:
+                continue
+
+            if LEADING_LINK_PATTERN.match(stripped):
+                checker.error(line_no, column + 1, "Expected a node before the link")
+                continue
+            dangling = DANGLING_LINK_PATTERN.search(stripped)
+            if dangling:
+                checker.error(
+                    line_no,
+                    column + dangling.start() + 1,
+                    f"Expected a node after '{dangling.group(1)}'",
+                )
+                continue
+            _check_node_shapes(checker, line_no, column, stripped)
+
+    for line_no in open_subgraphs:
+        checker.error(line_no, 1, "'subgraph' is missing its 'end'")
+
+
+def _check_sequence(
+    checker: _Checker, header: str, header_line: int, body: List[Tuple[int, str]]
+):
+    open_blocks: List[Tuple[str, int]] = []
+    for line_no, text in body:
+        stripped = text.strip().rstrip(";")
+        column = _indent(text) + 1
+        keyword = stripped.split()[0]
+
+        if keyword in SEQUENCE_BLOCKS:
+            open_blocks.append((keyword, line_no))
+        elif keyword in SEQUENCE_BLOCK_BRANCHES:
+            expected = SEQUENCE_BLOCK_BRANCHES[keyword]
+            if not open_blocks or open_blocks[-1][0] != expected:
+                checker.error(
+                    line_no, column, f"'{keyword}' outside of an '{expected}' block"
+                )
+        elif stripped == "end":
+            if not open_blocks:
+                checker.error(line_no, column, "'end' without a matching block")
+            else:
+                open_blocks.pop()
+        elif keyword.lower() == "note":
+            if not SEQUENCE_NOTE_PATTERN.match(stripped):
+                checker.error(
+                    line_no,
+                    column,
+                    "Invalid note; expected 'Note left of|right of|over <actor>: <text>'",
+                )
+        elif not (
+            SEQUENCE_STATEMENT_PATTERN.match(stripped)
+            or SEQUENCE_MESSAGE_PATTERN.match(stripped)
+        ):
+            checker.error(
+                line_no, column, f"Unrecognized sequence statement '{stripped}'"
+            )
+
+    for keyword, line_no in open_blocks:
+        checker.error(line_no, 1, f"'{keyword}' block is missing its 'end'")
+
+
+def _check_braces(checker: _Checker, body: List[Tuple[int, str]], block_name: str):
+    open_braces: List[Tuple[int, int]] = []
+    for line_no, text in body:
+        in_quotes = False
+        for index, char in enumerate(text):
+            if char == '"':
+                in_quotes = not in_quotes
+            elif in_quotes:
+                continue
+            elif char == "{":
+                open_braces.append((line_no, index + 1))
+            elif char == "}":
+                if not open_braces:
+                    checker.error(
+                        line_no,
+                        index + 1,
+                        f"Unexpected '}}' without an open {block_name}",
+                    )
+                else:
+                    open_braces.pop()
+    for line_no, column in open_braces:
+        checker.error(line_no, column, f"Unclosed '{{' in {block_name}")
+
+
+def _check_class(
+    checker: _Checker, header: str, header_line: int, body: List[Tuple[int, str]]
+):
+    for line_no, text in body:
+        _check_quotes(checker, line_no, text)
+    _check_braces(checker, body, "class body")
+
+
+def _check_state(
+    checker: _Checker, header: str, header_line: int, body: List[Tuple[int, str]]
+):
+    open_notes: List[int] = []
+    for line_no, text in body:
+        stripped = text.strip()
+        column = _indent(text) + 1
+        if not _check_quotes(checker, line_no, text):
+            continue
+        if re.match(r"^note\s+(left|right)\s+of\s+\S+\s*$", stripped, re.IGNORECASE):
+            open_notes.append(line_no)
+            continue
+        if re.match(r"^end\s+note$", stripped, re.IGNORECASE):
+            if not open_notes:
+                checker.error(line_no, column, "'end note' without a matching 'note'")
+            else:
+                open_notes.pop()
+            continue
+        if open_notes:
+            continue
+        dangling = re.search(r"-->\s*(:.*)?$", stripped)
+        if dangling:
+            checker.error(
+                line_no, column + dangling.start(), "Expected a state after '-->'"
+            )
+        elif stripped.startswith("-->"):
+            checker.error(line_no, column, "Expected a state before '-->'")
+
+    for line_no in open_notes:
+        checker.error(line_no, 1, "'note' is missing its 'end note'")
+    _check_braces(
+        checker,
+        [
+            (line_no, text)
+            for line_no, text in body
+            if not text.strip().lower().startswith("note")
+        ],
+        "composite state",
+    )
+
+
+def _check_pie(
+    checker: _Checker, header: str, header_line: int, body: List[Tuple[int, str]]
+):
+    for line_no, text in body:
+        stripped = text.strip()
+        column = _indent(text) + 1
+        if stripped.split()[0] in ("title", "showData"):
+            continue
+        if not _check_quotes(checker, line_no, text):
+            continue
+        match = PIE_SLICE_PATTERN.match(stripped)
+        if not match:
+            checker.error(
+                line_no, column, "Invalid pie slice; expected '\"<label>\" : <value>'"
+            )
+            continue
+        value = match.group(1)
+        try:
+            if float(value) < 0:
+                raise ValueError
+        except ValueError:
+            checker.error(
+                line_no,
+                column + match.start(1),
+                f"Pie slice value '{value}' must be a non-negative number",
+            )
+
+
+def _check_er(
+    checker: _Checker, header: str, header_line: int, body: List[Tuple[int, str]]
+):
+    open_entity: Optional[int] = None
+    for line_no, text in body:
+        stripped = text.strip()
+        column = _indent(text) + 1
+        if not _check_quotes(checker, line_no, text):
+            continue
+
+        if open_entity is not None:
+            # Attribute lines until the entity block closes
+            if stripped == "}":
+                open_entity = None
+            continue
+
+        if stripped.endswith("{") and "--" not in stripped and ".." not in stripped:
+            open_entity = line_no
+        elif stripped == "}":
+            checker.error(
+                line_no, column, "Unexpected '}' without an open entity block"
+            )
+        elif (
+            "--" in stripped or ".." in stripped
+        ) and not ER_RELATIONSHIP_PATTERN.match(stripped):
+            checker.error(
+                line_no,
+                column,
+                "Invalid relationship; expected '<ENTITY> <cardinality>--<cardinality> <ENTITY> : <label>'",
+            )
+
+    if open_entity is not None:
+        checker.error(open_entity, 1, "Unclosed '{' in entity block")
+
+
+def _check_gantt(
+    checker: _Checker, header: str, header_line: int, body: List[Tuple[int, str]]
+):
+    for line_no, text in body:
+        stripped = text.strip()
+        column = _indent(text) + 1
+        if stripped.split()[0] in GANTT_KEYWORDS:
+            continue
+        if ":" not in stripped:
+            checker.error(line_no, column, "Task is missing ':' before its metadata")
+        elif not stripped.split(":", 1)[1].strip():
+            checker.error(
+                line_no,
+                column + stripped.index(":") + 1,
+                "Task is missing its metadata",
+            )
+
+
+CHECKERS: Dict[str, Callable] = {
+    **{header: _check_flowchart for header in FLOWCHART_HEADERS},
+    **{header: _check_sequence for header in SEQUENCE_HEADERS},
+    **{header: _check_class for header in CLASS_HEADERS},
+    **{header: _check_state for header in STATE_HEADERS},
+    **{header: _check_pie for header in PIE_HEADERS},
+    **{header: _check_er for header in ER_HEADERS},
+    **{header: _check_gantt for header in GANTT_HEADERS},
+}
+
+
+def validate(graph: str) -> MermaidValidationResult:
+    """
+    Check Mermaid text for common syntax errors without rendering it.
+
+    Covers flowchart/graph, sequence, class, state, pie, erDiagram and gantt
+    diagrams. Other diagram types, including ones this module does not know,
+    pass through unchecked for the renderer to judge. The checks are
+    conservative: a valid result does not guarantee mermaid will render it.
+    """
+    lines = graph.splitlines()
+    start = _strip_frontmatter(lines)
+
+    header_index = next(
+        (i for i in range(start, len(lines)) if not _is_skippable(lines[i])),
+        None,
+    )
+    if header_index is None:
+        return MermaidValidationResult(
+            valid=False,
+            diagram_type=None,
+            errors=[MermaidValidationError(line=1, column=1, message="Empty diagram")],
+        )
+
+    header = lines[header_index].strip()
+    header_line = header_index + 1
+    diagram_type = re.split(r"[\s;]", header, maxsplit=1)[0].rstrip(":")
+
+    # Diagram types this module does not check, or does not know, are left to
+    # the renderer
+    check = CHECKERS.get(diagram_type)
+    if check is None:
+        return MermaidValidationResult(valid=True, diagram_type=diagram_type, errors=[])
+
+    body = [
+        (i + 1, lines[i])
+        for i in range(header_index + 1, len(lines))
+        if not _is_skippable(lines[i]) and not ACCESSIBILITY_PATTERN.match(lines[i])
+    ]
+
+    # One-line flowcharts ("graph LR; A --> B"): check the statements after the
+    # header, blanking the header itself so columns stay aligned
+    if diagram_type in FLOWCHART_HEADERS and ";" in header:
+        header_text = lines[header_index]
+        split_at = header_text.index(";") + 1
+        header = header_text[:split_at].strip()
+        remainder = " " * split_at + header_text[split_at:]
+        if remainder.strip():
+            body.insert(0, (header_line, remainder))
+
+    checker = _Checker()
+    check(checker, header, header_line, body)
+    return MermaidValidationResult(
+        valid=not checker.errors, diagram_type=diagram_type, errors=checker.errors
+    )
+
+
+def format_errors(graph: str, result: MermaidValidationResult) -> Optional[str]:
+    """Render validation errors with the offending line and a caret, or None if valid."""
+    if result.valid:
+        return None
+
+    lines = graph.splitlines()
+    messages = []
+    for error in result.errors:
+        message = f"Mermaid syntax error on line {error.line}, column {error.column}: {error.message}"
+        if 0 < error.line <= len(lines):
+            message += f"\n    {lines[error.line - 1]}\n    {' ' * (error.column - 1)}^"
+        messages.append(message)
+    return "\n".join(messages)
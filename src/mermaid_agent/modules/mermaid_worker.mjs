@@ -0,0 +1,41 @@
+// Long-lived Mermaid render worker used by mermaid.MermaidCliRenderer.
+//
+// Keeps one headless browser open and renders JSON-line requests from stdin,
+// answering each with a JSON line on stdout.
+//
+//   npm install -g @mermaid-js/mermaid-cli puppeteer   (or install next to this file)
+
+import readline from "node:readline";
+import puppeteer from "puppeteer";
+import { renderMermaid } from "@mermaid-js/mermaid-cli";
+
+const browser = await puppeteer.launch({ headless: true });
+const lines = readline.createInterface({ input: process.stdin });
+
+for await (const line of lines) {
+  if (!line.trim()) continue;
+  const request = JSON.parse(line);
+  let response;
+  try {
+    const { data } = await renderMermaid(
+      browser,
+      request.graph,
+      request.format ?? "png",
+      {
+        viewport: {
+          width: request.width ?? 500,
+          height: request.height ?? 500,
+          deviceScaleFactor: request.scale ?? 2,
+        },
+        backgroundColor: request.bgColor ?? "white",
+        mermaidConfig: { theme: request.theme ?? "default" },
+      },
+    );
+    response = { id: request.id, ok: true, data: Buffer.from(data).toString("base64") };
+  } catch (error) {
+    response = { id: request.id, ok: false, error: String(error?.message ?? error) };
+  }
+  process.stdout.write(JSON.stringify(response) + "\n");
+}
+
+await browser.close();
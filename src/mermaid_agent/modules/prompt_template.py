@@ -0,0 +1,125 @@
+import json
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Union
+from pydantic import BaseModel
+
+# Matches {{key}}, {{output[-j]}} and {{output[-j].path}} placeholders, where a
+# path of .key and [index] segments reaches into nested outputs, e.g.
+# {{output[-1].nodes[0].label}}
+PLACEHOLDER_PATTERN = re.compile(r"\{\{([^{}]+)\}\}")
+OUTPUT_REF_PATTERN = re.compile(r"output\[-(\d+)\](.*)")
+PATH_SEGMENT_PATTERN = re.compile(r"\.([^.\[\]]+)|\[(-?\d+)\]")
+
+Path = Tuple[Union[str, int], ...]
+# (raw placeholder, name, output index j, output key, parsed output path)
+Slot = Tuple[str, str, Optional[int], Optional[str], Optional[Path]]
+
+
+def parse_path(text: str) -> Optional[Path]:
+    """Split ".a.b[0]" into ("a", "b", 0); None if text isn't a valid path."""
+    path = []
+    position = 0
+    while position < len(text):
+        match = PATH_SEGMENT_PATTERN.match(text, position)
+        if match is None:
+            return None
+        key, index = match.groups()
+        path.append(key if key is not None else int(index))
+        position = match.end()
+    return tuple(path)
+
+
+def _to_text(value: Any) -> str:
+    if isinstance(value, BaseModel):
+        return value.model_dump_json()
+    return str(value)
+
+
+class CompiledPrompt:
+    """
+    A prompt parsed once into literal segments and placeholder slots.
+
+    Filling a compiled prompt is a single pass over its slots followed by one
+    join, instead of a str.replace scan per context key and per output reference.
+    Only the output paths a prompt mentions are ever looked up, so large
+    structured outputs cost nothing beyond the values actually referenced.
+    Placeholders that cannot be resolved are left in the prompt untouched.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.literals: List[str] = []
+        self.slots: List[Slot] = []
+
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(text):
+            self.literals.append(text[position : match.start()])
+            name = match.group(1)
+            output_match = OUTPUT_REF_PATTERN.fullmatch(name)
+            if output_match:
+                j = int(output_match.group(1))
+                # The text after "output[-j]." is kept whole for dict keys
+                # that themselves contain dots or brackets
+                rest = output_match.group(2)
+                key = rest[1:] if rest.startswith(".") else None
+                path = parse_path(rest)
+            else:
+                j, key, path = None, None, None
+            self.slots.append((match.group(0), name, j, key, path))
+            position = match.end()
+        self.literals.append(text[position:])
+
+    def fill(self, context: Dict[str, Any], outputs: List[Any]) -> str:
+        if not self.slots:
+            return self.text
+
+        parts = [self.literals[0]]
+        for slot, literal in zip(self.slots, self.literals[1:]):
+            parts.append(self._resolve(slot, context, outputs))
+            parts.append(literal)
+        return "".join(parts)
+
+    @staticmethod
+    def _resolve(slot: Slot, context: Dict[str, Any], outputs: List[Any]) -> str:
+        raw, name, j, key, path = slot
+
+        if name in context:
+            return str(context[name])
+
+        if j is None or j < 1 or j > len(outputs):
+            return raw
+
+        value = outputs[-j]
+        if not path:
+            if path is None:
+                return raw
+            if isinstance(value, dict):
+                return json.dumps(value)
+            return _to_text(value)
+
+        if key is not None and isinstance(value, dict) and key in value:
+            return _to_text(value[key])
+
+        for segment in path:
+            if isinstance(segment, int):
+                if not isinstance(value, (list, tuple)) or not (
+                    -len(value) <= segment < len(value)
+                ):
+                    return raw
+                value = value[segment]
+            elif isinstance(value, dict):
+                if segment not in value:
+                    return raw
+                value = value[segment]
+            elif isinstance(value, BaseModel) and segment in type(value).model_fields:
+                value = getattr(value, segment)
+            else:
+                return raw
+        return _to_text(value)
+
+
+@lru_cache(maxsize=256)
+def compile_prompt(text: str) -> CompiledPrompt:
+    """Parse a prompt into a CompiledPrompt, cached by prompt text."""
+    return CompiledPrompt(text)
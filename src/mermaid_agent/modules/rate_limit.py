@@ -0,0 +1,92 @@
+import contextlib
+import contextvars
+import threading
+import time
+from typing import Dict, Iterator, Optional
+from mermaid_agent.modules import deadlines
+from mermaid_agent.modules.deadlines import Deadline, DeadlineExceeded
+
+
+class RateLimiter:
+    """
+    Spaces calls evenly so at most requests_per_minute start per minute.
+
+    Thread-safe: each caller reserves the next free slot and sleeps until it.
+    A caller whose deadline passes before its slot raises DeadlineExceeded at
+    once and leaves the slot for others.
+    """
+
+    def __init__(self, requests_per_minute: float):
+        if requests_per_minute <= 0:
+            raise ValueError(
+                f"requests_per_minute must be positive, got {requests_per_minute}"
+            )
+        self.interval = 60.0 / requests_per_minute
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline: Optional[Deadline] = None, stage: str = "rate limit"):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            if deadline is not None:
+                deadline.check(stage)
+                remaining = deadline.remaining()
+                if remaining is not None and slot - now > remaining:
+                    raise DeadlineExceeded(stage)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+_rate_limiters: Dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def set_rate_limit(provider: str, requests_per_minute: Optional[float]):
+    """Limit calls to provider (e.g. a model id or "mermaid.ink"); None removes the limit."""
+    with _rate_limiters_lock:
+        if requests_per_minute:
+            _rate_limiters[provider] = RateLimiter(requests_per_minute)
+        else:
+            _rate_limiters.pop(provider, None)
+
+
+# Limits for one request, e.g. a bulk batch's --rate-limit; they take
+# precedence over the process-wide limits without changing them
+_scoped_rate_limiters: contextvars.ContextVar[Dict[str, RateLimiter]] = (
+    contextvars.ContextVar("rate_limiters", default={})
+)
+
+
+@contextlib.contextmanager
+def scope(limits: Dict[str, float]) -> Iterator[None]:
+    """
+    Limit calls to each provider in limits (requests per minute) within the
+    enclosed block. Like tracing spans, the limits reach worker threads
+    through tracing.in_current_context; other requests keep the process-wide
+    limits.
+    """
+    limiters = {
+        provider: RateLimiter(requests_per_minute)
+        for provider, requests_per_minute in limits.items()
+    }
+    token = _scoped_rate_limiters.set({**_scoped_rate_limiters.get(), **limiters})
+    try:
+        yield
+    finally:
+        _scoped_rate_limiters.reset(token)
+
+
+def acquire(provider: str):
+    """
+    Wait for the provider's next free slot; returns at once if it has no
+    limit. Raises DeadlineExceeded if the slot comes after the current
+    deadline (see deadlines.current).
+    """
+    limiter = _scoped_rate_limiters.get().get(provider)
+    if limiter is None:
+        with _rate_limiters_lock:
+            limiter = _rate_limiters.get(provider)
+    if limiter is not None:
+        limiter.acquire(deadlines.current(), f"rate limit {provider}")
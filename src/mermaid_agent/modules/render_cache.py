@@ -0,0 +1,191 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from mermaid_agent.modules.typings import RenderOptions
+from mermaid_agent.modules.utils import OUTPUT_DIR
+
+RENDER_CACHE_DIR = os.path.join(OUTPUT_DIR, "render_cache")
+
+
+class RenderCache:
+    """
+    Content-addressed cache of rendered diagram bytes.
+
+    Entries are keyed by a hash of the graph text and render options, kept in an
+    in-memory LRU tier and an on-disk tier that evicts least recently used files
+    once it grows past max_disk_bytes.
+    """
+
+    def __init__(
+        self,
+        max_memory_items: int = 128,
+        cache_dir: Optional[str] = RENDER_CACHE_DIR,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+    ):
+        self.max_memory_items = max_memory_items
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes: Optional[int] = None
+
+    @staticmethod
+    def key(graph: str, options: RenderOptions) -> str:
+        digest = hashlib.sha256(graph.encode("utf8"))
+        digest.update(b"\0")
+        digest.update(options.model_dump_json().encode("utf8"))
+        return digest.hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            content = self._memory.get(key)
+            if content is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return content
+
+        content = self._read_disk(key)
+
+        with self._lock:
+            if content is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, content)
+            return content
+
+    def put(self, key: str, content: bytes):
+        with self._lock:
+            self._remember(key, content)
+        self._write_disk(key, content)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_items": len(self._memory),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self.memory_hits = self.disk_hits = self.misses = 0
+
+    def _remember(self, key: str, content: bytes):
+        self._memory[key] = content
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as infile:
+                content = infile.read()
+            self._touch(path)
+            return content
+        except OSError:
+            return None
+
+    def _write_disk(self, key: str, content: bytes):
+        if not self.cache_dir:
+            return
+        # The disk tier is best effort: a full or unwritable cache directory
+        # must never fail the render that produced the content
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, "wb") as outfile:
+                outfile.write(content)
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+            self._touch(path)
+
+            with self._lock:
+                if self._disk_bytes is None:
+                    self._disk_bytes = self._scan_disk_bytes()
+                else:
+                    self._disk_bytes += len(content) - replaced
+                if self._disk_bytes > self.max_disk_bytes:
+                    self._evict_disk()
+        except OSError as e:
+            print(f"Failed to write render cache entry {key}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _touch(path: str):
+        # Set mtime from the wall clock; filesystem timestamps can be too coarse
+        # to order entries written or read within the same tick for LRU eviction
+        now = time.time()
+        os.utime(path, (now, now))
+
+    def _scan_disk_bytes(self) -> int:
+        return sum(
+            entry.stat().st_size
+            for entry in os.scandir(self.cache_dir)
+            if entry.name.endswith(".bin")
+        )
+
+    def _evict_disk(self):
+        entries = sorted(
+            (
+                entry
+                for entry in os.scandir(self.cache_dir)
+                if entry.name.endswith(".bin")
+            ),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        total = sum(entry.stat().st_size for entry in entries)
+        # Evict down to 90% of the budget so every write doesn't trigger a scan
+        target = self.max_disk_bytes * 0.9
+        for entry in entries:
+            if total <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                total -= size
+            except OSError:
+                pass
+        self._disk_bytes = total
+
+
+_render_cache: Optional[RenderCache] = None
+_render_cache_lock = threading.Lock()
+
+
+def get_render_cache() -> Optional[RenderCache]:
+    """The shared render cache, or None when MERMAID_RENDER_CACHE=0."""
+    global _render_cache
+    if os.getenv("MERMAID_RENDER_CACHE", "1") == "0":
+        return None
+    with _render_cache_lock:
+        if _render_cache is None:
+            _render_cache = RenderCache()
+        return _render_cache
+
+
+def set_render_cache(cache: Optional[RenderCache]):
+    global _render_cache
+    with _render_cache_lock:
+        _render_cache = cache
@@ -0,0 +1,88 @@
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List, NamedTuple
+
+IMPORT_TIME_PATTERN = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)\s*$")
+
+# Heavy dependencies the CLI only imports on the code paths that need them
+LAZY_DEPENDENCIES = ("llm", "openai", "anthropic", "PIL", "mako", "requests", "jinja2")
+
+# Code run in a fresh interpreter for each startup profile
+HELP_STARTUP = "import sys; sys.argv = ['main', '--help']; from mermaid_agent.main import main; main()"
+AGENT_STARTUP = (
+    "import mermaid_agent.main; from mermaid_agent import mermaid_agent; "
+    "import llm, mako.template, requests"
+)
+STARTUP_PROFILES = {
+    "main --help": HELP_STARTUP,
+    "mer / mer-iter / mer-bulk (agents, llm plugins, renderer)": AGENT_STARTUP,
+}
+
+
+class ImportTime(NamedTuple):
+    module: str
+    depth: int
+    self_seconds: float
+    cumulative_seconds: float
+
+
+def import_times(code: str) -> List[ImportTime]:
+    """
+    Run code in a fresh interpreter under -X importtime and return one entry
+    per imported module. Raises RuntimeError if the code fails.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+    )
+    times = []
+    other_lines = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        if match is None:
+            other_lines.append(line)
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        times.append(
+            ImportTime(
+                module=module,
+                depth=len(indent) // 2,
+                self_seconds=int(self_us) / 1e6,
+                cumulative_seconds=int(cumulative_us) / 1e6,
+            )
+        )
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"Startup profile failed ({result.returncode}):\n"
+            + "\n".join(other_lines[-20:])
+        )
+    return times
+
+
+def total_seconds(times: List[ImportTime]) -> float:
+    return sum(time.self_seconds for time in times)
+
+
+def package_seconds(times: List[ImportTime]) -> Dict[str, float]:
+    """Self import time summed per top-level package, slowest first."""
+    packages: Dict[str, float] = defaultdict(float)
+    for time in times:
+        packages[time.module.split(".")[0]] += time.self_seconds
+    return dict(sorted(packages.items(), key=lambda item: item[1], reverse=True))
+
+
+def startup_report(top: int = 12) -> str:
+    """Import time of each startup profile, broken down by package."""
+    sections = []
+    for name, code in STARTUP_PROFILES.items():
+        times = import_times(code)
+        lines = [
+            f"{name}: {total_seconds(times) * 1000:.1f} ms importing {len(times)} modules"
+        ]
+        for package, seconds in list(package_seconds(times).items())[:top]:
+            lines.append(f"    {package:<24} {seconds * 1000:8.1f} ms")
+        sections.append("\n".join(lines))
+    return "\n\n".join(sections)
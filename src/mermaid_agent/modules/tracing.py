@@ -0,0 +1,255 @@
+import abc
+import atexit
+import contextvars
+import functools
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from mermaid_agent.modules.typings import TraceSpan
+
+# Attributes a span copies from its parent unless it sets them itself
+INHERITED_ATTRIBUTES = ("model_id", "attempt")
+
+
+class SpanSink(abc.ABC):
+    """Receives each span once it has finished."""
+
+    @abc.abstractmethod
+    def export(self, span: TraceSpan):
+        """Record span; called from whichever thread finished it."""
+
+    def close(self):
+        pass
+
+
+class InMemorySpanSink(SpanSink):
+    """Collects finished spans in a list, e.g. for tests."""
+
+    def __init__(self):
+        self.spans: List[TraceSpan] = []
+        self._lock = threading.Lock()
+
+    def export(self, span: TraceSpan):
+        with self._lock:
+            self.spans.append(span)
+
+    def find(self, name: str) -> List[TraceSpan]:
+        with self._lock:
+            return [span for span in self.spans if span.name == name]
+
+
+class JsonlSpanSink(SpanSink):
+    """Appends each finished span to path as one JSON line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def export(self, span: TraceSpan):
+        line = span.model_dump_json() + "\n"
+        with self._lock:
+            if self._file is None:
+                if os.path.dirname(self.path):
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._file = open(self.path, "a")
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class OpenTelemetrySpanSink(SpanSink):
+    """
+    Re-emits finished spans through an OpenTelemetry tracer.
+
+    Needs the opentelemetry-api package; configure an SDK tracer provider and
+    exporter as usual. Parent links are carried as mermaid_agent.* attributes
+    since spans are exported after they finish.
+    """
+
+    def __init__(self, tracer: Any = None):
+        try:
+            from opentelemetry import trace
+        except ImportError as e:
+            raise ImportError(
+                "OpenTelemetrySpanSink requires opentelemetry-api: pip install opentelemetry-api"
+            ) from e
+        self._trace = trace
+        self._tracer = tracer or trace.get_tracer("mermaid_agent")
+
+    def export(self, span: TraceSpan):
+        attributes = {
+            key: value if isinstance(value, (str, bool, int, float)) else str(value)
+            for key, value in span.attributes.items()
+            if value is not None
+        }
+        attributes["mermaid_agent.trace_id"] = span.trace_id
+        attributes["mermaid_agent.span_id"] = span.span_id
+        if span.parent_id:
+            attributes["mermaid_agent.parent_id"] = span.parent_id
+
+        start_ns = int(span.start_time * 1e9)
+        otel_span = self._tracer.start_span(
+            span.name, start_time=start_ns, attributes=attributes
+        )
+        if span.error:
+            otel_span.set_status(
+                self._trace.Status(self._trace.StatusCode.ERROR, span.error)
+            )
+        otel_span.end(end_time=start_ns + int(span.duration * 1e9))
+
+
+class ActiveSpan:
+    """A span in progress; set adds attributes before it is exported."""
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_id: Optional[str],
+        attributes: Dict[str, Any],
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+
+_noop_span = _NoopSpan()
+_current_span: contextvars.ContextVar[Optional[ActiveSpan]] = contextvars.ContextVar(
+    "mermaid_agent_current_span", default=None
+)
+
+_span_sinks: Optional[List[SpanSink]] = None
+_span_sinks_lock = threading.Lock()
+
+
+def build_span_sinks() -> List[SpanSink]:
+    """Sinks configured by MERMAID_TRACE_FILE (JSONL path) and MERMAID_TRACE_OTEL=1."""
+    sinks: List[SpanSink] = []
+    if os.getenv("MERMAID_TRACE_FILE"):
+        sinks.append(JsonlSpanSink(os.environ["MERMAID_TRACE_FILE"]))
+    if os.getenv("MERMAID_TRACE_OTEL", "0") == "1":
+        sinks.append(OpenTelemetrySpanSink())
+    return sinks
+
+
+def get_span_sinks() -> List[SpanSink]:
+    global _span_sinks
+    if _span_sinks is not None:
+        return _span_sinks
+    with _span_sinks_lock:
+        if _span_sinks is None:
+            _span_sinks = build_span_sinks()
+            for sink in _span_sinks:
+                atexit.register(sink.close)
+        return _span_sinks
+
+
+def set_span_sinks(sinks: Optional[List[SpanSink]]):
+    """Replace the span sinks; None re-reads the environment on next use."""
+    global _span_sinks
+    with _span_sinks_lock:
+        _span_sinks = sinks
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Any]:
+    """
+    Time the enclosed block as a span nested under the current one.
+
+    Spans inherit model_id and attempt from their parent (attempt defaults to 1).
+    With no sinks configured this yields a no-op span and records nothing.
+    """
+    sinks = get_span_sinks()
+    if not sinks:
+        yield _noop_span
+        return
+
+    parent = _current_span.get()
+    for key in INHERITED_ATTRIBUTES:
+        if key not in attributes and parent is not None and key in parent.attributes:
+            attributes[key] = parent.attributes[key]
+    attributes.setdefault("attempt", 1)
+
+    active = ActiveSpan(
+        name,
+        parent.trace_id if parent is not None else uuid.uuid4().hex,
+        parent.span_id if parent is not None else None,
+        attributes,
+    )
+    token = _current_span.set(active)
+    start_time = time.time()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield active
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _current_span.reset(token)
+        finished = TraceSpan(
+            name=name,
+            trace_id=active.trace_id,
+            span_id=active.span_id,
+            parent_id=active.parent_id,
+            start_time=start_time,
+            duration=duration,
+            attributes=active.attributes,
+            error=error,
+        )
+        for sink in sinks:
+            try:
+                sink.export(finished)
+            except Exception as e:
+                print(f"Failed to export span {name}: {e}")
+
+
+def traced(name: str) -> Callable:
+    """Decorator running every call of the wrapped function in a span called name."""
+
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def in_current_context(fn: Callable) -> Callable:
+    """
+    Bind fn to a copy of the caller's context so spans it opens on a worker
+    thread nest under the current span. Wrap once per submitted task; a
+    context copy can't be entered by two threads at once.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.run(fn, *args, **kwargs)
+
+    return run
+
+
+def model_id(model: Any) -> str:
+    return getattr(model, "model_id", None) or type(model).__name__
@@ -1,6 +1,29 @@
-from pydantic import BaseModel, ConfigDict
-from typing import List, Dict, Optional, Union, Any
-from PIL import Image
+import io
+import os
+from pydantic import BaseModel, PositiveFloat, PrivateAttr, model_validator
+from typing import TYPE_CHECKING, List, Dict, Literal, Optional, Union, Any
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# Formats the renderers can produce
+RenderFormat = Literal["png", "svg", "pdf"]
+# Leading bytes of the encoded formats renderers return
+IMAGE_SIGNATURES = {
+    b"\x89PNG\r\n\x1a\n": "png",
+    b"\xff\xd8\xff": "jpeg",
+    b"%PDF-": "pdf",
+    b"<svg": "svg",
+}
+IMAGE_EXTENSIONS = {
+    "png": "png",
+    "jpg": "jpeg",
+    "jpeg": "jpeg",
+    "svg": "svg",
+    "pdf": "pdf",
+}
+# Formats PIL can decode and convert between
+RASTER_FORMATS = {"png", "jpeg"}
 
 
 class FusionChainResult(BaseModel):
@@ -11,42 +34,337 @@ class FusionChainResult(BaseModel):
     model_names: List[str]
 
 
-class OneShotMermaidParams(BaseModel):
-    prompt: str
+class FusionChainModelResult(BaseModel):
+    model_index: int
+    model_name: str
+    outputs: List[Any]
+    context_filled_prompts: List[str]
+    latency: float
+
+
+class FusionChainRaceResult(BaseModel):
+    top_response: Optional[Union[str, Dict[str, Any]]]
+    winner_model_name: Optional[str]
+    winner_prompt_responses: List[Any]
+    winner_context_filled_prompts: List[str]
+    latency: Optional[float]
+    rejected_model_names: List[str]
+    # Model name -> number of prompt steps issued before it was cancelled
+    cancelled_models: Dict[str, int]
+    # Whether the deadline passed before any output was accepted
+    timed_out: bool = False
+
+
+class TraceSpan(BaseModel):
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    # Wall clock start in seconds since the epoch, duration in seconds
+    start_time: float
+    duration: float
+    attributes: Dict[str, Any] = {}
+    error: Optional[str] = None
+
+
+def file_format(filename: str) -> Optional[str]:
+    """The image format named by filename's extension, or None."""
+    return IMAGE_EXTENSIONS.get(os.path.splitext(filename)[1].lstrip(".").lower())
+
+
+class RenderOptions(BaseModel):
+    # None follows the output file's extension, falling back to png
+    format: Optional[RenderFormat] = None
+    width: int = 500
+    height: int = 500
+    scale: int = 2
+    theme: str = "dark"  # Options: "default", "neutral", "dark", "forest", "base"
+    bg_color: str = "2a303c"
+
+    def for_file(self, filename: str) -> "RenderOptions":
+        """These options with format resolved against filename."""
+        if self.format is not None:
+            return self
+        extension_format = file_format(filename)
+        if extension_format not in ("svg", "pdf"):
+            extension_format = "png"
+        return self.model_copy(update={"format": extension_format})
+
+    def output_file(self, filename: str) -> str:
+        """
+        filename, with its extension replaced when it names a format this
+        render can't be saved as (e.g. chart.png for an svg render).
+        """
+        extension_format = file_format(filename)
+        render_format = self.format or "png"
+        if (
+            extension_format == render_format
+            or {
+                extension_format,
+                render_format,
+            }
+            <= RASTER_FORMATS
+        ):
+            return filename
+        if extension_format is None:
+            return f"{filename}.{render_format}"
+        return f"{os.path.splitext(filename)[0]}.{render_format}"
+
+
+def image_format(content: bytes) -> Optional[str]:
+    """The encoded image format of content, from its signature, or None."""
+    head = content[:256]
+    if head.startswith(b"<?xml") and b"<svg" in content[:1024]:
+        return "svg"
+    return next(
+        (
+            fmt
+            for signature, fmt in IMAGE_SIGNATURES.items()
+            if head.lstrip().startswith(signature)
+        ),
+        None,
+    )
+
+
+class RenderedImage(BaseModel):
+    """
+    A rendered chart as the encoded bytes the renderer returned.
+
+    save writes the bytes as they are when the file extension matches the
+    format, so SVG is written as the renderer's text; the PIL image is only
+    decoded for raster formats, when image or show is used.
+    """
+
+    content: bytes
+    format: str
+
+    _image: Optional["Image.Image"] = PrivateAttr(default=None)
+
+    @classmethod
+    def from_file(cls, path: str) -> "RenderedImage":
+        with open(path, "rb") as infile:
+            content = infile.read()
+        return cls(content=content, format=image_format(content) or "png")
+
+    @property
+    def image(self) -> "Image.Image":
+        if self.format not in RASTER_FORMATS:
+            raise ValueError(f"A {self.format} render can't be decoded as an image")
+        if self._image is None:
+            from PIL import Image
+
+            image = Image.open(io.BytesIO(self.content))
+            image.load()
+            self._image = image
+        return self._image
+
+    def save(self, path: str):
+        extension_format = file_format(path) or self.format
+        if extension_format != self.format:
+            if {extension_format, self.format} <= RASTER_FORMATS:
+                # Another raster format was asked for by name; transcode through PIL
+                self.image.save(path)
+                return
+            raise ValueError(
+                f"Can't save a {self.format} render as {path}; render it as "
+                f"{extension_format} instead"
+            )
+        with open(path, "wb") as outfile:
+            outfile.write(self.content)
+
+    def show(self):
+        if self.format in RASTER_FORMATS:
+            self.image.show()
+            return
+        # Vector formats open in the system viewer for their file type
+        import tempfile
+        import webbrowser
+
+        with tempfile.NamedTemporaryFile(
+            suffix=f".{self.format}", delete=False
+        ) as outfile:
+            outfile.write(self.content)
+        webbrowser.open(f"file://{outfile.name}")
+
+
+class RenderResult(BaseModel):
+    img: Optional[RenderedImage] = None
+    error: Optional[str] = None
+    # Wall time of the render, cache lookup included
+    seconds: float
+    # Another identical source in the batch was rendered for this one
+    duplicate: bool = False
+
+
+class RenderBatchResponse(BaseModel):
+    results: List[RenderResult]
+    seconds: float
+
+
+class MermaidValidationError(BaseModel):
+    line: int
+    column: int
+    message: str
+
+
+class MermaidValidationResult(BaseModel):
+    valid: bool
+    diagram_type: Optional[str]
+    errors: List[MermaidValidationError]
+
+
+class MermaidNode(BaseModel):
+    id: str
+    label: Optional[str] = None
+    # Opener and closer concatenated, e.g. "[]", "{}", "(())"; None for a bare id
+    shape: Optional[str] = None
+    classes: List[str] = []
+
+
+class MermaidEdge(BaseModel):
+    source: str
+    target: str
+    arrow: str = "-->"
+    label: Optional[str] = None
+
+
+class MermaidSubgraph(BaseModel):
+    id: str
+    title: Optional[str] = None
+    direction: Optional[str] = None
+    # Node and child subgraph ids, in declaration order
+    members: List[str] = []
+
+
+class MermaidGraph(BaseModel):
+    header: str = "flowchart"
+    direction: Optional[str] = None
+    nodes: Dict[str, MermaidNode] = {}
+    edges: List[MermaidEdge] = []
+    subgraphs: Dict[str, MermaidSubgraph] = {}
+    # Verbatim style, classDef, class, click, linkStyle and accessibility statements
+    styles: List[str] = []
+    # Front matter and %%{init}%% directives ahead of the header
+    preamble: List[str] = []
+
+
+class MermaidPatchOperation(BaseModel):
+    op: Literal[
+        "add_node",
+        "remove_node",
+        "rename_node",
+        "add_edge",
+        "remove_edge",
+        "add_subgraph",
+        "remove_subgraph",
+        "add_style",
+    ]
+    id: Optional[str] = None
+    new_id: Optional[str] = None
+    label: Optional[str] = None
+    shape: Optional[str] = None
+    source: Optional[str] = None
+    target: Optional[str] = None
+    arrow: Optional[str] = None
+    subgraph: Optional[str] = None
+    nodes: List[str] = []
+    style: Optional[str] = None
+
+
+class MermaidPatch(BaseModel):
+    operations: List[MermaidPatchOperation]
+
+
+class RenderParams(BaseModel):
+    """
+    The output file and render options of an agent that renders a chart.
+
+    The render format is negotiated on validation: an unset format follows the
+    output file's extension, and an extension the format can't be saved as is
+    replaced, so output_file always names the file that will be written.
+    """
+
     output_file: str
+    render_options: RenderOptions = RenderOptions()
+
+    @model_validator(mode="after")
+    def negotiate_format(self):
+        self.render_options = self.render_options.for_file(self.output_file)
+        self.output_file = self.render_options.output_file(self.output_file)
+        return self
+
+
+class ResolutionOptions(BaseModel):
+    """How one_shot_mermaid_agent fixes a chart that fails to render."""
+
+    # Rounds of fixes; each round builds on the previous round's failed charts
+    attempts: int = 2
+    # Fix attempts run concurrently per round; the first that renders wins
+    fanout: int = 1
+    # Seconds all rounds together may take; None runs every round to the end
+    deadline: Optional[float] = None
+    # Model ids and temperatures cycled over a round's attempts (default: the
+    # request's model at its default temperature)
+    models: List[str] = []
+    temperatures: List[float] = []
+
+
+class OneShotMermaidParams(RenderParams):
+    prompt: str
     input_file: Optional[str] = None
+    model: Optional[str] = None
+    cache: bool = False
+    stream: bool = False
+    resolution: ResolutionOptions = ResolutionOptions()
+    # Seconds the whole request may take, resolution included; None never times out
+    timeout: Optional[float] = None
 
 
-class ResolutionMermaidParams(BaseModel):
+class ResolutionMermaidParams(RenderParams):
     error: str
     damaged_mermaid_chart: str
     base_prompt: str
-    output_file: str
     input_file: Optional[str] = None
+    model: Optional[str] = None
+    cache: bool = False
+    request_id: Optional[str] = None
+    temperature: Optional[float] = None
 
 
-class IterateMermaidParams(BaseModel):
+class IterateMermaidParams(RenderParams):
     change_prompt: str
     base_prompt: str
     current_mermaid_chart: str
-    current_mermaid_img: Image.Image
-    output_file: str
+    # Not sent to the daemon; iterate_mermaid_agent only needs the chart text
+    current_mermaid_img: Optional[RenderedImage] = None
     input_file: Optional[str] = None
+    model: Optional[str] = None
+    # Ask for a patch to the parsed flowchart instead of a full chart
+    edit_mode: bool = False
+    # Seconds the whole request may take; None never times out
+    timeout: Optional[float] = None
 
-    model_config = ConfigDict(arbitrary_types_allowed=True)
 
-
-class BulkMermaidParams(BaseModel):
+class BulkMermaidParams(RenderParams):
     prompt: str
-    output_file: str
     input_file: Optional[str] = None
+    model: Optional[str] = None
     count: int
+    concurrency: int = 4
+    # Per-provider limits in requests per minute for this batch's calls, e.g. {"gpt-4o-2024-08-06": 60}
+    rate_limits: Dict[str, PositiveFloat] = {}
+    resolution: ResolutionOptions = ResolutionOptions()
+    # Seconds the whole batch may take; diagrams unfinished by then time out
+    timeout: Optional[float] = None
+
 
 class MermaidAgentResponse(BaseModel):
-    img: Optional[Image.Image]
+    img: Optional[RenderedImage]
     mermaid: Optional[str]
+    error: Optional[str] = None
+    # Set when the request's timeout passed or it was cancelled; error says where
+    timed_out: bool = False
 
-    model_config = ConfigDict(arbitrary_types_allowed=True)
 
 class BulkMermaidAgentResponse(BaseModel):
     responses: List[MermaidAgentResponse]
@@ -0,0 +1,77 @@
+import json
+import threading
+
+from mermaid_agent.modules import artifacts
+from mermaid_agent.modules.artifacts import ArtifactSink, new_request_id
+
+
+def test_artifact_sink_writes_each_request_to_its_own_directory(tmp_path):
+    sink = ArtifactSink(output_dir=str(tmp_path), mode="text")
+    request_ids = [new_request_id() for _ in range(8)]
+
+    # Concurrent requests writing artifacts with the same names
+    threads = [
+        threading.Thread(
+            target=sink.write,
+            args=(request_id, "mermaid_prompt_1_results", [f"graph {i}", {"k": i}]),
+        )
+        for i, request_id in enumerate(request_ids)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sink.close()
+
+    assert len(set(request_ids)) == 8
+    for i, request_id in enumerate(request_ids):
+        text = (tmp_path / request_id / "mermaid_prompt_1_results.txt").read_text()
+        assert text == (
+            "🔗 -------- Prompt Chain Result #1 -------------\n\n"
+            f"graph {i}\n\n"
+            "🔗🔗 -------- Prompt Chain Result #2 -------------\n\n"
+            f'{{"k": {i}}}\n\n'
+        )
+    # Writes queued together are flushed together
+    assert sink.batches_written < 8
+
+
+def test_artifact_sink_jsonl_mode_appends_records(tmp_path):
+    sink = ArtifactSink(output_dir=str(tmp_path), mode="jsonl", flush_interval=0)
+    sink.write("request-1", "results", ["graph LR", {"k": "v"}])
+    sink.flush()
+    sink.write("request-2", "results", ["pie"])
+    sink.close()
+
+    lines = (tmp_path / "artifacts.jsonl").read_text().splitlines()
+    records = [json.loads(line) for line in lines]
+    assert [(r["request_id"], r["name"], r["content"]) for r in records] == [
+        ("request-1", "results", ["graph LR", {"k": "v"}]),
+        ("request-2", "results", ["pie"]),
+    ]
+
+
+def test_artifact_sink_recreates_deleted_directories(tmp_path):
+    import shutil
+
+    output_dir = tmp_path / "artifacts"
+    sink = ArtifactSink(output_dir=str(output_dir), mode="text", flush_interval=0)
+    sink.write("request-1", "results", ["graph LR"])
+    sink.flush()
+
+    # e.g. output/ cleaned up while a daemon keeps running
+    shutil.rmtree(output_dir)
+    sink.write("request-1", "results", ["pie"])
+    sink.close()
+
+    assert "pie" in (output_dir / "request-1" / "results.txt").read_text()
+
+
+def test_artifacts_off_switch(tmp_path, monkeypatch):
+    monkeypatch.setenv("MERMAID_ARTIFACTS", "off")
+    monkeypatch.setenv("MERMAID_ARTIFACTS_DIR", str(tmp_path))
+
+    artifacts.write("request-1", "results", ["graph LR"])
+
+    assert artifacts.get_artifact_sink() is None
+    assert list(tmp_path.iterdir()) == []
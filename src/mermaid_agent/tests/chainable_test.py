@@ -1,5 +1,7 @@
 from typing import Any, List, Tuple
 
+import pytest
+
 from pydantic import BaseModel
 from mermaid_agent.modules.chain import MinimalChainable, FusionChain
 from mermaid_agent.modules.llm_module import (
@@ -199,6 +201,219 @@ def test_chainable_json_output_with_markdown():
     assert result[0] == {"key": "value", "number": 42, "nested": {"inner": "content"}}
 
 
+@pytest.mark.parametrize(
+    "response, parsed",
+    [
+        ('  {"key": "value"}\n', {"key": "value"}),
+        ("[1, 2]", [1, 2]),
+        ("42", 42),
+        ("null", None),
+        ('Here:\n```json\n{"key": "value"}\n```', {"key": "value"}),
+        ("graph LR\n  A --> B", "graph LR\n  A --> B"),
+        ("```mermaid\ngraph LR\n```", "```mermaid\ngraph LR\n```"),
+        ("{not json", "{not json"),
+        ("", ""),
+    ],
+)
+def test_parse_result_auto_detects_json(response, parsed):
+    assert MinimalChainable._parse_result(response) == parsed
+
+
+def test_chainable_declared_output_formats():
+    from mermaid_agent.modules.chain import ChainOutputError
+
+    class MockModel:
+        pass
+
+    def mock_callable_prompt(model, prompt):
+        if "chart" in prompt:
+            return "```mermaid\ngraph LR\n  A --> B\n```"
+        return '{"key": "value"}'
+
+    result, filled = MinimalChainable.run(
+        {},
+        MockModel(),
+        mock_callable_prompt,
+        ["Give JSON", "Give JSON", "Draw chart", "Review chart: {{output[-1]}}"],
+        output_formats=["text", "json", "mermaid", "auto"],
+    )
+
+    assert result[:3] == ['{"key": "value"}', {"key": "value"}, "graph LR\n  A --> B"]
+    assert filled[3] == "Review chart: graph LR\n  A --> B"
+
+    with pytest.raises(ChainOutputError, match="Prompt step 0"):
+        MinimalChainable.run(
+            {},
+            MockModel(),
+            mock_callable_prompt,
+            ["Draw chart"],
+            output_formats=["json"],
+        )
+    with pytest.raises(ValueError, match="1 output formats for 2 prompts"):
+        MinimalChainable.run(
+            {}, MockModel(), mock_callable_prompt, ["a", "b"], output_formats=["text"]
+        )
+
+
+def test_compiled_prompt_resolves_nested_output_paths():
+    from mermaid_agent.modules.prompt_template import compile_prompt
+
+    outputs = [{"a": {"b": ["first", {"c": 3}]}, "dotted.key": "kept"}]
+
+    def fill(text):
+        return compile_prompt(text).fill({}, outputs)
+
+    assert fill("{{output[-1].a.b[0]}}") == "first"
+    assert fill("{{output[-1].a.b[-1].c}}") == "3"
+    assert fill("{{output[-1].dotted.key}}") == "kept"
+    assert fill("{{output[-1].a.b[5]}} {{output[-1].a.x}}") == (
+        "{{output[-1].a.b[5]}} {{output[-1].a.x}}"
+    )
+    assert fill("{{output[-1]a}}") == "{{output[-1]a}}"
+
+
+def test_chainable_validates_output_schema_once():
+    from pydantic import BaseModel
+    from mermaid_agent.modules.chain import ChainOutputError
+
+    class Node(BaseModel):
+        id: str
+        label: str
+
+    class Graph(BaseModel):
+        nodes: List[Node]
+
+    class MockModel:
+        pass
+
+    def mock_callable_prompt(model, prompt):
+        if "Nodes" in prompt:
+            return '```json\n{"nodes": [{"id": "A", "label": "Start"}]}\n```'
+        return f"Echo: {prompt}"
+
+    result, filled = MinimalChainable.run(
+        {},
+        MockModel(),
+        mock_callable_prompt,
+        ["Nodes", "First {{output[-1].nodes[0].label}} in {{output[-1]}}"],
+        output_schemas=[Graph, None],
+    )
+
+    assert result[0] == Graph(nodes=[Node(id="A", label="Start")])
+    assert filled[1] == ('First Start in {"nodes":[{"id":"A","label":"Start"}]}')
+
+    with pytest.raises(ChainOutputError, match="does not match Graph"):
+        MinimalChainable.run(
+            {},
+            MockModel(),
+            lambda model, prompt: '{"nodes": [{"id": "A"}]}',
+            ["Nodes"],
+            output_schemas=[Graph],
+        )
+    with pytest.raises(ValueError, match="needs a json output format"):
+        MinimalChainable.run(
+            {},
+            MockModel(),
+            mock_callable_prompt,
+            ["Nodes"],
+            output_formats=["mermaid"],
+            output_schemas=[Graph],
+        )
+
+
+def test_chainable_does_not_expand_placeholders_inside_values():
+    # Mock model and callable function
+    class MockModel:
+        pass
+
+    def mock_callable_prompt(model, prompt):
+        return prompt
+
+    # Context values containing placeholder syntax are inserted verbatim
+    context = {"var1": "{{var2}} {{output[-1]}}", "var2": "World"}
+    chains = ["First: {{var2}}", "Second: {{var1}} {{missing}} {{output[-3]}}"]
+
+    result, _ = MinimalChainable.run(context, MockModel(), mock_callable_prompt, chains)
+
+    assert result[0] == "First: World"
+    assert result[1] == "Second: {{var2}} {{output[-1]}} {{missing}} {{output[-3]}}"
+
+
+def test_compile_prompt_is_cached_by_text():
+    from mermaid_agent.modules.prompt_template import compile_prompt
+
+    template = compile_prompt("A {{x}} B {{output[-1].key}} C")
+
+    assert compile_prompt("A {{x}} B {{output[-1].key}} C") is template
+    assert template.literals == ["A ", " B ", " C"]
+    assert template.fill({"x": 1}, [{"key": "v"}]) == "A 1 B v C"
+    assert template.fill({}, ["plain"]) == "A {{x}} B {{output[-1].key}} C"
+
+
+def test_chainable_arun_with_sync_adapter():
+    import asyncio
+    from mermaid_agent.modules.chain import to_async_callable
+
+    # Mock model and callable function
+    class MockModel:
+        pass
+
+    def mock_callable_prompt(model, prompt):
+        if "Output JSON" in prompt:
+            return '{"key": "value"}'
+        return f"Response to: {prompt}"
+
+    context = {"test": "JSON"}
+    chains = ["Output JSON: {{test}}", "Reference JSON: {{output[-1].key}}"]
+
+    result, filled = asyncio.run(
+        MinimalChainable.arun(
+            context, MockModel(), to_async_callable(mock_callable_prompt), chains
+        )
+    )
+
+    assert result == [{"key": "value"}, "Response to: Reference JSON: value"]
+    assert filled == ["Output JSON: JSON", "Reference JSON: value"]
+
+    # Adapters share one pool instead of starting threads per adapter
+    from mermaid_agent.modules import chain
+
+    executor = chain.get_async_executor()
+    to_async_callable(mock_callable_prompt)
+    assert chain.get_async_executor() is executor
+
+
+def test_chainable_run_consumes_streamed_chunks():
+    from mermaid_agent.modules import llm_module
+
+    # Mock model whose streamed response is an iterator of chunks
+    class MockModel:
+        model_id = "mock-model"
+
+        def prompt(self, prompt, stream=False, **options):
+            assert stream
+            return iter(
+                ['{"key": ', '"value"}'] if "JSON" in prompt else ["Hi ", prompt]
+            )
+
+    chunks = []
+    result, _ = MinimalChainable.run(
+        {},
+        MockModel(),
+        llm_module.stream_prompt,
+        ["Output JSON", "Reference {{output[-1].key}}"],
+        on_chunk=lambda step, chunk: chunks.append((step, chunk)),
+    )
+
+    assert result == [{"key": "value"}, "Hi Reference value"]
+    assert chunks == [
+        (0, '{"key": '),
+        (0, '"value"}'),
+        (1, "Hi "),
+        (1, "Reference value"),
+    ]
+
+
 # ------------ CompetitionChainable.run
 
 import random
@@ -301,6 +516,312 @@ def test_fusion_chain_run():
     print("result.model_dump_json: ", result.model_dump_json())
 
 
+def test_fusion_chain_run_parallel_keeps_model_order():
+    import time
+
+    # Mock models; earlier models are slower so they finish last
+    class MockModel:
+        def __init__(self, name, delay):
+            self.name = name
+            self.delay = delay
+
+    def mock_callable_prompt(model, prompt):
+        time.sleep(model.delay)
+        return f"{model.name} response: {prompt}"
+
+    def mock_evaluator(outputs):
+        return outputs[0], [1.0 / (n + 1) for n in range(len(outputs))]
+
+    context = {"var1": "Hello"}
+    chains = ["First prompt: {{var1}}"]
+    models = [MockModel(f"Model{i}", 0.06 - i * 0.02) for i in range(3)]
+
+    result = FusionChain.run_parallel(
+        context=context,
+        models=models,
+        callable=mock_callable_prompt,
+        prompts=chains,
+        evaluator=mock_evaluator,
+        get_model_name=lambda model: model.name,
+    )
+
+    assert result.model_names == ["Model0", "Model1", "Model2"]
+    for name, outputs in zip(result.model_names, result.all_prompt_responses):
+        assert outputs == [f"{name} response: First prompt: Hello"]
+
+    # The streaming variant yields the fastest model first
+    finished = list(
+        FusionChain.iter_parallel(
+            context, models, mock_callable_prompt, chains, lambda model: model.name
+        )
+    )
+    assert [r.model_name for r in finished] == ["Model2", "Model1", "Model0"]
+    assert [r.model_index for r in finished] == [2, 1, 0]
+    assert all(r.latency >= models[r.model_index].delay for r in finished)
+
+
+def test_fusion_chain_run_race_cancels_slower_models():
+    import time
+
+    # Mock models with a per-step delay
+    class MockModel:
+        def __init__(self, name, delay, answer):
+            self.name = name
+            self.delay = delay
+            self.answer = answer
+            self.calls = 0
+
+    def mock_callable_prompt(model, prompt):
+        model.calls += 1
+        time.sleep(model.delay)
+        return model.answer
+
+    chains = ["Step 1", "Step 2: {{output[-1]}}", "Step 3: {{output[-1]}}"]
+    models = [
+        MockModel("Fast", 0.005, "broken"),
+        MockModel("Medium", 0.02, "graph LR; A --> B"),
+        MockModel("Slow", 0.2, "graph LR; A --> C"),
+    ]
+
+    result = FusionChain.run_race(
+        context={},
+        models=models,
+        callable=mock_callable_prompt,
+        prompts=chains,
+        accept=lambda output: output.startswith("graph"),
+        get_model_name=lambda model: model.name,
+    )
+
+    assert result.winner_model_name == "Medium"
+    assert result.top_response == "graph LR; A --> B"
+    assert result.winner_prompt_responses == ["graph LR; A --> B"] * 3
+    assert result.rejected_model_names == ["Fast"]
+    assert result.cancelled_models == {"Slow": 1}
+
+    # The slow chain stops before issuing its next prompt step
+    time.sleep(0.3)
+    assert models[2].calls == 1
+
+
+def test_fusion_chain_run_race_without_accepted_output():
+    class MockModel:
+        def __init__(self, name):
+            self.name = name
+
+    result = FusionChain.run_race(
+        context={},
+        models=[MockModel("A"), MockModel("B")],
+        callable=lambda model, prompt: "broken",
+        prompts=["Step 1"],
+        accept=lambda output: False,
+        get_model_name=lambda model: model.name,
+    )
+
+    assert result.winner_model_name is None
+    assert result.top_response is None
+    assert sorted(result.rejected_model_names) == ["A", "B"]
+
+
+def test_chainable_skips_optional_steps_when_time_is_short():
+    import time
+
+    from mermaid_agent.modules.deadlines import Deadline, DeadlineExceeded
+
+    calls = []
+
+    def mock_callable_prompt(model, prompt):
+        calls.append(prompt)
+        time.sleep(0.05)
+        return f"response to {prompt}"
+
+    prompts = ["Draft", "Review: {{output[-1]}}"]
+
+    # The draft took 0.05s and only about 0.03s is left, so the review is dropped
+    output, _ = MinimalChainable.run(
+        {},
+        None,
+        mock_callable_prompt,
+        prompts,
+        deadline=Deadline(0.08),
+        optional_steps=[1],
+    )
+    assert output == ["response to Draft"]
+
+    # A required step past the deadline raises instead
+    calls.clear()
+    with pytest.raises(DeadlineExceeded, match="prompt step 1"):
+        MinimalChainable.run(
+            {}, None, mock_callable_prompt, prompts, deadline=Deadline(0.03)
+        )
+    assert calls == ["Draft"]
+
+
+def test_chainable_arun_stops_at_the_deadline():
+    import asyncio
+    import time
+
+    from mermaid_agent.modules import deadlines
+    from mermaid_agent.modules.chain import to_async_callable
+    from mermaid_agent.modules.deadlines import Deadline, DeadlineExceeded
+
+    calls = []
+
+    async def mock_async_callable_prompt(model, prompt):
+        calls.append(prompt)
+        await asyncio.sleep(model)
+        return f"response to {prompt}"
+
+    prompts = ["Draft", "Review: {{output[-1]}}"]
+
+    # A slow call is abandoned at the deadline rather than awaited to the end
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded, match="llm_call"):
+        asyncio.run(
+            MinimalChainable.arun(
+                {}, 0.3, mock_async_callable_prompt, prompts, deadline=Deadline(0.05)
+            )
+        )
+    assert time.monotonic() - start < 0.2 and calls == ["Draft"]
+
+    # A step that starts after the deadline is cancelled is never issued
+    calls.clear()
+    deadline = Deadline(5)
+
+    async def cancel_after_draft(model, prompt):
+        deadline.cancel()
+        return await mock_async_callable_prompt(0, prompt)
+
+    with pytest.raises(DeadlineExceeded, match="cancelled during prompt step 1"):
+        asyncio.run(
+            MinimalChainable.arun(
+                {}, None, cancel_after_draft, prompts, deadline=deadline
+            )
+        )
+    assert calls == ["Draft"]
+
+    # Sync callables adapted with to_async_callable see the chain's deadline
+    deadline = Deadline(5)
+    seen = []
+    asyncio.run(
+        MinimalChainable.arun(
+            {},
+            None,
+            to_async_callable(lambda model, prompt: seen.append(deadlines.current())),
+            ["Draft"],
+            deadline=deadline,
+        )
+    )
+    assert seen == [deadline]
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(
+            FusionChain.arun(
+                context={},
+                models=[0.01, 0.3],
+                callable=mock_async_callable_prompt,
+                prompts=["Step 1"],
+                evaluator=lambda outputs: (outputs[0], [1.0] * len(outputs)),
+                get_model_name=str,
+                deadline=Deadline(0.05),
+            )
+        )
+    assert time.monotonic() - start < 0.2
+
+
+def test_fusion_chain_run_parallel_stops_at_the_deadline():
+    import time
+
+    from mermaid_agent.modules.deadlines import Deadline, DeadlineExceeded
+
+    class MockModel:
+        def __init__(self, name, delay):
+            self.name = name
+            self.delay = delay
+            self.calls = 0
+
+    def mock_callable_prompt(model, prompt):
+        model.calls += 1
+        time.sleep(model.delay)
+        return f"{model.name} response"
+
+    models = [MockModel("Fast", 0.01), MockModel("Slow", 0.2)]
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded, match="fusion chain"):
+        FusionChain.run_parallel(
+            context={},
+            models=models,
+            callable=mock_callable_prompt,
+            prompts=["Step 1", "Step 2: {{output[-1]}}"],
+            evaluator=lambda outputs: (outputs[0], [1.0] * len(outputs)),
+            get_model_name=lambda model: model.name,
+            deadline=Deadline(0.1),
+        )
+    assert time.monotonic() - start < 0.15
+
+    # The abandoned slow chain stops before its next prompt step
+    time.sleep(0.2)
+    assert models[1].calls == 1
+
+    race = FusionChain.run_race(
+        context={},
+        models=[MockModel("Slow", 0.2)],
+        callable=mock_callable_prompt,
+        prompts=["Step 1"],
+        accept=lambda output: True,
+        get_model_name=lambda model: model.name,
+        deadline=Deadline(0.05),
+    )
+    assert race.timed_out and race.winner_model_name is None
+    assert race.cancelled_models == {"Slow": 1}
+
+
+def test_fusion_chain_arun_runs_models_concurrently():
+    import asyncio
+
+    # Mock models
+    class MockModel:
+        def __init__(self, name, delay):
+            self.name = name
+            self.delay = delay
+
+    in_flight = 0
+    max_in_flight = 0
+
+    # Mock async callable function; later models finish first
+    async def mock_async_callable_prompt(model, prompt):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(model.delay)
+        in_flight -= 1
+        return f"{model.name} response: {prompt}"
+
+    def mock_evaluator(outputs):
+        return outputs[0], [1.0 / (n + 1) for n in range(len(outputs))]
+
+    context = {"var1": "Hello"}
+    chains = ["First prompt: {{var1}}", "Second prompt: {{output[-1]}}"]
+    models = [MockModel(f"Model{i}", 0.03 - i * 0.01) for i in range(3)]
+
+    result = asyncio.run(
+        FusionChain.arun(
+            context=context,
+            models=models,
+            callable=mock_async_callable_prompt,
+            prompts=chains,
+            evaluator=mock_evaluator,
+            get_model_name=lambda model: model.name,
+        )
+    )
+
+    assert max_in_flight == 3
+    assert result.model_names == ["Model0", "Model1", "Model2"]
+    for i, outputs in enumerate(result.all_prompt_responses):
+        assert outputs[0] == f"Model{i} response: First prompt: Hello"
+    assert result.top_response == result.all_prompt_responses[0][-1]
+
+
 def test_real_fusion_chain_run():
 
     sonnet_3_5_model, gpt4_o_model, gemini_1_5_pro_model = build_big_3_models()
@@ -0,0 +1,157 @@
+import http.client
+import json
+import threading
+
+import pytest
+from PIL import Image
+
+from mermaid_agent import mermaid_agent
+from mermaid_agent.modules import daemon
+from mermaid_agent.modules.typings import (
+    BulkMermaidAgentResponse,
+    BulkMermaidParams,
+    IterateMermaidParams,
+    MermaidAgentResponse,
+    OneShotMermaidParams,
+    RenderedImage,
+)
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    server = daemon.build_server("127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield daemon.DaemonClient(*server.server_address[:2], server.token)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def mock_agent(params) -> MermaidAgentResponse:
+    # Stands in for the agents: "saves" a chart named after the request
+    Image.new("RGB", (2, 2)).save(params.output_file)
+    image = RenderedImage.from_file(params.output_file)
+    return MermaidAgentResponse(img=image, mermaid=f"graph LR; {params.output_file}")
+
+
+def test_client_runs_agents_on_the_daemon(client, monkeypatch, tmp_path):
+    requests = []
+
+    def one_shot(params):
+        requests.append(params)
+        return mock_agent(params)
+
+    monkeypatch.setattr(mermaid_agent, "one_shot_mermaid_agent", one_shot)
+    monkeypatch.setattr(mermaid_agent, "iterate_mermaid_agent", mock_agent)
+
+    assert client.health()["status"] == "ok"
+
+    response = client.one_shot_mermaid_agent(
+        OneShotMermaidParams(
+            prompt="Flowchart", output_file="chart.png", input_file="notes.md"
+        )
+    )
+    assert response.mermaid == "graph LR; chart.png"
+    assert response.img.image.size == (2, 2)
+    # The client saves the image under its own output directory
+    assert (tmp_path / "output" / "chart.png").read_bytes() == response.img.content
+    # Relative input files are resolved on the client's side
+    assert requests[0].input_file == str(tmp_path / "notes.md")
+
+    response = client.iterate_mermaid_agent(
+        IterateMermaidParams(
+            change_prompt="Add C",
+            base_prompt="Flowchart",
+            current_mermaid_chart="graph LR; A --> B",
+            current_mermaid_img=response.img,
+            output_file="iter.png",
+        )
+    )
+    assert response.mermaid == "graph LR; iter.png"
+
+
+def test_client_bulk_reports_each_diagram(client, monkeypatch):
+    def bulk(params, on_complete=None):
+        return BulkMermaidAgentResponse(
+            responses=[
+                MermaidAgentResponse(
+                    img=None, mermaid=None, error="provider unavailable"
+                ),
+                MermaidAgentResponse(img=None, mermaid="graph LR; A --> B"),
+            ]
+        )
+
+    monkeypatch.setattr(mermaid_agent, "bulk_mermaid_agent", bulk)
+
+    completed = []
+    response = client.bulk_mermaid_agent(
+        BulkMermaidParams(prompt="Flowchart", output_file="chart.png", count=2),
+        on_complete=lambda index, res: completed.append(index),
+    )
+
+    assert completed == [0, 1]
+    assert [res.error for res in response.responses] == ["provider unavailable", None]
+    assert response.responses[1].mermaid == "graph LR; A --> B"
+
+
+def test_client_raises_daemon_errors(client, monkeypatch):
+    def failing(params):
+        raise RuntimeError("no API key")
+
+    monkeypatch.setattr(mermaid_agent, "one_shot_mermaid_agent", failing)
+
+    with pytest.raises(daemon.DaemonError, match="500.*RuntimeError: no API key"):
+        client.one_shot_mermaid_agent(
+            OneShotMermaidParams(prompt="Flowchart", output_file="chart.png")
+        )
+
+
+def test_daemon_refuses_requests_a_web_page_could_send(client, monkeypatch):
+    calls = []
+    monkeypatch.setattr(mermaid_agent, "one_shot_mermaid_agent", calls.append)
+
+    def post(headers, body=None):
+        connection = http.client.HTTPConnection(client.host, client.port)
+        try:
+            connection.request(
+                "POST",
+                "/mer",
+                body=json.dumps(
+                    body or {"prompt": "Flowchart", "output_file": "chart.png"}
+                ),
+                headers={**client._headers(), **headers},
+            )
+            return connection.getresponse().status
+        finally:
+            connection.close()
+
+    # A cross-origin "simple" request, DNS rebinding, and no token
+    assert post({"Content-Type": "text/plain"}) == 415
+    assert post({"Content-Type": "application/json", "Host": "evil.test:8765"}) == 403
+    assert post({"Content-Type": "application/json", "Authorization": ""}) == 401
+    # Outputs must stay under the daemon's output directory
+    for output_file in ["../../.bashrc", "/tmp/chart.png", "charts/../../x.png"]:
+        body = {"prompt": "Flowchart", "output_file": output_file}
+        assert post({"Content-Type": "application/json"}, body) == 400
+    assert calls == []
+
+
+def test_connect_falls_back_without_a_daemon(client, monkeypatch, tmp_path):
+    monkeypatch.setenv("MERMAID_DAEMON_URL", f"http://{client.host}:{client.port}")
+    monkeypatch.setenv("MERMAID_DAEMON_TOKEN_FILE", str(tmp_path / "token"))
+    # No token file: the daemon can't be used
+    assert daemon.connect() is None
+
+    daemon.write_token(client.token)
+    assert (tmp_path / "token").stat().st_mode & 0o777 == 0o600
+    assert daemon.connect() is not None
+
+    monkeypatch.setenv("MERMAID_DAEMON", "off")
+    assert daemon.connect() is None
+
+    monkeypatch.delenv("MERMAID_DAEMON")
+    monkeypatch.setenv("MERMAID_DAEMON_URL", "http://127.0.0.1:1")
+    assert daemon.connect() is None
@@ -0,0 +1,82 @@
+import threading
+import time
+
+import pytest
+
+from mermaid_agent.modules import deadlines, tracing
+from mermaid_agent.modules.deadlines import Deadline, DeadlineExceeded
+
+
+def test_child_deadline_is_bounded_by_its_parent():
+    parent = Deadline(0.2)
+    tighter = parent.child(0.05)
+    looser = parent.child(10)
+
+    assert tighter.remaining() <= 0.05
+    assert looser.remaining() <= 0.2
+    assert Deadline().remaining() is None and Deadline().has_time(1e9)
+    assert looser.cap(5) <= 0.2 and Deadline().cap(5) == 5
+
+    # Cancelling a child leaves the parent running; cancelling the parent stops every child
+    tighter.cancel()
+    assert tighter.expired() and not parent.expired()
+    parent.cancel()
+    with pytest.raises(DeadlineExceeded, match="cancelled during render") as e:
+        looser.check("render")
+    assert e.value.cancelled and e.value.stage == "render"
+
+
+def test_call_stops_waiting_at_the_deadline():
+    finished = threading.Event()
+
+    def slow_call():
+        time.sleep(0.3)
+        finished.set()
+        return "late"
+
+    with deadlines.start(0.05):
+        assert deadlines.call(lambda: "fast", "llm_call") == "fast"
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded, match="deadline exceeded during llm_call"):
+            deadlines.call(slow_call, "llm_call")
+        assert time.monotonic() - start < 0.2
+        # Later calls fail fast rather than starting
+        with pytest.raises(DeadlineExceeded):
+            deadlines.call(lambda: "fast", "llm_call")
+    assert not finished.is_set()
+
+    # Without a deadline the call runs inline
+    assert deadlines.call(threading.current_thread, "llm_call") is (
+        threading.current_thread()
+    )
+
+
+def test_cancelling_a_deadline_stops_a_stream():
+    deadline = Deadline(10)
+
+    def stream():
+        yield "graph LR\n"
+        deadline.cancel()
+        time.sleep(0.3)
+        yield "  A --> B"
+
+    chunks = []
+    with deadlines.scope(deadline):
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded) as e:
+            for chunk in deadlines.iterate(stream, "llm_stream"):
+                chunks.append(chunk)
+    assert chunks == ["graph LR\n"]
+    assert e.value.cancelled and time.monotonic() - start < 0.2
+
+
+def test_deadline_reaches_worker_threads():
+    seen = []
+    with deadlines.start(5) as deadline:
+        worker = threading.Thread(
+            target=tracing.in_current_context(lambda: seen.append(deadlines.current()))
+        )
+        worker.start()
+        worker.join()
+    assert seen == [deadline]
+    assert deadlines.current().remaining() is None
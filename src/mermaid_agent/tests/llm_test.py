@@ -70,3 +70,121 @@ def test_build_gemini_duo():
         "Paris" in flash_result
     ), f"Unexpected response from gemini_1_5_flash: {flash_result}"
     print("Gemini 1.5 Flash response:", flash_result)
+
+
+def test_get_model_builds_each_model_once(monkeypatch):
+    import threading
+    import llm
+    from mermaid_agent.modules import llm_module
+
+    # Mock llm.get_model, counting builds per model id
+    class MockModel:
+        def __init__(self, model_id):
+            self.model_id = model_id
+            self.key = None
+
+    builds = []
+
+    def mock_get_model(model_id):
+        builds.append(model_id)
+        return MockModel(model_id)
+
+    monkeypatch.setattr(llm, "get_model", mock_get_model)
+    monkeypatch.setattr(llm_module, "_models", {})
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+
+    threads = [
+        threading.Thread(target=llm_module.get_model, args=("claude-3.5-sonnet",))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    model = llm_module.get_model("claude-3.5-sonnet")
+    assert builds == ["claude-3.5-sonnet"]
+    assert model.key == "test-key"
+    assert llm_module.get_model("gpt-4o-mini") is not model
+    assert builds == ["claude-3.5-sonnet", "gpt-4o-mini"]
+
+
+def test_cached_prompt_reuses_responses(tmp_path):
+    from mermaid_agent.modules import llm_module
+    from mermaid_agent.modules.llm_cache import LLMResponseCache, set_llm_cache
+
+    # Mock model returning a response object with text()
+    class MockResponse:
+        def __init__(self, text):
+            self._text = text
+
+        def text(self):
+            return self._text
+
+    class MockModel:
+        model_id = "mock-model"
+
+        def __init__(self):
+            self.calls = 0
+
+        def prompt(self, prompt, **options):
+            self.calls += 1
+            return MockResponse(f"{prompt} {options}")
+
+    cache = LLMResponseCache(path=str(tmp_path / "llm_cache.sqlite"))
+    set_llm_cache(cache)
+    try:
+        model = MockModel()
+        first = llm_module.cached_prompt(model, "Draw a chart")
+        second = llm_module.cached_prompt(model, "Draw a chart")
+        llm_module.cached_prompt(model, "Draw a chart", temperature=0.5)
+        llm_module.prompt_callable(False)(model, "Draw a chart")
+    finally:
+        set_llm_cache(None)
+
+    assert first == second == "Draw a chart {}"
+    assert model.calls == 3
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["entries"] == 2
+
+
+@pytest.mark.parametrize(
+    "chunks, complete_at",
+    [
+        (["Here:\n```mermaid\ngraph LR\n  A --> B\n```\nDone"], 0),
+        (["`", "``mer", "maid\ngraph LR\n", "  A --> B\n`", "``", "\nDone"], 4),
+        (["graph LR\n", "  A --> B\n"], None),
+    ],
+)
+def test_mermaid_stream_extractor_matches_parse_markdown_backticks(chunks, complete_at):
+    from mermaid_agent.modules import llm_module
+
+    extractor = llm_module.MermaidStreamExtractor()
+    blocks = [extractor.feed(chunk) for chunk in chunks]
+
+    expected = llm_module.parse_markdown_backticks("".join(chunks))
+    assert expected == "graph LR\n  A --> B"
+    assert blocks == [
+        expected if i == complete_at else None for i in range(len(chunks))
+    ]
+    assert extractor.finish() == expected
+
+
+def test_llm_response_cache_ttl_and_eviction(tmp_path):
+    from mermaid_agent.modules.llm_cache import LLMResponseCache
+
+    path = str(tmp_path / "llm_cache.sqlite")
+    cache = LLMResponseCache(path=path, max_entries=2)
+    keys = [LLMResponseCache.key("mock-model", f"prompt {n}", {}) for n in range(3)]
+
+    for n, key in enumerate(keys):
+        cache.put(key, "mock-model", f"response {n}")
+
+    # Only the two most recently used entries are kept, and they persist on disk
+    reopened = LLMResponseCache(path=path, max_entries=2)
+    assert reopened.get(keys[0]) is None
+    assert reopened.get(keys[2]) == "response 2"
+
+    expired = LLMResponseCache(path=path, ttl_seconds=0)
+    assert expired.get(keys[1]) is None
+    assert expired.stats()["entries"] == 1
@@ -0,0 +1,457 @@
+import threading
+import time
+
+
+from mermaid_agent import mermaid_agent
+from mermaid_agent.modules import rate_limit
+from mermaid_agent.modules.typings import (
+    BulkMermaidParams,
+    MermaidAgentResponse,
+    RenderedImage,
+)
+
+
+def test_bulk_mermaid_agent_runs_concurrently_in_index_order(monkeypatch):
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    # Mock one shot agent; later diagrams finish first and diagram 2 fails
+    def mock_one_shot_mermaid_agent(params):
+        nonlocal in_flight, max_in_flight
+        index = int(params.output_file.split("_", 1)[0])
+        # Diagrams share one prompt, so a cached response would repeat diagram 1
+        assert not params.cache
+        with lock:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+        time.sleep(0.05 - index * 0.01)
+        with lock:
+            in_flight -= 1
+        if index == 2:
+            raise RuntimeError("provider unavailable")
+        return MermaidAgentResponse(img=None, mermaid=f"graph LR; A{index} --> B")
+
+    monkeypatch.setattr(
+        mermaid_agent, "one_shot_mermaid_agent", mock_one_shot_mermaid_agent
+    )
+
+    completed = []
+    response = mermaid_agent.bulk_mermaid_agent(
+        BulkMermaidParams(
+            prompt="Flowchart", output_file="chart.png", count=4, concurrency=4
+        ),
+        on_complete=lambda index, res: completed.append(index),
+    )
+
+    assert max_in_flight == 4
+    assert completed == [3, 2, 1, 0]
+    assert [res.mermaid for res in response.responses] == [
+        "graph LR; A1 --> B",
+        None,
+        "graph LR; A3 --> B",
+        "graph LR; A4 --> B",
+    ]
+    assert response.responses[1].error == "provider unavailable"
+
+
+def test_rate_limit_spaces_calls_per_provider():
+    rate_limit.set_rate_limit("test-provider", 600)
+    try:
+        start = time.monotonic()
+        for _ in range(3):
+            rate_limit.acquire("test-provider")
+        # Unlimited providers never wait
+        rate_limit.acquire("other-provider")
+        elapsed = time.monotonic() - start
+    finally:
+        rate_limit.set_rate_limit("test-provider", None)
+
+    assert 0.2 <= elapsed < 0.5
+
+
+def test_rate_limit_gives_up_when_the_slot_is_past_the_deadline():
+    import pytest
+
+    from mermaid_agent.modules import deadlines
+
+    with rate_limit.scope({"test-provider": 6}), deadlines.start(0.5):
+        rate_limit.acquire("test-provider")
+        # The next slot is 10s away: fail now instead of sleeping past the deadline
+        start = time.monotonic()
+        with pytest.raises(
+            deadlines.DeadlineExceeded, match="rate limit test-provider"
+        ):
+            rate_limit.acquire("test-provider")
+        assert time.monotonic() - start < 0.1
+
+    # A refused caller does not reserve the slot it could not use
+    limiter = rate_limit.RateLimiter(6)
+    limiter.acquire()
+    next_slot = limiter._next_slot
+    with pytest.raises(deadlines.DeadlineExceeded):
+        limiter.acquire(deadlines.Deadline(0.5))
+    assert limiter._next_slot == next_slot
+
+
+def test_rate_limit_scope_leaves_process_limits_alone():
+    import pytest
+
+    from mermaid_agent.main import parse_rate_limits
+
+    with rate_limit.scope({"test-provider": 600}):
+        start = time.monotonic()
+        rate_limit.acquire("test-provider")
+        rate_limit.acquire("test-provider")
+        assert time.monotonic() - start >= 0.1
+    # Outside the scope the provider is unlimited again
+    start = time.monotonic()
+    for _ in range(3):
+        rate_limit.acquire("test-provider")
+    assert time.monotonic() - start < 0.05
+
+    assert parse_rate_limits(["gpt-4o=60", "mermaid.ink=30.5"]) == {
+        "gpt-4o": 60.0,
+        "mermaid.ink": 30.5,
+    }
+    for bad in ["60", "gpt-4o=fast", "gpt-4o=0", "gpt-4o=-5"]:
+        with pytest.raises(Exception, match="PROVIDER=REQUESTS_PER_MINUTE"):
+            parse_rate_limits([bad])
+
+
+def test_one_shot_streaming_renders_before_the_stream_ends(monkeypatch, tmp_path):
+    from mermaid_agent.modules import mermaid
+    from mermaid_agent.modules.typings import OneShotMermaidParams
+
+    events = []
+    image = RenderedImage(content=b"\x89PNG\r\n\x1a\n", format="png")
+
+    # Mock model streaming a fenced chart followed by trailing prose
+    class MockModel:
+        model_id = "mock-model"
+
+        def prompt(self, prompt, stream=False, **options):
+            assert stream
+            yield "```mermaid\ngraph LR\n"
+            yield "  A --> B\n```"
+            time.sleep(0.05)
+            events.append("stream end")
+            yield "\nThat's the chart."
+
+    def mock_render(graph, options, name=""):
+        events.append(f"render {graph!r}")
+        return image
+
+    monkeypatch.setattr(mermaid_agent, "build_model", lambda model_id: MockModel())
+    monkeypatch.setattr(mermaid, "render_image", mock_render)
+    monkeypatch.setattr(mermaid_agent, "build_file_path", lambda n: str(tmp_path / n))
+    monkeypatch.setenv("MERMAID_ARTIFACTS", "off")
+
+    response = mermaid_agent.one_shot_mermaid_agent(
+        OneShotMermaidParams(prompt="Flowchart", output_file="chart.png", stream=True)
+    )
+
+    assert response.mermaid == "graph LR\n  A --> B"
+    assert response.img is image
+    # Only the final step's block is rendered, once, while it is still streaming
+    assert events == ["stream end", "render 'graph LR\\n  A --> B'", "stream end"]
+    assert (tmp_path / "chart.png").read_bytes() == image.content
+
+
+def fail_render(graph, options, name=""):
+    from mermaid_agent.modules import mermaid
+
+    raise mermaid.MermaidRenderError(f"mermaid.ink returned 400 for {graph!r}")
+
+
+def test_one_shot_traces_resolution_attempts(monkeypatch):
+    from mermaid_agent.modules import mermaid, tracing
+    from mermaid_agent.modules.tracing import InMemorySpanSink
+    from mermaid_agent.modules.typings import OneShotMermaidParams
+
+    class MockModel:
+        model_id = "mock-model"
+
+        def prompt(self, prompt, **options):
+            raise AssertionError("prompt_callable is mocked")
+
+    # Every chart renders as None, so both resolution attempts run
+    monkeypatch.setattr(mermaid_agent, "build_model", lambda model_id: MockModel())
+    monkeypatch.setattr(
+        mermaid_agent.llm_module,
+        "prompt_callable",
+        lambda use_cache, stream=False: lambda model, prompt: "graph LR\n  A --> B",
+    )
+    monkeypatch.setattr(mermaid, "mm", lambda graph, filename, options=None: None)
+    monkeypatch.setattr(mermaid, "render_image", fail_render)
+    monkeypatch.setenv("MERMAID_ARTIFACTS", "off")
+
+    sink = InMemorySpanSink()
+    tracing.set_span_sinks([sink])
+    try:
+        mermaid_agent.one_shot_mermaid_agent(
+            OneShotMermaidParams(prompt="Flowchart", output_file="chart.png")
+        )
+    finally:
+        tracing.set_span_sinks(None)
+
+    (root,) = sink.find("one_shot_mermaid_agent")
+    resolutions = sink.find("resolution")
+    assert [span.attributes["attempt"] for span in resolutions] == [2, 3]
+    assert all(span.parent_id == root.span_id for span in resolutions)
+    assert all(not span.attributes["resolved"] for span in resolutions)
+    # LLM calls made while resolving carry the resolution attempt
+    attempts = [span.attributes["attempt"] for span in sink.find("llm_call")]
+    assert attempts == [1, 1, 2, 3]
+    assert all(span.trace_id == root.trace_id for span in sink.spans)
+
+
+def mock_resolution(monkeypatch, tmp_path, fix):
+    """
+    Mocks a one shot run whose first chart fails to render: fix(damaged,
+    model_id, options) answers resolution prompts, and only charts containing
+    "fixed" render.
+    Returns the resolution prompts seen.
+    """
+    from mermaid_agent.modules import mermaid
+
+    class MockModel:
+        def __init__(self, model_id):
+            self.model_id = model_id or "mock-model"
+
+    prompts = []
+
+    def mock_prompt(model, prompt, **options):
+        if "<damaged-mermaid-chart>" not in prompt:
+            return "graph LR\n    A --> broken0"
+        prompts.append(prompt)
+        damaged = prompt.split("<damaged-mermaid-chart>\n")[1].split("\n</damaged")[0]
+        return fix(damaged, model.model_id, options)
+
+    def mock_render(graph, options, name=""):
+        if "fixed" not in graph:
+            fail_render(graph, options)
+        return RenderedImage(
+            content=b"\x89PNG\r\n\x1a\n" + graph.encode(), format="png"
+        )
+
+    monkeypatch.setattr(mermaid_agent, "build_model", MockModel)
+    monkeypatch.setattr(
+        mermaid_agent.llm_module,
+        "prompt_callable",
+        lambda use_cache, stream=False: mock_prompt,
+    )
+    monkeypatch.setattr(mermaid, "mm", lambda graph, filename, options=None: None)
+    monkeypatch.setattr(mermaid, "render_image", mock_render)
+    monkeypatch.setattr(mermaid_agent, "build_file_path", lambda n: str(tmp_path / n))
+    monkeypatch.setenv("MERMAID_ARTIFACTS", "off")
+    return prompts
+
+
+def test_resolution_retries_build_on_the_previous_attempt(monkeypatch, tmp_path):
+    from mermaid_agent.modules.typings import OneShotMermaidParams
+
+    # broken0 -> broken1 -> fixed2
+    def fix(damaged, model_id, options):
+        version = int(damaged[-1]) + 1
+        return f"graph LR\n    A --> {'fixed' if version == 2 else 'broken'}{version}"
+
+    prompts = mock_resolution(monkeypatch, tmp_path, fix)
+    response = mermaid_agent.one_shot_mermaid_agent(
+        OneShotMermaidParams(prompt="Flowchart", output_file="chart.png")
+    )
+
+    assert response.mermaid == "graph LR\n    A --> fixed2"
+    assert (tmp_path / "chart.png").read_bytes() == response.img.content
+    # The second round fixes the first round's chart and render error
+    assert (
+        "A --> broken1" in prompts[1] and "'graph LR\\n    A --> broken1'" in prompts[1]
+    )
+
+
+def test_render_error_reaches_the_resolution_agent(monkeypatch, tmp_path):
+    from mermaid_agent.modules.typings import OneShotMermaidParams
+
+    mock_resolution(
+        monkeypatch, tmp_path, lambda damaged, model_id, options: "graph LR\n  fixed"
+    )
+    errors = []
+    fix_mermaid_chart = mermaid_agent.fix_mermaid_chart
+
+    def record_error(params, cancel_event=None):
+        errors.append(params.error)
+        return fix_mermaid_chart(params, cancel_event)
+
+    monkeypatch.setattr(mermaid_agent, "fix_mermaid_chart", record_error)
+    mermaid_agent.one_shot_mermaid_agent(
+        OneShotMermaidParams(prompt="Flowchart", output_file="chart.png")
+    )
+
+    assert errors == [
+        "mermaid.ink returned 400 for " + repr("graph LR\n    A --> broken0")
+    ]
+
+
+def test_speculative_resolution_takes_the_first_fix_that_renders(monkeypatch, tmp_path):
+    from mermaid_agent.modules.typings import OneShotMermaidParams, ResolutionOptions
+
+    seen = []
+
+    # Slower temperatures answer later; only the second candidate's fix renders
+    def fix(damaged, model_id, options):
+        seen.append((model_id, options["temperature"]))
+        time.sleep(options["temperature"])
+        if options["temperature"] == 0.1:
+            return "graph LR\n    A --> broken1"
+        return f"graph LR\n    A --> fixed{options['temperature']}"
+
+    mock_resolution(monkeypatch, tmp_path, fix)
+    start = time.monotonic()
+    response = mermaid_agent.one_shot_mermaid_agent(
+        OneShotMermaidParams(
+            prompt="Flowchart",
+            output_file="chart.png",
+            resolution=ResolutionOptions(
+                fanout=3, models=["a", "b"], temperatures=[0.1, 0.2, 1.0]
+            ),
+        )
+    )
+    elapsed = time.monotonic() - start
+
+    assert response.mermaid == "graph LR\n    A --> fixed0.2"
+    assert elapsed < 0.8
+    assert sorted(seen) == [("a", 0.1), ("a", 1.0), ("b", 0.2)]
+
+
+def test_resolution_stops_at_its_deadline(monkeypatch, tmp_path):
+    from mermaid_agent.modules.typings import OneShotMermaidParams, ResolutionOptions
+
+    def fix(damaged, model_id, options):
+        time.sleep(0.5)
+        return "graph LR\n    A --> fixed"
+
+    prompts = mock_resolution(monkeypatch, tmp_path, fix)
+    start = time.monotonic()
+    response = mermaid_agent.one_shot_mermaid_agent(
+        OneShotMermaidParams(
+            prompt="Flowchart",
+            output_file="chart.png",
+            resolution=ResolutionOptions(attempts=3, deadline=0.1),
+        )
+    )
+
+    assert time.monotonic() - start < 0.4
+    assert response.img is None and response.mermaid == "graph LR\n    A --> broken0"
+    assert len(prompts) == 1
+
+
+def test_iterate_edit_mode_applies_patch_locally(monkeypatch):
+    from mermaid_agent.modules import mermaid
+    from mermaid_agent.modules.typings import IterateMermaidParams
+
+    prompts = []
+
+    class MockModel:
+        model_id = "mock-model"
+
+        def prompt(self, prompt, **options):
+            raise AssertionError("llm_module.prompt is mocked")
+
+    def mock_prompt(model, prompt):
+        prompts.append(prompt)
+        if "<operations>" in prompt:
+            return '{"operations": [{"op": "add_node", "id": "C", "label": "Ship it"}, {"op": "add_edge", "source": "B", "target": "C"}]}'
+        return "graph LR\n    A --> B --> C"
+
+    image = RenderedImage(content=b"\x89PNG\r\n\x1a\n", format="png")
+    monkeypatch.setattr(mermaid_agent, "build_model", lambda model_id: MockModel())
+    monkeypatch.setattr(mermaid_agent.llm_module, "prompt", mock_prompt)
+    monkeypatch.setattr(mermaid, "mm", lambda graph, filename, options=None: image)
+    monkeypatch.setenv("MERMAID_ARTIFACTS", "off")
+
+    params = IterateMermaidParams(
+        change_prompt="Add a ship step",
+        base_prompt="Release flow",
+        current_mermaid_chart='graph LR\n    A["Build"] --> B["Test"]',
+        current_mermaid_img=image,
+        output_file="chart.png",
+        edit_mode=True,
+    )
+    response = mermaid_agent.iterate_mermaid_agent(params)
+
+    # One patch prompt instead of a draft and a review of the full chart
+    assert len(prompts) == 1
+    assert response.mermaid == (
+        "graph LR\n    A[Build]\n    B[Test]\n    C[Ship it]\n    A --> B\n    B --> C"
+    )
+    assert response.img is image
+
+    # Charts the IR cannot parse fall back to full regeneration
+    prompts.clear()
+    params.current_mermaid_chart = 'pie title Fruit\n    "Apples" : 40'
+    response = mermaid_agent.iterate_mermaid_agent(params)
+    assert len(prompts) == 2
+    assert response.mermaid == "graph LR\n    A --> B --> C"
+
+
+def test_one_shot_times_out_instead_of_waiting_on_a_slow_model(monkeypatch):
+    from mermaid_agent.modules import mermaid
+    from mermaid_agent.modules.typings import OneShotMermaidParams
+
+    renders = []
+
+    class SlowResponse:
+        def text(self):
+            time.sleep(0.5)
+            return "graph LR\n    A --> B"
+
+    class MockModel:
+        model_id = "mock-model"
+
+        def prompt(self, prompt, **options):
+            return SlowResponse()
+
+    monkeypatch.setattr(mermaid_agent, "build_model", lambda model_id: MockModel())
+    monkeypatch.setattr(
+        mermaid, "mm", lambda graph, filename, options=None: renders.append(graph)
+    )
+    monkeypatch.setenv("MERMAID_ARTIFACTS", "off")
+
+    start = time.monotonic()
+    response = mermaid_agent.one_shot_mermaid_agent(
+        OneShotMermaidParams(prompt="Flowchart", output_file="chart.png", timeout=0.1)
+    )
+
+    assert time.monotonic() - start < 0.3
+    assert response.timed_out and response.img is None and response.mermaid is None
+    assert response.error == "Request deadline exceeded during llm_call mock-model"
+    assert renders == []
+
+
+def test_bulk_timeout_covers_the_whole_batch(monkeypatch):
+    from mermaid_agent.modules import deadlines
+
+    def mock_one_shot(params):
+        # Each diagram takes 0.1s of the batch's 0.15s
+        time.sleep(0.1)
+        deadlines.current().check("prompt step 0")
+        return MermaidAgentResponse(img=None, mermaid="graph LR; A --> B")
+
+    monkeypatch.setattr(
+        mermaid_agent,
+        "one_shot_mermaid_agent",
+        mermaid_agent.with_timeout(mock_one_shot),
+    )
+
+    response = mermaid_agent.bulk_mermaid_agent(
+        BulkMermaidParams(
+            prompt="Flowchart",
+            output_file="chart.png",
+            count=3,
+            concurrency=1,
+            timeout=0.15,
+        )
+    )
+
+    assert [res.timed_out for res in response.responses] == [False, True, True]
+    assert response.responses[0].mermaid == "graph LR; A --> B"
@@ -0,0 +1,123 @@
+import pytest
+
+from mermaid_agent import examples
+from mermaid_agent.modules import mermaid_graph
+from mermaid_agent.modules.mermaid_validator import validate
+from mermaid_agent.modules.typings import MermaidPatch
+
+FLOWCHART = """flowchart TD
+    %% a comment
+    A["Start (here)"] --> B{Is it?}
+    B -->|Yes| C([Stadium]) & D[(Database)]
+    B -- No --> E((Circle)):::highlight
+    subgraph one [Group]
+        F[/Parallel/] --> G{{Hex}}
+    end
+    classDef highlight fill:#f96
+    style E fill:#f9f
+    linkStyle 3 stroke:#f00"""
+
+
+def patch(*operations):
+    return MermaidPatch.model_validate({"operations": list(operations)})
+
+
+def test_parse_flowchart():
+    graph = mermaid_graph.parse(FLOWCHART)
+
+    assert graph.header == "flowchart" and graph.direction == "TD"
+    assert graph.nodes["A"].label == "Start (here)"
+    assert graph.nodes["B"].shape == "{}"
+    assert graph.nodes["E"].classes == ["highlight"]
+    assert [(e.source, e.target, e.label) for e in graph.edges] == [
+        ("A", "B", None),
+        ("B", "C", "Yes"),
+        ("B", "D", "Yes"),
+        ("B", "E", "No"),
+        ("F", "G", None),
+    ]
+    assert graph.subgraphs["one"].title == "Group"
+    assert graph.subgraphs["one"].members == ["F", "G"]
+    assert len(graph.styles) == 3
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        FLOWCHART,
+        examples.graph,
+        "graph LR\n    A o--o B\n    B x--x C\n    C <--> D\n    D o-- both --o A",
+    ],
+)
+def test_serialize_round_trips_and_validates(text):
+    compact = mermaid_graph.serialize(mermaid_graph.parse(text))
+
+    assert validate(compact).valid
+    assert mermaid_graph.parse(compact) == mermaid_graph.parse(text)
+    assert mermaid_graph.serialize(mermaid_graph.parse(compact)) == compact
+
+
+def test_serialize_declares_labels_once():
+    text = "graph LR\n" + "\n".join(
+        f'    N{i}["Check step {i} output"] --> N{i + 1}["Check step {i + 1} output"]'
+        for i in range(50)
+    )
+    compact = mermaid_graph.serialize(mermaid_graph.parse(text))
+
+    assert compact.count("step 1 output") == 1
+    assert len(compact) < len(text) * 0.75
+
+
+@pytest.mark.parametrize(
+    "text",
+    [examples.pie_chart, "graph LR\n    A --> ", "graph LR\n    A@{ shape: rect }"],
+)
+def test_parse_rejects_unsupported_charts(text):
+    with pytest.raises(mermaid_graph.MermaidGraphError):
+        mermaid_graph.parse(text)
+
+
+def test_apply_patch_operations():
+    graph = mermaid_graph.parse(FLOWCHART)
+    patched = mermaid_graph.apply_patch(
+        graph,
+        patch(
+            {"op": "add_node", "id": "H", "label": "Retry?", "shape": "{}"},
+            {"op": "add_edge", "source": "E", "target": "H", "label": "fail"},
+            {"op": "rename_node", "id": "E", "new_id": "Done", "label": "Done"},
+            {"op": "remove_node", "id": "C"},
+            {"op": "add_subgraph", "id": "two", "label": "Storage", "nodes": ["D"]},
+        ),
+    )
+
+    # The input graph is not modified
+    assert "H" not in graph.nodes
+    assert list(patched.nodes) == ["A", "B", "D", "Done", "F", "G", "H"]
+    assert patched.nodes["Done"].classes == ["highlight"]
+    assert [(e.source, e.target) for e in patched.edges] == [
+        ("A", "B"),
+        ("B", "D"),
+        ("B", "Done"),
+        ("F", "G"),
+        ("Done", "H"),
+    ]
+    assert patched.subgraphs["two"].members == ["D"]
+    # References follow the rename and linkStyle indexes the removed edge
+    assert "style Done fill:#f9f" in patched.styles
+    assert "linkStyle 2 stroke:#f00" in patched.styles
+    assert validate(mermaid_graph.serialize(patched)).valid
+
+
+def test_apply_patch_reports_failing_operation():
+    graph = mermaid_graph.parse(FLOWCHART)
+    with pytest.raises(mermaid_graph.MermaidPatchError) as error:
+        mermaid_graph.apply_patch(
+            graph,
+            patch(
+                {"op": "remove_edge", "source": "A", "target": "B"},
+                {"op": "add_edge", "source": "A", "target": "Z"},
+            ),
+        )
+
+    assert error.value.index == 1
+    assert str(error.value) == "Operation 2 (add_edge): no node or subgraph 'Z'"
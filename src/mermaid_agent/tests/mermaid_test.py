@@ -0,0 +1,401 @@
+import base64
+import io
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+from mermaid_agent.modules import mermaid
+from mermaid_agent.modules.render_cache import RenderCache, set_render_cache
+from mermaid_agent.modules.typings import OneShotMermaidParams, RenderOptions
+
+
+def build_png_bytes(size=(8, 8)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, "black").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+SVG_BYTES = b'<svg xmlns="http://www.w3.org/2000/svg"><text>A</text></svg>'
+PDF_BYTES = b"%PDF-1.7\n%%EOF\n"
+
+
+class FakeMermaidInkHandler(BaseHTTPRequestHandler):
+    # Local stand-in for mermaid.ink: renders a PNG unless the graph says "invalid"
+    requests_seen = []
+    # Number of 503 responses to send for graphs that say "flaky"
+    flaky_failures = 0
+
+    def do_GET(self):
+        endpoint, encoded = self.path.split("?", 1)[0].strip("/").split("/", 1)
+        graph = base64.b64decode(encoded).decode("utf8")
+        FakeMermaidInkHandler.requests_seen.append((graph, self.path))
+
+        if "slow" in graph:
+            time.sleep(0.5)
+
+        if "flaky" in graph and FakeMermaidInkHandler.flaky_failures > 0:
+            FakeMermaidInkHandler.flaky_failures -= 1
+            body = b"Service Unavailable"
+            self.send_response(503)
+            self.send_header("Content-Type", "text/plain")
+        elif "invalid" in graph:
+            body = b"Syntax error in graph"
+            self.send_response(400)
+            self.send_header("Content-Type", "text/plain")
+        elif endpoint == "svg":
+            body = SVG_BYTES
+            self.send_response(200)
+            self.send_header("Content-Type", "image/svg+xml")
+        elif endpoint == "pdf":
+            body = PDF_BYTES
+            self.send_response(200)
+            self.send_header("Content-Type", "application/pdf")
+        else:
+            body = build_png_bytes()
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def fake_mermaid_ink():
+    FakeMermaidInkHandler.requests_seen = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeMermaidInkHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def render_cache(tmp_path):
+    cache = RenderCache(max_memory_items=2, cache_dir=str(tmp_path / "render_cache"))
+    set_render_cache(cache)
+    yield cache
+    set_render_cache(None)
+
+
+@pytest.fixture
+def fake_worker_command(tmp_path):
+    # Speaks the mermaid_worker.mjs JSON-line protocol without node or a browser
+    script = tmp_path / "fake_worker.py"
+    script.write_text(f"""
+import base64, json, sys
+png = base64.b64decode({base64.b64encode(build_png_bytes()).decode()!r})
+for line in sys.stdin:
+    request = json.loads(line)
+    if "noisy" in request["graph"]:
+        print("warning: stray log line", flush=True)
+        continue
+    if "invalid" in request["graph"]:
+        response = {{"id": request["id"], "ok": False, "error": "Parse error on line 1"}}
+    else:
+        response = {{"id": request["id"], "ok": True, "data": base64.b64encode(png).decode()}}
+    print(json.dumps(response), flush=True)
+""")
+    return [sys.executable, str(script)]
+
+
+def test_mermaid_ink_renderer_against_local_stand_in(fake_mermaid_ink):
+    renderer = mermaid.MermaidInkRenderer(base_url=fake_mermaid_ink)
+
+    content = renderer.render("graph LR; A --> B", RenderOptions(theme="forest"))
+
+    assert Image.open(io.BytesIO(content)).format == "PNG"
+    graph, path = FakeMermaidInkHandler.requests_seen[-1]
+    assert graph == "graph LR; A --> B"
+    assert "theme=forest" in path and "bgColor=2a303c" in path
+
+    with pytest.raises(mermaid.MermaidRenderError):
+        renderer.render("invalid graph", RenderOptions())
+
+
+def test_mermaid_ink_renderer_retries_transient_errors(fake_mermaid_ink):
+    renderer = mermaid.MermaidInkRenderer(
+        base_url=fake_mermaid_ink, max_retries=2, backoff=0
+    )
+
+    FakeMermaidInkHandler.flaky_failures = 2
+    assert renderer.render("flaky graph", RenderOptions()) == build_png_bytes()
+    assert len(FakeMermaidInkHandler.requests_seen) == 3
+
+    # Client errors are not retried
+    with pytest.raises(mermaid.MermaidRenderError, match="400"):
+        renderer.render("invalid graph", RenderOptions())
+    assert len(FakeMermaidInkHandler.requests_seen) == 4
+
+    FakeMermaidInkHandler.flaky_failures = 3
+    with pytest.raises(mermaid.MermaidRenderError, match="503"):
+        renderer.render("flaky graph", RenderOptions())
+
+
+def test_mermaid_ink_renderer_honours_retry_after():
+    import requests
+
+    def error_response(status, retry_after):
+        response = requests.Response()
+        response.status_code = status
+        response.headers["Retry-After"] = retry_after
+        return response
+
+    renderer = mermaid.MermaidInkRenderer(read_timeout=10, backoff=0)
+
+    assert renderer._backoff_delay(0, error_response(429, "7")) == 7
+    assert renderer._backoff_delay(0, error_response(503, "2")) == 2
+    # Capped at the read timeout
+    assert renderer._backoff_delay(0, error_response(429, "120")) == 10
+    # Dates and missing headers fall back to the jittered backoff
+    assert renderer._backoff_delay(0, error_response(429, "Wed, 21 Oct")) == 0
+    assert renderer._backoff_delay(0) == 0
+
+
+def test_mermaid_ink_renderer_times_out(fake_mermaid_ink):
+    renderer = mermaid.MermaidInkRenderer(
+        base_url=fake_mermaid_ink, read_timeout=0.1, max_retries=0
+    )
+
+    with pytest.raises(mermaid.MermaidRenderError, match="request failed"):
+        renderer.render("slow graph", RenderOptions())
+
+
+def test_mermaid_ink_renderer_stops_at_the_request_deadline(fake_mermaid_ink):
+    from mermaid_agent.modules import deadlines
+
+    renderer = mermaid.MermaidInkRenderer(base_url=fake_mermaid_ink, backoff=10)
+
+    # The read timeout is cut to the time left, and no retry is waited for
+    start = time.monotonic()
+    with deadlines.start(0.1), pytest.raises(deadlines.DeadlineExceeded):
+        renderer.render("slow graph", RenderOptions())
+    assert time.monotonic() - start < 0.3
+    assert len(FakeMermaidInkHandler.requests_seen) == 1
+
+
+def test_build_image_uses_configured_renderer(fake_mermaid_ink, render_cache):
+    mermaid.set_renderer(mermaid.MermaidInkRenderer(base_url=fake_mermaid_ink))
+    try:
+        assert mermaid.build_image("graph LR; A --> B", "ok.png") is not None
+        assert mermaid.build_image("graph LR; A --> invalid", "bad.png") is None
+        assert len(FakeMermaidInkHandler.requests_seen) == 2
+
+        # Charts that fail local validation never reach the renderer
+        assert mermaid.build_image("graph LR; A[Start (here)]", "bad.png") is None
+        assert len(FakeMermaidInkHandler.requests_seen) == 2
+    finally:
+        mermaid.set_renderer(None)
+
+
+def test_mm_writes_rendered_bytes_without_decoding(
+    fake_mermaid_ink, render_cache, monkeypatch, tmp_path
+):
+    monkeypatch.setattr(mermaid, "build_file_path", lambda name: str(tmp_path / name))
+    mermaid.set_renderer(mermaid.MermaidInkRenderer(base_url=fake_mermaid_ink))
+    try:
+        img = mermaid.mm("graph LR; A --> B", "chart.png")
+    finally:
+        mermaid.set_renderer(None)
+
+    assert img.format == "png"
+    assert (tmp_path / "chart.png").read_bytes() == img.content == build_png_bytes()
+    assert img._image is None
+    assert img.image.size == (8, 8)
+
+    # A different extension is transcoded
+    img.save(str(tmp_path / "chart.jpg"))
+    assert Image.open(tmp_path / "chart.jpg").format == "JPEG"
+
+
+def test_render_options_negotiate_format_with_output_file():
+    options = RenderOptions()
+    assert options.for_file("chart.svg").format == "svg"
+    assert options.for_file("chart.jpg").format == "png"
+    assert options.for_file("chart").format == "png"
+
+    svg = RenderOptions(format="svg")
+    assert svg.for_file("chart.png") is svg
+    assert svg.output_file("chart.png") == "chart.svg"
+    assert svg.output_file("chart") == "chart.svg"
+    # png renders are transcoded to other raster extensions
+    assert RenderOptions(format="png").output_file("chart.jpg") == "chart.jpg"
+
+    params = OneShotMermaidParams(
+        prompt="Flowchart", output_file="chart.png", render_options=svg
+    )
+    assert params.output_file == "chart.svg"
+    params = OneShotMermaidParams(prompt="Flowchart", output_file="chart.pdf")
+    assert params.render_options.format == "pdf"
+
+
+@pytest.mark.parametrize(
+    "render_format, content", [("svg", SVG_BYTES), ("pdf", PDF_BYTES)]
+)
+def test_mm_writes_vector_renders_as_returned(
+    render_format, content, fake_mermaid_ink, render_cache, monkeypatch, tmp_path
+):
+    monkeypatch.setattr(mermaid, "build_file_path", lambda name: str(tmp_path / name))
+    mermaid.set_renderer(mermaid.MermaidInkRenderer(base_url=fake_mermaid_ink))
+    try:
+        img = mermaid.mm("graph LR; A --> B", f"chart.{render_format}")
+        # Explicit options are cached apart from the png render
+        options = RenderOptions(theme="forest", bg_color="ffffff")
+        themed = mermaid.build_image("graph LR; A --> B", "chart.png", options)
+    finally:
+        mermaid.set_renderer(None)
+
+    assert img.format == render_format
+    assert (tmp_path / f"chart.{render_format}").read_bytes() == content
+    assert themed.format == "png"
+    paths = [path for _, path in FakeMermaidInkHandler.requests_seen]
+    assert paths[0].startswith(f"/{render_format}/")
+    assert paths[1].startswith("/img/") and "theme=forest&bgColor=ffffff" in paths[1]
+
+    with pytest.raises(ValueError):
+        img.save(str(tmp_path / "chart.png"))
+
+
+def test_mermaid_cli_renderer_reuses_worker_process(fake_worker_command):
+    renderer = mermaid.MermaidCliRenderer(command=fake_worker_command)
+    try:
+        first = renderer.render("graph LR; A --> B", RenderOptions())
+        process = renderer._process
+        second = renderer.render("graph LR; B --> C", RenderOptions())
+
+        assert first == second == build_png_bytes()
+        assert renderer._process is process
+
+        with pytest.raises(mermaid.MermaidRenderError, match="Parse error"):
+            renderer.render("invalid graph", RenderOptions())
+    finally:
+        renderer.close()
+
+
+def test_mermaid_cli_renderer_restarts_worker_after_invalid_response(
+    fake_worker_command,
+):
+    renderer = mermaid.MermaidCliRenderer(command=fake_worker_command)
+    try:
+        renderer.render("graph LR; A --> B", RenderOptions())
+        process = renderer._process
+
+        with pytest.raises(mermaid.MermaidRenderError, match="stray log line"):
+            renderer.render("noisy graph", RenderOptions())
+
+        assert renderer.render("graph LR; A --> B", RenderOptions()) == (
+            build_png_bytes()
+        )
+        assert renderer._process is not process
+    finally:
+        renderer.close()
+
+
+def test_render_many_renders_concurrently_and_deduplicates(
+    fake_mermaid_ink, render_cache
+):
+    sources = [
+        "graph LR; slow1 --> B",
+        "graph LR; slow2 --> B",
+        "graph LR; slow1 --> B",
+        "graph LR; A --> invalid",
+        "graph LR; A[Start (here)]",
+    ]
+    mermaid.set_renderer(mermaid.MermaidInkRenderer(base_url=fake_mermaid_ink))
+    try:
+        response = mermaid.render_many(sources, RenderOptions(format="svg"))
+    finally:
+        mermaid.set_renderer(None)
+
+    results = response.results
+    assert [result.error is None for result in results] == [1, 1, 1, 0, 0]
+    assert [result.duplicate for result in results] == [0, 0, 1, 0, 0]
+    assert results[2].img is results[0].img and results[0].img.format == "svg"
+    assert "400" in results[3].error and "syntax error" in results[4].error
+    # The duplicate is not rendered again and the two slow renders overlap
+    assert len(FakeMermaidInkHandler.requests_seen) == 3
+    assert results[0].seconds >= 0.5 and response.seconds < 1.0
+
+
+def test_renderer_pool_spreads_renders_over_workers(fake_worker_command, render_cache):
+    pool = mermaid.MermaidRendererPool(
+        [mermaid.MermaidCliRenderer(command=fake_worker_command) for _ in range(2)]
+    )
+    mermaid.set_renderer(pool)
+    try:
+        assert pool.max_concurrency == 2
+        response = mermaid.render_many(
+            [f"graph LR; A --> N{n}" for n in range(6)], max_workers=2
+        )
+        processes = [renderer._process for renderer in pool.renderers]
+    finally:
+        mermaid.set_renderer(None)
+
+    assert all(result.img.content == build_png_bytes() for result in response.results)
+    assert all(process is not None for process in processes)
+
+
+def test_build_image_serves_repeat_renders_from_cache(fake_mermaid_ink, render_cache):
+    mermaid.set_renderer(mermaid.MermaidInkRenderer(base_url=fake_mermaid_ink))
+    try:
+        assert mermaid.build_image("graph LR; A --> B", "a.png") is not None
+        assert mermaid.build_image("graph LR; A --> B", "a.png") is not None
+        # Different options are a different cache entry
+        options = RenderOptions(theme="forest")
+        assert mermaid.build_image("graph LR; A --> B", "a.png", options) is not None
+        # Failed renders are not cached
+        assert mermaid.build_image("graph LR; A --> invalid", "bad.png") is None
+        assert mermaid.build_image("graph LR; A --> invalid", "bad.png") is None
+    finally:
+        mermaid.set_renderer(None)
+
+    assert len(FakeMermaidInkHandler.requests_seen) == 4
+    assert render_cache.stats()["memory_hits"] == 1
+    assert render_cache.stats()["misses"] == 4
+
+
+def test_render_cache_disk_tier_and_eviction(tmp_path):
+    cache_dir = str(tmp_path / "render_cache")
+    cache = RenderCache(max_memory_items=1, cache_dir=cache_dir, max_disk_bytes=250)
+    keys = [RenderCache.key(f"graph {n}", RenderOptions()) for n in range(3)]
+
+    cache.put(keys[0], b"0" * 100)
+    cache.put(keys[1], b"1" * 100)
+
+    # A fresh cache over the same directory is served from disk
+    reopened = RenderCache(max_memory_items=1, cache_dir=cache_dir, max_disk_bytes=250)
+    assert reopened.get(keys[0]) == b"0" * 100
+    assert reopened.get(keys[0]) == b"0" * 100
+    assert reopened.stats()["disk_hits"] == 1
+    assert reopened.stats()["memory_hits"] == 1
+
+    # Going over the disk budget evicts the least recently used entry
+    reopened.put(keys[2], b"2" * 100)
+    fresh = RenderCache(cache_dir=cache_dir)
+    assert fresh.get(keys[1]) is None
+    assert fresh.get(keys[2]) == b"2" * 100
+
+    # Rewriting an entry replaces its size rather than adding to it
+    fresh.put(keys[2], b"2" * 100)
+    fresh.put(keys[2], b"2" * 50)
+    assert fresh._disk_bytes == fresh._scan_disk_bytes()
+
+
+def test_render_cache_survives_unwritable_disk_tier(tmp_path, capsys):
+    # A file where the cache directory should be fails every disk write (ENOTDIR)
+    cache_dir = tmp_path / "render_cache"
+    cache_dir.write_text("not a directory")
+    cache = RenderCache(max_memory_items=1, cache_dir=str(cache_dir))
+    key = RenderCache.key("graph LR; A --> B", RenderOptions())
+
+    cache.put(key, b"content")
+
+    assert cache.get(key) == b"content"
+    assert "Failed to write render cache entry" in capsys.readouterr().out
@@ -0,0 +1,125 @@
+import pytest
+
+from mermaid_agent import examples
+from mermaid_agent.modules.mermaid_validator import format_errors, validate
+
+
+@pytest.mark.parametrize(
+    "graph",
+    [
+        examples.graph,
+        examples.pie_chart,
+        examples.sequence_diagram,
+        examples.gantt_chart,
+        examples.class_diagram,
+        examples.llm_pie,
+        """flowchart TD
+    %% a comment
+    A["Start (here)"] --> B{Is it?}
+    B -->|Yes| C([Stadium]) & D[(Database)]
+    B -- No --> E((Circle)):::highlight
+    subgraph one [Group]
+        F[/Parallel/] --> G{{Hex}}
+    end
+    classDef highlight fill:#f96
+    style A fill:#f9f""",
+        """sequenceDiagram
+    autonumber
+    participant A as Alice
+    actor B
+    A->>+B: Hello
+    alt is sick
+        B-->>A: Not so good
+    else is well
+        B-->>-A: Feeling fresh
+    end
+    par A to C
+        A-)C: Hi
+    and A to D
+        A-xD: Hi
+    end
+    Note over A,B: A typical interaction""",
+        """stateDiagram-v2
+    [*] --> Still
+    Still --> Moving : push
+    state Moving {
+        [*] --> Fast
+    }
+    note right of Still
+        Resting {idle}
+    end note
+    Moving --> [*]""",
+        """erDiagram
+    CUSTOMER ||--o{ ORDER : places
+    ORDER ||--|{ LINE-ITEM : contains
+    CUSTOMER {
+        string name PK
+        string email "login"
+    }""",
+        "graph LR; A-->B; B-->C[Done]",
+        """timeline
+    title History of Social Media Platforms
+    2002 : LinkedIn""",
+        "flowchart-elk TD\n    A --> B",
+        # Types this module does not know are left to the renderer
+        "architecture-beta\n    service db(database)[Database]",
+        """---
+title: Front matter
+---
+%%{init: {"theme": "dark"}}%%
+graph LR;
+    A --> B;""",
+    ],
+)
+def test_validate_accepts_valid_diagrams(graph):
+    result = validate(graph)
+    assert result.valid, format_errors(graph, result)
+
+
+@pytest.mark.parametrize(
+    "graph, line, column, message",
+    [
+        ("", 1, 1, "Empty diagram"),
+        ("graph XY\n  A --> B", 1, 7, "Unknown direction"),
+        ("graph LR\n  A[Start (here)] --> B", 2, 11, "wrap the label in double quotes"),
+        ("graph LR\n  A[Start --> B", 2, 4, "Unclosed node shape"),
+        ('graph LR\n  A["Start] --> B', 2, 5, "Unterminated string"),
+        ("graph LR\n  A -->\n  B --> C", 2, 5, "Expected a node after '-->'"),
+        ("graph LR; A --> B; B -->", 1, 22, "Expected a node after '-->'"),
+        ("graph LR\n  subgraph one\n  A --> B", 2, 1, "missing its 'end'"),
+        ("graph LR\n  A --> B\n  end", 3, 3, "without a matching 'subgraph'"),
+        ("sequenceDiagram\n  Alice says hi", 2, 3, "Unrecognized sequence statement"),
+        (
+            "sequenceDiagram\n  loop Every minute\n  A->>B: ping",
+            2,
+            1,
+            "missing its 'end'",
+        ),
+        ("sequenceDiagram\n  else nope", 2, 3, "outside of an 'alt' block"),
+        ("sequenceDiagram\n  Note A: hi", 2, 3, "Invalid note"),
+        ("classDiagram\n  class Duck{\n    +swim()", 2, 13, "Unclosed '{'"),
+        ("stateDiagram-v2\n  [*] -->", 2, 7, "Expected a state after '-->'"),
+        ('pie\n  "Apples" : forty', 2, 14, "must be a non-negative number"),
+        ("pie\n  Apples : 40", 2, 3, "Invalid pie slice"),
+        ("erDiagram\n  CUSTOMER --> ORDER : places", 2, 3, "Invalid relationship"),
+        ("erDiagram\n  CUSTOMER {\n    string name", 2, 1, "Unclosed '{'"),
+        ("gantt\n  section A\n  Design the thing", 3, 3, "missing ':'"),
+    ],
+)
+def test_validate_reports_error_position(graph, line, column, message):
+    result = validate(graph)
+
+    assert not result.valid
+    error = result.errors[0]
+    assert (error.line, error.column) == (line, column)
+    assert message in error.message
+
+
+def test_format_errors_points_at_column():
+    graph = "graph LR\n  A[Start (here)] --> B"
+
+    formatted = format_errors(graph, validate(graph))
+
+    assert formatted.startswith("Mermaid syntax error on line 2, column 11:")
+    assert formatted.endswith("  A[Start (here)] --> B\n              ^")
+    assert format_errors("graph LR\n  A --> B", validate("graph LR\n  A --> B")) is None
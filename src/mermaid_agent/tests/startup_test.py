@@ -0,0 +1,40 @@
+import os
+
+from mermaid_agent.modules import startup
+
+# main --help imported ~630 ms of modules before agents, llm, PIL and the
+# renderer were made lazy, about 7x a bare "import typer"; it now takes ~2.5x.
+# The budget is relative to typer's import time on the same machine so slow CI
+# runners and coverage don't make it flaky; MERMAID_STARTUP_BUDGET_SECONDS
+# replaces it with a fixed budget.
+HELP_IMPORT_BUDGET_MULTIPLE = 5
+
+
+def test_help_skips_lazy_dependencies():
+    times = startup.import_times(startup.HELP_STARTUP)
+
+    packages = startup.package_seconds(times)
+    assert not set(packages) & set(startup.LAZY_DEPENDENCIES)
+
+
+def test_help_stays_within_import_budget():
+    budget = os.getenv("MERMAID_STARTUP_BUDGET_SECONDS")
+    if budget:
+        budget = float(budget)
+    else:
+        typer_seconds = startup.total_seconds(startup.import_times("import typer"))
+        budget = HELP_IMPORT_BUDGET_MULTIPLE * typer_seconds
+
+    times = startup.import_times(startup.HELP_STARTUP)
+
+    assert startup.total_seconds(times) < budget
+
+
+def test_import_times_parses_nested_modules():
+    times = startup.import_times("import json")
+
+    (json_time,) = [time for time in times if time.module == "json"]
+    decoder = next(time for time in times if time.module == "json.decoder")
+    assert decoder.depth > json_time.depth
+    assert json_time.cumulative_seconds >= decoder.cumulative_seconds
+    assert startup.package_seconds(times)["json"] > 0
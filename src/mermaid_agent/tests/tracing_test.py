@@ -0,0 +1,160 @@
+import json
+
+import pytest
+
+from mermaid_agent.modules import tracing
+from mermaid_agent.modules.chain import FusionChain, MinimalChainable
+from mermaid_agent.modules.tracing import (
+    InMemorySpanSink,
+    JsonlSpanSink,
+    OpenTelemetrySpanSink,
+)
+
+
+@pytest.fixture
+def span_sink():
+    sink = InMemorySpanSink()
+    tracing.set_span_sinks([sink])
+    yield sink
+    tracing.set_span_sinks(None)
+
+
+class MockModel:
+    def __init__(self, model_id):
+        self.model_id = model_id
+
+
+def mock_callable_prompt(model, prompt):
+    if "JSON" in prompt:
+        return '```json\n{"key": "value"}\n```'
+    return f"{model.model_id}: {prompt}"
+
+
+def test_chain_steps_record_fill_llm_and_parse_spans(span_sink):
+    MinimalChainable.run(
+        {"topic": "JSON"},
+        MockModel("mock-model"),
+        mock_callable_prompt,
+        ["Output {{topic}}", "Echo {{output[-1].key}}"],
+    )
+
+    steps = span_sink.find("chain_step")
+    assert [span.attributes["step"] for span in steps] == [0, 1]
+    for name in ("template_fill", "llm_call", "json_parse"):
+        spans = span_sink.find(name)
+        assert [span.parent_id for span in spans] == [s.span_id for s in steps]
+        assert all(span.attributes["model_id"] == "mock-model" for span in spans)
+        assert all(span.attributes["attempt"] == 1 for span in spans)
+
+    llm_calls = span_sink.find("llm_call")
+    assert [span.attributes["prompt_chars"] for span in llm_calls] == [11, 10]
+    assert [span.attributes["response_chars"] for span in llm_calls] == [
+        len('```json\n{"key": "value"}\n```'),
+        len("mock-model: Echo value"),
+    ]
+    parses = span_sink.find("json_parse")
+    assert [span.attributes["parsed_json"] for span in parses] == [True, False]
+
+
+def test_spans_nest_across_worker_threads(span_sink):
+    models = [MockModel("model-a"), MockModel("model-b")]
+
+    with tracing.span("fusion", attempt=2) as root:
+        FusionChain.run_parallel(
+            {},
+            models,
+            mock_callable_prompt,
+            ["Hello"],
+            lambda outputs: (outputs[0], [1.0 for _ in outputs]),
+            lambda model: model.model_id,
+        )
+
+    steps = span_sink.find("chain_step")
+    assert {span.attributes["model_id"] for span in steps} == {"model-a", "model-b"}
+    assert all(span.parent_id == root.span_id for span in steps)
+    assert all(span.trace_id == root.trace_id for span in span_sink.spans)
+    assert all(span.attributes["attempt"] == 2 for span in span_sink.spans)
+
+
+def test_span_records_errors(span_sink):
+    with pytest.raises(ValueError):
+        with tracing.span("render"):
+            raise ValueError("boom")
+
+    assert span_sink.spans[0].error == "ValueError: boom"
+
+
+def test_spans_are_not_recorded_without_sinks():
+    tracing.set_span_sinks([])
+    try:
+        with tracing.span("render") as span:
+            span.set(graph_chars=1)
+    finally:
+        tracing.set_span_sinks(None)
+
+    assert span is tracing._noop_span
+
+
+def test_jsonl_span_sink(tmp_path):
+    path = tmp_path / "traces" / "spans.jsonl"
+    sink = JsonlSpanSink(str(path))
+    tracing.set_span_sinks([sink])
+    try:
+        with tracing.span("one_shot_mermaid_agent"):
+            with tracing.span("render", graph_chars=42):
+                pass
+    finally:
+        tracing.set_span_sinks(None)
+        sink.close()
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [record["name"] for record in records] == [
+        "render",
+        "one_shot_mermaid_agent",
+    ]
+    assert records[0]["parent_id"] == records[1]["span_id"]
+    assert records[0]["attributes"] == {"graph_chars": 42, "attempt": 1}
+
+
+def test_opentelemetry_span_sink_re_emits_spans():
+    pytest.importorskip("opentelemetry")
+
+    class MockOtelSpan:
+        def __init__(self, name, start_time, attributes):
+            self.name = name
+            self.start_time = start_time
+            self.attributes = attributes
+            self.status = None
+            self.end_time = None
+
+        def set_status(self, status):
+            self.status = status
+
+        def end(self, end_time):
+            self.end_time = end_time
+
+    class MockTracer:
+        def __init__(self):
+            self.spans = []
+
+        def start_span(self, name, start_time, attributes):
+            span = MockOtelSpan(name, start_time, attributes)
+            self.spans.append(span)
+            return span
+
+    tracer = MockTracer()
+    tracing.set_span_sinks([OpenTelemetrySpanSink(tracer)])
+    try:
+        with pytest.raises(RuntimeError):
+            with tracing.span("llm_call", model_id="mock-model", options={"a": 1}):
+                raise RuntimeError("timeout")
+    finally:
+        tracing.set_span_sinks(None)
+
+    (span,) = tracer.spans
+    assert span.name == "llm_call"
+    assert span.attributes["model_id"] == "mock-model"
+    assert span.attributes["options"] == "{'a': 1}"
+    assert "mermaid_agent.span_id" in span.attributes
+    assert span.end_time >= span.start_time
+    assert span.status.description == "RuntimeError: timeout"